@@ -0,0 +1,128 @@
+"""Snapping lyric times to the pauses in the narration.
+
+Lyric times from the chunk timeline (see ``lyrics.ChunkTimeline``) are
+measured at chunk boundaries but estimated inside a chunk. This pass has
+ffmpeg decode the finished audio to low-rate mono PCM, reads it a block at
+a time, and computes a short-time RMS envelope with NumPy to find the
+pauses: runs of frames well below the speech level of their block. A line
+starts where speech resumes after a pause, so each line is moved to the end
+of the nearest pause within ``max_shift`` seconds.
+
+Memory is bounded by the block size, not the length of the book: only the
+pause list (about one entry per sentence) is kept.
+"""
+import subprocess
+import tempfile
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+from django.conf import settings
+
+SAMPLE_RATE = 8000  # plenty to tell speech from silence
+FRAME_SECONDS = 0.02
+BLOCK_SECONDS = 30
+# A frame is quiet below this fraction (-26 dB) of its block's speech level, the 90th percentile frame RMS,
+# and always below the floor (-60 dBFS)
+QUIET_RATIO = 0.05
+QUIET_FLOOR = 0.001
+MIN_PAUSE_SECONDS = 0.15
+
+def decode_pcm(path, sample_rate=SAMPLE_RATE, block_seconds=BLOCK_SECONDS):
+    """Yield the audio at ``path`` as float32 mono blocks in [-1, 1], decoded by ffmpeg as they are read.
+
+    ffmpeg's messages go to a temporary file rather than a pipe: a corrupt
+    file can make it report an error per frame, which would fill a pipe
+    nobody reads until the audio is done and stall the decoder.
+    """
+    from imageio_ffmpeg import get_ffmpeg_exe
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(
+            [get_ffmpeg_exe(), '-loglevel', 'error', '-i', path, '-ac', '1', '-ar', str(sample_rate),
+             '-f', 's16le', 'pipe:1'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=errors,
+        )
+        block_bytes = int(block_seconds * sample_rate) * 2
+        try:
+            while data := process.stdout.read(block_bytes):
+                yield np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+            if process.wait() != 0:
+                errors.seek(max(errors.tell() - 2000, 0))
+                message = errors.read().decode(errors='replace').strip()
+                raise RuntimeError(f"ffmpeg could not decode {path}: {message}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+def rms_envelope(blocks, frame_samples):
+    """Yield the RMS of consecutive ``frame_samples``-sample frames, one array per block of samples."""
+    rest = np.empty(0, dtype=np.float32)
+    for block in blocks:
+        if rest.size:
+            block = np.concatenate((rest, block))
+        usable = block.size - block.size % frame_samples
+        rest = block[usable:]
+        frames = block[:usable].reshape(-1, frame_samples)
+        yield np.sqrt(np.einsum('ij,ij->i', frames, frames) / frame_samples)
+
+def find_pauses(envelopes, frame_seconds=FRAME_SECONDS, min_pause=MIN_PAUSE_SECONDS,
+                quiet_ratio=QUIET_RATIO, floor=QUIET_FLOOR):
+    """Yield ``(start, end)`` in seconds (to the millisecond) for each run of quiet frames at least ``min_pause`` long.
+
+    ``envelopes`` are consecutive arrays of frame RMS; a run may continue
+    from one array into the next.
+    """
+    min_frames = min_pause / frame_seconds
+    offset = 0
+    open_run = None  # frame where a quiet run still going at the end of the last array began
+    for rms in envelopes:
+        if not rms.size:
+            continue
+        threshold = max(floor, quiet_ratio * float(np.percentile(rms, 90)))
+        quiet = (rms < threshold).astype(np.int8)
+        # +1 where a quiet run starts, -1 where one has just ended
+        edges = np.diff(quiet, prepend=np.int8(open_run is not None))
+        starts = offset + np.flatnonzero(edges == 1)
+        ends = offset + np.flatnonzero(edges == -1)
+        if open_run is not None:
+            starts = np.concatenate(([open_run], starts))
+        open_run = int(starts[-1]) if len(starts) > len(ends) else None
+        starts = starts[:len(ends)]
+        long_enough = ends - starts >= min_frames
+        for start, end in zip(starts[long_enough], ends[long_enough]):
+            yield round(int(start) * frame_seconds, 3), round(int(end) * frame_seconds, 3)
+        offset += rms.size
+    if open_run is not None and offset - open_run >= min_frames:
+        yield round(open_run * frame_seconds, 3), round(offset * frame_seconds, 3)
+
+def snap_lyrics(lyrics, pauses, max_shift):
+    """Move each line to the end of the nearest pause within ``max_shift`` seconds of its time.
+
+    Lines keep their order and never share a pause; a line with no pause in
+    reach keeps its time.
+    """
+    ends = [end for _, end in pauses]
+    snapped = []
+    previous, used = float('-inf'), -1
+    for line in lyrics:
+        time = line['time']
+        lo = max(bisect_left(ends, time - max_shift), used + 1)
+        hi = bisect_right(ends, time + max_shift)
+        nearest = bisect_left(ends, time, lo, hi)
+        candidates = [i for i in (nearest - 1, nearest) if lo <= i < hi and ends[i] > previous]
+        if candidates:
+            used = min(candidates, key=lambda i: abs(ends[i] - time))
+            time = ends[used]
+        time = max(time, previous)
+        snapped.append({'time': round(time, 2), 'text': line['text']})
+        previous = time
+    return snapped
+
+def align_lyrics(path, lyrics, max_shift=None):
+    """Return ``(lyrics, pause_count)`` with ``lyrics`` snapped to the pauses in the audio at ``path``."""
+    if max_shift is None:
+        max_shift = getattr(settings, 'EBOOK_LYRICS_ALIGN_MAX_SHIFT', 1.5)
+    envelopes = rms_envelope(decode_pcm(path), round(SAMPLE_RATE * FRAME_SECONDS))
+    pauses = list(find_pauses(envelopes))
+    return snap_lyrics(lyrics, pauses, max_shift), len(pauses)
@@ -0,0 +1,595 @@
+"""Benchmarks for the conversion pipeline, run with ``manage.py benchmark``."""
+import asyncio
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.files import File
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Q
+from django.test import AsyncClient, Client, RequestFactory, override_settings
+
+from . import events
+from .tts import FakeBackend
+from .utils import (clean_text_for_tts, extract_pdf_pages, in_page_order, iter_clean_text, iter_pdf_pages,
+                    iter_text_chunks, synthesize_chunks)
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog while narrator reads another "
+    "chapter about river mountain village harbour evening morning journey "
+    "letter window garden stranger promise silence winter summer story"
+).split()
+
+def sample_text(sentences, seed=0):
+    """Deterministic English-like text made of ``sentences`` sentences."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 18))]
+        out.append(" ".join(words).capitalize() + ".")
+    return " ".join(out)
+
+def make_sample_pdf(path, pages=500, lines_per_page=40, seed=0):
+    """Write a text-only PDF with ``pages`` pages of generated prose."""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for _ in range(pages):
+        lines = []
+        for _ in range(lines_per_page):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(6, 12))]
+            lines.append(" ".join(words).capitalize() + ".")
+        stream = "BT /F1 10 Tf 14 TL 50 780 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = stream.encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return path
+
+def legacy_clean_text_for_tts(text):
+    """The original eight-pass cleaner, kept as the reference for clean_text_for_tts."""
+    # Remove excessive whitespace
+    text = re.sub(r'\s+', ' ', text)
+    
+    # Fix common PDF extraction issues
+    text = re.sub(r'([a-z])([A-Z])', r'\1. \2', text)  # Add periods between sentences
+    text = re.sub(r'(\d)([A-Za-z])', r'\1. \2', text)  # Number to text
+    text = re.sub(r'([A-Za-z])(\d)', r'\1. \2', text)  # Text to number
+    
+    # Remove special characters that TTS struggles with
+    text = re.sub(r'[^\w\s\.,!?;:\-\n]', '', text)
+    
+    # Fix line breaks
+    text = re.sub(r'\n\s*\n', '\n\n', text)  # Double line breaks for paragraphs
+    text = re.sub(r'\n(?!\n)', ' ', text)    # Single line breaks to spaces
+    
+    # Add proper sentence endings
+    text = re.sub(r'(?<=[a-z])(?=\s+[A-Z])', '.', text)
+    
+    return text.strip()
+
+def legacy_split_text_into_chunks(text, max_length=4000):
+    """The original two-pass chunker, kept as the baseline for the chunker benchmark."""
+    # Split by paragraphs first
+    paragraphs = text.split('\n\n')
+    chunks = []
+    current_chunk = ""
+    
+    for paragraph in paragraphs:
+        if len(current_chunk + paragraph) <= max_length:
+            current_chunk += paragraph + "\n\n"
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = paragraph + "\n\n"
+    
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    
+    # If chunks are still too long, split by sentences
+    final_chunks = []
+    for chunk in chunks:
+        if len(chunk) <= max_length:
+            final_chunks.append(chunk)
+        else:
+            sentences = re.split(r'[.!?]+', chunk)
+            temp_chunk = ""
+            for sentence in sentences:
+                if len(temp_chunk + sentence) <= max_length:
+                    temp_chunk += sentence + ". "
+                else:
+                    if temp_chunk:
+                        final_chunks.append(temp_chunk.strip())
+                    temp_chunk = sentence + ". "
+            if temp_chunk:
+                final_chunks.append(temp_chunk.strip())
+    
+    return [chunk for chunk in final_chunks if chunk.strip()]
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def bench_extraction(report, scale=1.0):
+    """Thread-pool vs process-pool PDF extraction on a large generated PDF."""
+    pages = max(1, int(600 * scale))
+    workers = os.cpu_count() or 4
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = make_sample_pdf(os.path.join(tmp, 'sample.pdf'), pages=pages)
+        report(f"{pages} pages, {workers} workers")
+        baseline = None
+        for mode in ('thread', 'process'):
+            elapsed, texts = _timed(extract_pdf_pages, pdf_path, mode=mode, workers=workers)
+            chars = sum(len(t) for t in texts)
+            baseline = baseline or elapsed
+            report(f"{mode:>8}: {elapsed:7.2f}s  {pages / elapsed:8.1f} pages/s  "
+                   f"{chars} chars  x{baseline / elapsed:.2f}")
+
+def bench_cleaner(report, scale=1.0):
+    """Throughput of clean_text_for_tts against the original multi-pass cleaner."""
+    pages = [sample_text(25, seed=i).replace('. ', '.\n', 3) + ' Page{}endsHere (see fig.{}) ...'.format(i, i)
+             for i in range(max(1, int(2000 * scale)))]
+    text = '\n'.join(pages)
+    megabytes = len(text.encode('utf-8')) / 1e6
+    report(f"{megabytes:.1f} MB in {len(pages)} pages")
+
+    legacy_time, legacy = _timed(legacy_clean_text_for_tts, text)
+    new_time, new = _timed(clean_text_for_tts, text)
+    paged_time, _ = _timed(lambda: sum(1 for _ in iter_clean_text(pages)))
+    assert new == legacy, "cleaner output differs from the original"
+
+    report(f"  legacy: {megabytes / legacy_time:7.1f} MB/s")
+    report(f"  single: {megabytes / new_time:7.1f} MB/s  x{legacy_time / new_time:.2f}")
+    report(f"   paged: {megabytes / paged_time:7.1f} MB/s  x{legacy_time / paged_time:.2f}")
+
+def bench_synthesis(report, scale=1.0):
+    """Sequential vs concurrent chunk synthesis against a fake backend with network-like latency."""
+    chunks = [sample_text(30, seed=i) for i in range(max(1, int(40 * scale)))]
+    backend = FakeBackend(latency=0.1)
+
+    report(f"{len(chunks)} chunks, {backend.latency * len(chunks):.2f}s of simulated latency")
+    baseline = None
+    for workers in (1, 4, 8):
+        elapsed, results = _timed(lambda: list(synthesize_chunks(chunks, backend.synthesize, workers=workers)))
+        assert [chunk for chunk, _ in results] == chunks
+        baseline = baseline or elapsed
+        report(f"  {workers} workers: {elapsed:6.2f}s  x{baseline / elapsed:.2f}")
+
+def bench_chunker(report, scale=1.0):
+    """Streaming chunker vs the original split_text_into_chunks on ~10 MB of cleaned text."""
+    pages = [clean_text_for_tts(sample_text(20, seed=i)) for i in range(200)]
+    pages = pages * max(1, int(30 * scale))  # ~10 MB at scale 1
+    megabytes = sum(len(p) for p in pages) / 1e6
+    report(f"{megabytes:.1f} MB in {len(pages)} pages")
+
+    legacy_time, legacy = _timed(legacy_split_text_into_chunks, ' '.join(pages))
+    stream_time, chunks = _timed(lambda: list(iter_text_chunks(iter(pages))))
+    assert all(len(c) <= 4000 for c in chunks)
+
+    report(f"  legacy: {legacy_time:6.2f}s  {megabytes / legacy_time:7.1f} MB/s  {len(legacy)} chunks")
+    report(f"  stream: {stream_time:6.2f}s  {megabytes / stream_time:7.1f} MB/s  {len(chunks)} chunks  "
+           f"x{legacy_time / stream_time:.2f}")
+
+def bench_pipeline(report, scale=1.0):
+    """Extract-then-synthesize vs the streaming pipeline, against a fake backend with network-like latency."""
+    pages = max(1, int(150 * scale))
+    backend = FakeBackend(latency=0.05)
+
+    def run(texts):
+        start = time.perf_counter()
+        first_audio = None
+        chunks = 0
+        for _ in synthesize_chunks(iter_text_chunks(texts()), backend.synthesize, workers=4):
+            first_audio = first_audio or time.perf_counter() - start
+            chunks += 1
+        return first_audio, time.perf_counter() - start, chunks
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = make_sample_pdf(os.path.join(tmp, 'sample.pdf'), pages=pages)
+        report(f"{pages} pages, 4 TTS workers, {backend.latency}s per chunk")
+        sequential = run(lambda: [clean_text_for_tts(t) for t in extract_pdf_pages(pdf_path)])
+        pipelined = run(lambda: (clean_text_for_tts(t) for _, t in in_page_order(iter_pdf_pages(pdf_path))))
+
+    for name, (first_audio, elapsed, chunks) in (('sequential', sequential), ('pipelined', pipelined)):
+        report(f"  {name:>10}: first audio {first_audio:6.2f}s  total {elapsed:6.2f}s  "
+               f"{chunks} chunks  x{sequential[1] / elapsed:.2f}")
+
+@contextmanager
+def scratch_database():
+    """Run against a throwaway copy of the database schema, so benchmarks can create rows freely."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+class QueryCounter:
+    """Counts queries on every database connection, in every thread, while active."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _attach(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self._attach)
+        for conn in connections.all():
+            self._attach(None, conn)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self._attach)
+        for conn in connections.all(initialized_only=True):
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+def bench_progress(report, scale=1.0):
+    """2-second status polling vs long-polling vs the SSE stream, for users watching one conversion.
+
+    A 10 minute conversion publishing 100 progress events is replayed 100x
+    faster. Polling is costed from measured requests rather than replayed,
+    since its load does not depend on when events happen.
+    """
+    from .jobs import claim_job, enqueue
+    from .models import Ebook
+
+    watchers = max(1, int(20 * scale))
+    conversion, updates, speedup = 600, 100, 100
+    status_url = '/ebooks/{}/status/'
+
+    def converting(title):
+        with open(make_sample_pdf(os.path.join(tmp, f'{title}.pdf'), pages=1), 'rb') as f:
+            ebook = Ebook.objects.create(title=title, pdf_file=File(f, name=f'{title}.pdf'))
+        enqueue(ebook)
+        claim_job('bench')
+        events.publish(ebook.pk, stage='synthesize', progress=10)
+        return ebook
+
+    async def publish(ebook):
+        for percent in range(1, updates + 1):
+            await asyncio.sleep(conversion / speedup / updates)
+            events.publish(ebook.pk, progress=percent)
+        events.publish(ebook.pk, status='completed', has_audio=True)
+
+    async def long_poll(ebook):
+        # Long polls only wait under ASGI, where a held request costs a coroutine rather than a worker
+        client, since, requests = AsyncClient(), 0, 0
+        while True:
+            data = (await client.get(status_url.format(ebook.pk), {'since': since, 'wait': 25 / speedup})).json()
+            requests += 1
+            if data['status'] != 'processing':
+                return requests
+            since = data['version']
+
+    async def stream(ebook):
+        response = await AsyncClient().get(f'/ebooks/{ebook.pk}/progress/')
+        return sum([1 async for message in response.streaming_content if message.startswith(b'event:')])
+
+    async def watch_streams(ebook):
+        publisher = asyncio.ensure_future(publish(ebook))
+        received = await asyncio.gather(*(stream(ebook) for _ in range(watchers)))
+        await publisher
+        return received
+
+    async def watch_long_polls(ebook):
+        publisher = asyncio.ensure_future(publish(ebook))
+        counts = await asyncio.gather(*(long_poll(ebook) for _ in range(watchers)))
+        await publisher
+        return counts
+
+    with tempfile.TemporaryDirectory() as tmp, scratch_database(), override_settings(
+            ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=tmp, EBOOK_PROGRESS_CACHE='default',
+            EBOOK_PROGRESS_STREAM_INTERVAL=0.5 / speedup, EBOOK_PROGRESS_LONG_POLL_SECONDS=25 / speedup):
+        report(f"{watchers} watchers, {conversion // 60} minute conversion with {updates} progress events")
+
+        ebook = converting('polling')
+        client = Client()
+        samples = 200
+        with QueryCounter() as queries:
+            start = time.process_time()
+            for _ in range(samples):
+                client.get(status_url.format(ebook.pk))
+            cpu = time.process_time() - start
+        requests = watchers * conversion // 2
+        report(f"    polling: {requests:6d} requests {requests / conversion:7.2f} req/s  "
+               f"{requests * queries.count // samples:6d} queries  {requests * cpu / samples:6.2f}s server CPU")
+
+        for name, watch in (('long-poll', watch_long_polls), ('sse', watch_streams)):
+            ebook = converting(name)
+            with QueryCounter() as queries:
+                start = time.process_time()
+                counts = asyncio.run(watch(ebook))
+                cpu = time.process_time() - start
+            requests = sum(counts) if name == 'long-poll' else watchers
+            report(f"  {name:>9}: {requests:6d} requests {requests / conversion:7.2f} req/s  "
+                   f"{queries.count:6d} queries  {cpu:6.2f}s server CPU")
+
+def legacy_detail_lyrics(ebook):
+    """What ebook_detail used to do on every view of a finished book: probe the audio and rewrite the lyrics."""
+    from moviepy import AudioFileClip
+    from .utils import generate_timed_lyrics_based_on_duration
+
+    audio_clip = AudioFileClip(ebook.audio_file.path)
+    total_duration = audio_clip.duration
+    audio_clip.close()
+    ebook.lyrics = generate_timed_lyrics_based_on_duration(ebook.iter_text(), total_duration)
+    ebook.save()
+
+def bench_detail(report, scale=1.0):
+    """Detail page latency for a finished book, with and without the old per-view audio probe and lyrics rewrite."""
+    from .models import Ebook
+    from .utils import audio_metadata, extract_text_from_pdf, generate_timed_lyrics_based_on_duration
+
+    pages, views = max(1, int(100 * scale)), 20
+    with tempfile.TemporaryDirectory() as tmp, scratch_database(), override_settings(
+            ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=tmp, EBOOK_EXTRACTION_MODE='thread'):
+        with open(make_sample_pdf(os.path.join(tmp, 'book.pdf'), pages=pages), 'rb') as f:
+            ebook = Ebook.objects.create(title='Bench', pdf_file=File(f, name='book.pdf'))
+        extract_text_from_pdf(ebook)
+        os.makedirs(os.path.join(tmp, 'ebooks', 'audio'))
+        audio = FakeBackend().synthesize(' '.join(WORDS * max(1, int(100 * scale))))
+        with open(os.path.join(tmp, 'ebooks', 'audio', 'book.mp3'), 'wb') as f:
+            f.write(audio.getvalue())
+        ebook.audio_file = 'ebooks/audio/book.mp3'
+        ebook.processing_status = 'completed'
+        ebook.audio_duration, ebook.audio_bitrate, ebook.audio_size = audio_metadata(ebook.audio_file.path)
+        ebook.lyrics = generate_timed_lyrics_based_on_duration(ebook.iter_text(), ebook.audio_duration)
+        ebook.save()
+        report(f"{pages} pages, {ebook.audio_duration / 60:.0f} minutes of audio, {len(ebook.lyrics)} lyric lines, "
+               f"{views} views")
+
+        client = Client()
+        url = f'/ebooks/{ebook.pk}/'
+
+        def view(before=None):
+            start = time.perf_counter()
+            if before:
+                before(Ebook.objects.get(pk=ebook.pk))
+            client.get(url)
+            return time.perf_counter() - start
+
+        view()  # warm up templates and connections
+        baseline = None
+        for name, before in (('before', legacy_detail_lyrics), ('after', None)):
+            with QueryCounter() as queries:
+                timings = sorted(view(before) for _ in range(views))
+            mean = sum(timings) / views
+            baseline = baseline or mean
+            report(f"  {name:>6}: mean {mean * 1000:7.1f} ms  p95 {timings[int(views * 0.95) - 1] * 1000:7.1f} ms  "
+                   f"{queries.count / views:5.1f} queries/view  x{baseline / mean:.2f}")
+
+def bench_list(report, scale=1.0):
+    """Library page for a user with 10k books: every row with every column vs keyset pages of the card columns."""
+    from django.contrib.auth.models import User
+    from django.template.loader import render_to_string
+    from django.utils import timezone
+    from datetime import timedelta
+    from .models import Ebook
+    from .views import LIST_COLUMNS, _library_stats
+
+    rows = max(1, int(10000 * scale))
+    with scratch_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+        user = User.objects.create_user('bench')
+        now = timezone.now()
+        lyrics = [{'time': i * 2.5, 'text': sample_text(1, seed=i)} for i in range(100)]
+        Ebook.objects.bulk_create(
+            (Ebook(title=f'Book {i}', pdf_file=f'uploads/{i}.pdf', audio_file=f'ebooks/audio/{i}.mp3',
+                   uploaded_by=user, processing_status='completed', extracted_text=sample_text(40, seed=i),
+                   lyrics=lyrics, upload_date=now - timedelta(seconds=i // 3))
+             for i in range(rows)), batch_size=500)
+        report(f"{rows} books for one user")
+
+        client = Client()
+        client.force_login(user)
+
+        def timed(label, func):
+            with QueryCounter() as queries:
+                elapsed, result = _timed(func)
+            size = f"{len(result) / 1024:6.0f} KB" if isinstance(result, (str, bytes)) else f"{len(result):6d} rows"
+            report(f"  {label:>24}: {elapsed * 1000:8.1f} ms  {size}  {queries.count} queries")
+
+        request = RequestFactory().get('/ebooks/list/')
+        request.user = user
+
+        def unpaged():
+            # The same page as the view, counters included, but with every book and column
+            ebooks = Ebook.objects.filter(uploaded_by=user)
+            context = {'ebooks': list(ebooks.order_by('-upload_date')), 'stats': _library_stats(ebooks)}
+            return render_to_string('ebooks/list.html', context, request=request)
+
+        ordered = Ebook.objects.filter(uploaded_by=user).only(*LIST_COLUMNS).order_by('-upload_date', '-pk')
+        deep = ordered[rows * 9 // 10]
+        after = Q(upload_date__lt=deep.upload_date) | Q(upload_date=deep.upload_date, pk__lt=deep.pk)
+        cursor = f"{deep.upload_date.isoformat()},{deep.pk}"
+
+        report("whole page:")
+        timed('every row and column', unpaged)
+        timed('first page + counters', lambda: client.get('/ebooks/list/').content)
+        timed('page at 90% (keyset)', lambda: client.get('/ebooks/list/', {'after': cursor}).content)
+        report("page query alone:")
+        timed('every row and column', lambda: list(Ebook.objects.filter(uploaded_by=user).order_by('-upload_date')))
+        timed('counters', lambda: _library_stats(Ebook.objects.filter(uploaded_by=user)))
+        timed('page at 90% (OFFSET)', lambda: list(ordered[rows * 9 // 10 + 1:rows * 9 // 10 + 25]))
+        timed('page at 90% (keyset)', lambda: list(ordered.filter(after)[:25]))
+
+def bench_lyrics(report, scale=1.0):
+    """Lyrics for a 10-hour book: every line in the page vs windows fetched from the lyrics endpoint.
+
+    The player's per-``timeupdate`` work is modelled in Python: the old linear
+    scan plus the ``upcoming`` pass over every line, vs a binary search and
+    the eleven lines on screen.
+    """
+    from bisect import bisect_right
+    from django.template import Context, Template
+    from .lyrics import LyricIndex
+    from .models import Ebook
+
+    hours, updates = 10 * scale, 1000
+    lyrics = [{'time': round(i * 4.8, 2), 'text': sample_text(1, seed=i)} for i in range(int(hours * 3600 / 4.8))]
+    with scratch_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+        ebook = Ebook.objects.create(title='Bench', pdf_file='uploads/bench.pdf', lyrics=lyrics)
+        report(f"{hours:.0f} hours of audio, {len(lyrics)} lyric lines")
+
+        old_markup = Template('{% for lyric in lyrics %}<div class="lyric-line" data-time="{{ lyric.time }}">'
+                              '{{ lyric.text }}</div>{% endfor %}')
+        elapsed, markup = _timed(lambda: old_markup.render(Context({'lyrics': lyrics})))
+        report(f"  {'every line in the page':>24}: {elapsed * 1000:8.1f} ms  {len(markup) / 1024:6.0f} KB  "
+               f"{len(lyrics)} DOM nodes")
+        client = Client()
+        url = f'/ebooks/{ebook.pk}/lyrics/'
+        params = {'start': int(hours * 1800 * 1000), 'before': 4}
+        # The first window builds the process's index of the book; later ones only slice it
+        for name in ('first window (endpoint)', 'next window (endpoint)'):
+            elapsed, body = _timed(lambda: client.get(url, params).content)
+            report(f"  {name:>24}: {elapsed * 1000:8.1f} ms  {len(body) / 1024:6.0f} KB  11 DOM nodes")
+
+    times = [line['time'] for line in lyrics]
+    positions = [random.Random(i).uniform(0, times[-1]) for i in range(updates)]
+
+    def linear(now):
+        current = -1
+        for i, time_ in enumerate(times):
+            if time_ <= now:
+                current = i
+            else:
+                break
+        return current, [i for i, time_ in enumerate(times) if now < time_ <= now + 3]
+
+    index = LyricIndex.from_lyrics(lyrics)
+
+    def windowed(now):
+        ms = now * 1000
+        current = bisect_right(index.times, ms) - 1
+        shown = range(max(current - 4, 0), min(current + 7, len(index)))
+        return current, [i for i in shown if ms < index.times[i] <= ms + 3000]
+
+    report(f"per timeupdate, {updates} random positions:")
+    for name, func in (('linear scan', linear), ('binary search', windowed)):
+        elapsed, _ = _timed(lambda: [func(now) for now in positions])
+        report(f"  {name:>24}: {elapsed / updates * 1e6:8.1f} us")
+
+def bench_lyric_sync(report, scale=1.0):
+    """Lyric timing error over a 10-hour book: total duration spread evenly vs measured chunk durations.
+
+    The fake voice speaks a fixed time per word, so the true start of each
+    line is known from the words before it.
+    """
+    from .lyrics import ChunkTimeline
+    from .utils import generate_timed_lyrics_based_on_duration, generate_timed_lyrics_from_timeline, iter_text_chunks
+
+    backend = FakeBackend()
+    pages = [sample_text(60, seed=i) for i in range(max(1, int(130 * scale)))]
+    timeline = ChunkTimeline()
+    for chunk in iter_text_chunks(pages, backend.max_chunk_chars):
+        timeline.append(chunk, backend.duration_for(chunk))
+    total = sum(timeline.durations)
+    report(f"{total / 3600:.1f} hours of audio, {len(timeline)} chunks")
+
+    for name, make in (('even spread', lambda: generate_timed_lyrics_based_on_duration(pages, total)),
+                       ('chunk timeline', lambda: generate_timed_lyrics_from_timeline(pages, timeline))):
+        elapsed, lyrics = _timed(make)
+        errors, words = [], 0
+        for line in lyrics:
+            errors.append(abs(line['time'] - words * backend.seconds_per_word))
+            words += len(line['text'].split())
+        errors.sort()
+        report(f"  {name:>15}: median error {errors[len(errors) // 2]:6.2f}s  max {errors[-1]:6.2f}s  "
+               f"{elapsed * 1000:6.1f} ms for {len(lyrics)} lines")
+
+def bench_alignment(report, scale=1.0):
+    """Snapping lyrics to pauses: runtime per audio hour, peak memory and timing error before and after.
+
+    The narration is noise bursts one to six seconds long with a 0.4 s pause
+    before each, encoded like gTTS output (24 kHz mono MP3). Lyric times
+    start up to a second off, as inside a long chunk.
+    """
+    import subprocess
+    import tracemalloc
+    import numpy as np
+    from imageio_ffmpeg import get_ffmpeg_exe
+    from .alignment import align_lyrics
+
+    hours = scale
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'narration.mp3')
+        encoder = subprocess.Popen(
+            [get_ffmpeg_exe(), '-loglevel', 'error', '-f', 's16le', '-ar', '8000', '-ac', '1', '-i', 'pipe:0',
+             '-ar', '24000', '-b:a', '32k', path], stdin=subprocess.PIPE)
+        starts, now = [], 0.0
+        while now < hours * 3600:
+            samples = int(rng.integers(8000, 48000))
+            seconds = samples / 8000
+            starts.append(round(now + 0.4, 2))
+            sentence = np.concatenate((np.zeros(3200), rng.uniform(-0.4, 0.4, samples)))
+            encoder.stdin.write((sentence * 32767).astype('<i2').tobytes())
+            now += 0.4 + seconds
+        encoder.stdin.close()
+        encoder.wait()
+        estimates = [{'time': max(start + float(rng.uniform(-1, 1)), 0), 'text': ''} for start in starts]
+        report(f"{now / 3600:.1f} hours of audio, {len(starts)} lines, {os.path.getsize(path) / 2 ** 20:.0f} MB MP3")
+
+        tracemalloc.start()
+        try:
+            elapsed, (aligned, pauses) = _timed(align_lyrics, path, estimates, 1.5)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        report(f"  {elapsed:.1f}s ({elapsed / (now / 3600):.1f}s per audio hour), {pauses} pauses, "
+               f"peak {peak / 2 ** 20:.1f} MB traced")
+        for name, lyrics in (('estimated', estimates), ('aligned', aligned)):
+            errors = sorted(abs(line['time'] - start) for line, start in zip(lyrics, starts))
+            within = sum(error <= 0.1 for error in errors) / len(errors)
+            report(f"  {name:>9}: median error {errors[len(errors) // 2] * 1000:6.0f} ms  max {errors[-1] * 1000:6.0f} ms  "
+                   f"{within:4.0%} within 100 ms")
+
+BENCHMARKS = {
+    'alignment': bench_alignment,
+    'chunker': bench_chunker,
+    'cleaner': bench_cleaner,
+    'detail': bench_detail,
+    'extraction': bench_extraction,
+    'list': bench_list,
+    'lyric-sync': bench_lyric_sync,
+    'lyrics': bench_lyrics,
+    'pipeline': bench_pipeline,
+    'progress': bench_progress,
+    'synthesis': bench_synthesis,
+}
@@ -0,0 +1,252 @@
+"""Content-addressed caches stored under MEDIA_ROOT."""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ExtractionCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Per-process hit/miss counters, e.g. stats['extraction_hits']
+stats = Counter()
+
+def sha256_of_file(f, chunk_size=1024 * 1024):
+    """Hash a file object without reading it into memory at once."""
+    digest = hashlib.sha256()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+def extraction_cache_path(sha256, version):
+    version_dir = re.sub(r'[^A-Za-z0-9.-]+', '_', version)
+    return os.path.join(settings.MEDIA_ROOT, 'cache', 'extraction', version_dir, sha256[:2], f'{sha256}.jsonl.gz')
+
+def _read_cached_pages(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            index, text = json.loads(line)
+            yield index, text
+
+def cached_pages(sha256, version):
+    """Return an iterator of ``(page_index, raw_text)`` from the cache, or None on a miss."""
+    entry = ExtractionCacheEntry.objects.filter(sha256=sha256, extractor_version=version).first()
+    path = extraction_cache_path(sha256, version)
+    if entry is not None and not os.path.exists(path):
+        entry.delete()
+        entry = None
+
+    if entry is None:
+        stats['extraction_misses'] += 1
+        logger.info(f"Extraction cache miss for {sha256[:12]} ({_hit_rate('extraction')})")
+        return None
+
+    ExtractionCacheEntry.objects.filter(pk=entry.pk).update(
+        hit_count=F('hit_count') + 1, last_used_at=timezone.now())
+    stats['extraction_hits'] += 1
+    logger.info(f"Extraction cache hit for {sha256[:12]} ({_hit_rate('extraction')})")
+    return _read_cached_pages(path)
+
+def cache_pages(pages, sha256, version):
+    """Pass ``(page_index, raw_text)`` pairs through while writing them to the cache.
+
+    The entry is only published (atomically renamed into place) once the whole
+    stream has been consumed, so a failed or abandoned extraction leaves no
+    partial entry behind.
+    """
+    path = extraction_cache_path(sha256, version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    page_count = 0
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+            for index, text in pages:
+                f.write(json.dumps([index, text]) + '\n')
+                page_count += 1
+                yield index, text
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    ExtractionCacheEntry.objects.update_or_create(
+        sha256=sha256, extractor_version=version,
+        defaults={
+            'page_count': page_count,
+            'size_bytes': os.path.getsize(path),
+            'last_used_at': timezone.now(),
+        },
+    )
+
+def prune_extraction_cache(max_entries=None, max_age_days=None):
+    """Delete least recently used entries beyond ``max_entries`` or unused for ``max_age_days``.
+
+    Returns the number of entries removed.
+    """
+    entries = ExtractionCacheEntry.objects.order_by('-last_used_at')
+    doomed = []
+    if max_entries is not None:
+        doomed.extend(entries[max_entries:])
+    if max_age_days is not None:
+        cutoff = timezone.now() - timedelta(days=max_age_days)
+        doomed.extend(entries.filter(last_used_at__lt=cutoff))
+
+    removed = {}
+    for entry in doomed:
+        if entry.pk in removed:
+            continue
+        try:
+            os.unlink(extraction_cache_path(entry.sha256, entry.extractor_version))
+        except FileNotFoundError:
+            pass
+        removed[entry.pk] = entry
+    ExtractionCacheEntry.objects.filter(pk__in=removed).delete()
+    return len(removed)
+
+class ChunkAudioCache:
+    """Size-bounded, content-addressed cache of synthesized chunk audio.
+
+    Files live under ``MEDIA_ROOT/cache/tts`` named by a hash of the
+    normalized chunk text, backend name and voice parameters. Writes go to a
+    temp file and are renamed into place, and every reader and evictor
+    tolerates files vanishing underneath it, so several worker processes can
+    share the directory without locking. A file's mtime is its last use.
+    """
+    # Temp files older than this are assumed to belong to a dead writer
+    STALE_TEMP_SECONDS = 3600
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.path.join(settings.MEDIA_ROOT, 'cache', 'tts')
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'EBOOK_TTS_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, text, backend_name, voice_params):
+        normalized = ' '.join(text.split())
+        params = json.dumps(voice_params, sort_keys=True)
+        return hashlib.sha256(f"{backend_name}\0{params}\0{normalized}".encode()).hexdigest()
+
+    def path(self, key, audio_format):
+        return os.path.join(self.root, key[:2], f'{key}.{audio_format}')
+
+    def get(self, key, audio_format):
+        """Return the cached audio as a BytesIO, or None."""
+        path = self.path(key, audio_format)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        return BytesIO(data)
+
+    def put(self, key, audio_format, data):
+        path = self.path(key, audio_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        """Delete least recently used files until the cache fits in ``max_bytes``.
+
+        Returns the number of files removed.
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.endswith('.tmp'):
+                    if now - st.st_mtime > self.STALE_TEMP_SECONDS:
+                        _unlink_quietly(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _unlink_quietly(path)
+            total -= size
+            removed += 1
+        return removed
+
+class CachedSynthesizer:
+    """``synthesize(chunk)`` callable that consults a ChunkAudioCache before the backend.
+
+    Safe to call from several threads; ``hits`` and ``misses`` count this job only.
+    """
+
+    def __init__(self, backend, voice_params, audio_cache=None):
+        self.backend = backend
+        self.voice_params = voice_params
+        self.audio_cache = audio_cache or ChunkAudioCache()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, chunk):
+        if not self.audio_cache.enabled:
+            return self.backend.synthesize(chunk, **self.voice_params)
+
+        key = self.audio_cache.key(chunk, self.backend.name, self.voice_params)
+        audio = self.audio_cache.get(key, self.backend.audio_format)
+        if audio is not None:
+            with self._lock:
+                self.hits += 1
+            return audio
+
+        audio = self.backend.synthesize(chunk, **self.voice_params)
+        self.audio_cache.put(key, self.backend.audio_format, audio.getvalue())
+        with self._lock:
+            self.misses += 1
+        return audio
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+def _unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def _hit_rate(kind):
+    hits, misses = stats[f'{kind}_hits'], stats[f'{kind}_misses']
+    return f"{hits} hits / {misses} misses"
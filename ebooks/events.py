@@ -0,0 +1,83 @@
+"""Progress events passed from the workers to the pages watching a conversion.
+
+Workers publish each ebook's latest state (status, stage, percent) to the
+cache named by ``EBOOK_PROGRESS_CACHE``, and the progress stream and the
+long-poll status endpoint read it from there, so watching a conversion
+costs cache reads rather than database queries. Workers and web servers
+run in different processes, so that cache must be shared between them
+(file-based on one host, Redis or Memcached across hosts).
+
+Every publish gives the event a new ``version``: the time in microseconds,
+bumped if needed so it always increases, which lets readers in any process
+tell whether anything changed since they last looked.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Ebook
+
+# Events for ebooks nobody publishes to any more are dropped after this many seconds
+EVENT_TIMEOUT = 60 * 60
+QUEUE_KEY = 'ebook-events:queue'
+
+_STAGE_DISPLAY = dict(Ebook._meta.get_field('processing_stage').choices)
+
+def _cache():
+    return caches[getattr(settings, 'EBOOK_PROGRESS_CACHE', 'default')]
+
+def _key(ebook_pk):
+    return f'ebook-events:{ebook_pk}'
+
+def _next_version(previous):
+    return max(time.time_ns() // 1000, previous + 1)
+
+def poll_interval():
+    return getattr(settings, 'EBOOK_PROGRESS_STREAM_INTERVAL', 0.5)
+
+def publish(ebook_pk, **fields):
+    """Merge ``fields`` into the ebook's latest event and give it a new version.
+
+    Only one worker runs an ebook's job at a time, so the read-modify-write
+    does not race with another publisher in practice.
+    """
+    cache = _cache()
+    event = cache.get(_key(ebook_pk)) or {}
+    event.update(fields)
+    if 'stage' in fields:
+        event['stage_display'] = _STAGE_DISPLAY.get(fields['stage'], '')
+    event['version'] = _next_version(event.get('version', 0))
+    cache.set(_key(ebook_pk), event, EVENT_TIMEOUT)
+    return event
+
+def latest(ebook_pk):
+    """The ebook's latest event, or None if nothing was published recently."""
+    return _cache().get(_key(ebook_pk))
+
+async def alatest(ebook_pk):
+    return await _cache().aget(_key(ebook_pk))
+
+def queue_changed():
+    """Record that jobs were queued or claimed, so queue positions shown to users may be stale."""
+    cache = _cache()
+    cache.set(QUEUE_KEY, _next_version(cache.get(QUEUE_KEY, 0)), EVENT_TIMEOUT)
+
+async def aqueue_version():
+    return await _cache().aget(QUEUE_KEY, 0)
+
+async def await_change(ebook_pk, since, timeout):
+    """Wait until the ebook's event version differs from ``since`` or ``timeout`` seconds pass.
+
+    Returns the new event, or None on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        event = await alatest(ebook_pk)
+        if event is not None and event['version'] != since:
+            return event
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        await asyncio.sleep(min(poll_interval(), remaining))
@@ -50,6 +50,10 @@ class EbookForm(forms.ModelForm):
         instance = super().save(commit=False)
         if self.user:
             instance.uploaded_by = self.user
+        # Set by ebooks.uploadhandlers while the upload was streamed in
+        sha256 = getattr(self.cleaned_data.get('pdf_file'), 'sha256', None)
+        if sha256:
+            instance.pdf_sha256 = sha256
         if commit:
             instance.save()
         return instance
\ No newline at end of file
@@ -0,0 +1,340 @@
+"""Database-backed job queue for ebook processing.
+
+Views only enqueue a ProcessingJob; ``manage.py run_workers`` processes claim
+and run them, so conversion happens outside the web process and can be scaled
+separately. Claiming is a conditional UPDATE from 'queued' to 'running', which
+is atomic on every database backend (including SQLite, which has no
+``SELECT ... FOR UPDATE``), so two workers can never run the same job.
+
+Which queued job runs next is decided by a fair scheduler (see
+``scheduled_queue``): at most ``EBOOK_JOB_MAX_RUNNING`` jobs run at once,
+at most ``EBOOK_JOB_MAX_RUNNING_PER_USER`` per uploader, users take turns,
+and each user's own jobs run shortest first.
+
+A claimed job is leased to its worker for ``EBOOK_JOB_LEASE_SECONDS``. The
+pipeline heartbeats between pages and chunks, which extends the lease and
+saves a resume checkpoint; extraction also heartbeats while it waits on
+its process pool. If a worker dies, its lease runs out and the
+reaper (run by every worker between jobs) requeues the job, which resumes
+from the last checkpoint, until ``max_attempts`` is reached.
+
+An ebook has at most one job running at a time. Regenerating while a job
+is queued updates that job in place; while one is running, the running job
+is asked to cancel (it stops at its next check, between chunks) and the new
+job waits for it. Deleting an ebook cancels all of its work.
+
+Status changes are also published as progress events (see ``events``) for
+the pages streaming an ebook's progress.
+"""
+import logging
+import os
+import socket
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from . import events
+from .models import Ebook, ExtractionCacheEntry, ProcessingJob
+from .utils import EXTRACTOR_VERSION, Checkpoint, JobCancelled, LeaseLost, process_ebook
+
+logger = logging.getLogger(__name__)
+
+def lease_seconds():
+    return getattr(settings, 'EBOOK_JOB_LEASE_SECONDS', 300)
+
+# Rough cleaned characters per PDF page, for sizing jobs whose text is not extracted yet
+CHARS_PER_PAGE_ESTIMATE = 2000
+# Rough PDF bytes per cleaned character, for sizing PDFs nobody has extracted yet
+PDF_BYTES_PER_CHAR_ESTIMATE = 2
+
+def estimate_job_chars(ebook):
+    """Estimate how many characters a job for ``ebook`` will narrate.
+
+    Called from the web request that enqueues the job, so it never opens
+    the PDF: stored pages and the extraction cache are counted when there
+    are any, and otherwise the file size stands in.
+    """
+    chars = ebook.text_length()
+    if chars:
+        return chars
+    entry = None
+    if ebook.pdf_sha256:
+        entry = ExtractionCacheEntry.objects.filter(sha256=ebook.pdf_sha256, extractor_version=EXTRACTOR_VERSION).first()
+    if entry is not None:
+        return entry.page_count * CHARS_PER_PAGE_ESTIMATE
+    try:
+        return ebook.pdf_file.size // PDF_BYTES_PER_CHAR_ESTIMATE
+    except OSError as e:
+        logger.warning(f"Could not size ebook {ebook.pk}: {e}")
+        return 0
+
+def enqueue(ebook):
+    """Mark the ebook as processing and queue a job for its current voice and accent.
+
+    A job already waiting for the ebook is updated instead of adding another
+    one, and a running job is asked to cancel since its output is now stale.
+    """
+    ebook.processing_status = 'processing'
+    ebook.progress = 0
+    ebook.processing_stage = ''
+    ebook.save(update_fields=['processing_status', 'progress', 'processing_stage'])
+    events.publish(ebook.pk, status='processing', progress=0, stage='', has_audio=bool(ebook.audio_file))
+    events.queue_changed()
+
+    ProcessingJob.objects.filter(ebook=ebook, status='running').update(cancel_requested=True)
+    job = ProcessingJob.objects.filter(ebook=ebook, status='queued').order_by('created_at', 'pk').first()
+    if job is not None:
+        job.voice_style, job.accent = ebook.voice_style, ebook.accent
+        job.save(update_fields=['voice_style', 'accent'])
+        logger.info(f"Coalesced request for ebook {ebook.pk} into queued job {job.pk}")
+        return job
+
+    job = ProcessingJob.objects.create(
+        ebook=ebook, voice_style=ebook.voice_style, accent=ebook.accent,
+        max_attempts=getattr(settings, 'EBOOK_JOB_MAX_ATTEMPTS', 3),
+        estimated_chars=estimate_job_chars(ebook),
+    )
+    logger.info(f"Queued job {job.pk} for ebook {ebook.pk}")
+    return job
+
+def cancel_jobs(ebook):
+    """Cancel the ebook's queued jobs and ask its running job to stop. Returns the number affected."""
+    cancelled = ProcessingJob.objects.filter(ebook=ebook, status='queued').update(
+        status='cancelled', finished_at=timezone.now())
+    cancelled += ProcessingJob.objects.filter(ebook=ebook, status='running').update(cancel_requested=True)
+    if cancelled:
+        events.queue_changed()
+        logger.info(f"Cancelled {cancelled} job(s) for ebook {ebook.pk}")
+    return cancelled
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def scheduled_queue():
+    """Return ``(queued, running)`` describing the dispatch order.
+
+    ``queued`` is a list of ``(job_pk, user_id)`` in the order jobs will be
+    started if nothing else is enqueued: users (by ``Ebook.uploaded_by``; all
+    anonymous uploads count as one user) take turns, fewest running jobs
+    first and then longest waiting, and each user's jobs are ordered by
+    estimated size, shortest first. ``running`` counts running jobs per user.
+    """
+    running = Counter(ProcessingJob.objects.filter(status='running').values_list('ebook__uploaded_by', flat=True))
+    per_user = defaultdict(list)
+    waiting_since = {}
+    # A job waits while an older job for the same ebook is still running (and being cancelled)
+    busy_ebooks = ProcessingJob.objects.filter(status='running').values('ebook')
+    rows = (ProcessingJob.objects.filter(status='queued').exclude(ebook__in=busy_ebooks)
+            .order_by('estimated_chars', 'created_at', 'pk')
+            .values_list('pk', 'ebook__uploaded_by', 'created_at'))
+    for pk, user, created_at in rows:
+        per_user[user].append(pk)
+        waiting_since[user] = min(created_at, waiting_since.get(user, created_at))
+
+    users = sorted(per_user, key=lambda user: (running[user], waiting_since[user]))
+    queued = []
+    for turn in range(max((len(jobs) for jobs in per_user.values()), default=0)):
+        queued.extend((per_user[user][turn], user) for user in users if turn < len(per_user[user]))
+    return queued, running
+
+def queue_position(job):
+    """1-based position of a queued job in the dispatch order, or None if it is not queued."""
+    if job.status != 'queued':
+        return None
+    queued, _ = scheduled_queue()
+    for position, (pk, _) in enumerate(queued, start=1):
+        if pk == job.pk:
+            return position
+    return None
+
+def claim_job(worker_id):
+    """Atomically take the next job the scheduler allows, or return None.
+
+    None means the queue is empty or every waiting user is at their limit.
+    The limits are checked just before the claiming UPDATE rather than
+    inside it, so two workers racing can briefly exceed them by one job.
+    """
+    max_running = getattr(settings, 'EBOOK_JOB_MAX_RUNNING', None)
+    max_per_user = getattr(settings, 'EBOOK_JOB_MAX_RUNNING_PER_USER', None)
+    while True:
+        queued, running = scheduled_queue()
+        if max_running is not None and sum(running.values()) >= max_running:
+            return None
+        candidates = [pk for pk, user in queued if max_per_user is None or running[user] < max_per_user]
+        if not candidates:
+            return None
+        for pk in candidates[:10]:
+            now = timezone.now()
+            claimed = ProcessingJob.objects.filter(pk=pk, status='queued').update(
+                status='running', worker=worker_id, started_at=now, attempts=F('attempts') + 1,
+                heartbeat_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds()))
+            if claimed:
+                events.queue_changed()
+                return ProcessingJob.objects.select_related('ebook').get(pk=pk)
+        # Every candidate was taken by another worker in the meantime; look again
+
+class JobCheckpoint(Checkpoint):
+    """Checkpoint that renews the job's lease and stores resume state on the job row.
+
+    Lease renewals and checkpoint writes each happen at most once per
+    ``interval`` seconds (a third of the lease by default), on separate
+    clocks so frequent heartbeats never crowd out the checkpoint; writing a
+    checkpoint also renews the lease. Cancellation is checked at
+    most once per ``cancel_interval`` seconds. Raises JobCancelled when the
+    job was cancelled or deleted, and LeaseLost if it now belongs to another
+    worker.
+    """
+
+    def __init__(self, job, interval=None, cancel_interval=None):
+        self.job = job
+        self.interval = interval if interval is not None else lease_seconds() / 3
+        if cancel_interval is None:
+            cancel_interval = getattr(settings, 'EBOOK_JOB_CANCEL_CHECK_SECONDS', 1)
+        self.cancel_interval = cancel_interval
+        self._last_write = self._last_save = self._last_cancel_check = time.monotonic()
+
+    def _due(self, since):
+        return time.monotonic() - since >= self.interval
+
+    def _owned(self):
+        return ProcessingJob.objects.filter(pk=self.job.pk, status='running', worker=self.job.worker,
+                                            cancel_requested=False)
+
+    def _lost(self):
+        current = ProcessingJob.objects.filter(pk=self.job.pk).values('status', 'worker', 'cancel_requested').first()
+        if current is None or current['cancel_requested'] or current['status'] == 'cancelled':
+            return JobCancelled(f"Job {self.job.pk} was cancelled")
+        return LeaseLost(f"Job {self.job.pk} is no longer leased to {self.job.worker}")
+
+    def _renew(self, **fields):
+        now = timezone.now()
+        renewed = self._owned().update(
+            heartbeat_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds()), **fields)
+        self._last_write = self._last_cancel_check = time.monotonic()
+        if not renewed:
+            raise self._lost()
+
+    def check_cancelled(self):
+        self._last_cancel_check = time.monotonic()
+        if not self._owned().exists():
+            raise self._lost()
+
+    def heartbeat(self):
+        if self._due(self._last_write):
+            self._renew()
+        elif time.monotonic() - self._last_cancel_check >= self.cancel_interval:
+            self.check_cancelled()
+
+    def load(self, key):
+        saved = self.job.checkpoint
+        if saved and saved.get('key') == key:
+            return saved['state']
+        return None
+
+    def save(self, key, state):
+        if self._due(self._last_save):
+            self._last_save = time.monotonic()
+            self.job.checkpoint = {'key': key, 'state': state()}
+            self._renew(checkpoint=self.job.checkpoint)
+
+def run_job(job):
+    """Run a claimed job to completion and record the outcome on the job and its ebook."""
+    ebook = job.ebook
+    logger.info(f"Worker {job.worker} starting job {job.pk} for ebook {ebook.pk} (attempt {job.attempts})")
+    # Ebook updates go through querysets so an ebook deleted mid-job is not re-created
+    try:
+        page_count = process_ebook(ebook, voice_style=job.voice_style, accent=job.accent,
+                                   checkpoint=JobCheckpoint(job))
+        job.status = 'completed' if ebook.audio_file else 'failed'
+        Ebook.objects.filter(pk=ebook.pk).update(processing_status=job.status)
+        events.publish(ebook.pk, status=job.status, has_audio=bool(ebook.audio_file))
+        logger.info(f"Job {job.pk} {job.status}: {page_count} pages")
+    except LeaseLost as e:
+        # The reaper has taken the job back; whoever holds it now owns the ebook
+        logger.warning(f"Abandoning job {job.pk}: {e}")
+        return job
+    except JobCancelled as e:
+        job.status = 'cancelled'
+        logger.info(f"Stopped job {job.pk}: {e}")
+        if not ProcessingJob.objects.filter(ebook=ebook.pk, status='queued').exists():
+            Ebook.objects.filter(pk=ebook.pk).update(processing_status='failed', progress=0, processing_stage='')
+            events.publish(ebook.pk, status='failed', progress=0, stage='')
+    except Exception as e:
+        Ebook.objects.filter(pk=ebook.pk).update(processing_status='failed', progress=0, processing_stage='')
+        events.publish(ebook.pk, status='failed', progress=0, stage='')
+        job.status = 'failed'
+        job.error = str(e)
+        logger.error(f"Job {job.pk} for ebook {ebook.pk} failed: {e}")
+    job.finished_at = timezone.now()
+    job.checkpoint = None
+    ProcessingJob.objects.filter(pk=job.pk, worker=job.worker).update(
+        status=job.status, error=job.error, finished_at=job.finished_at, checkpoint=None, lease_expires_at=None)
+    return job
+
+def reap_expired_jobs():
+    """Requeue running jobs whose lease has expired, or fail them once out of attempts.
+
+    Returns ``(requeued, failed)`` counts.
+    """
+    requeued = failed = 0
+    now = timezone.now()
+    for job in ProcessingJob.objects.filter(status='running', lease_expires_at__lt=now).select_related('ebook'):
+        # Conditional on the lease still being expired, so a late heartbeat wins
+        still_expired = ProcessingJob.objects.filter(pk=job.pk, status='running', lease_expires_at__lt=now)
+        if job.cancel_requested:
+            still_expired.update(status='cancelled', finished_at=now, lease_expires_at=None, checkpoint=None)
+            if job.checkpoint:
+                _unlink_quietly(job.checkpoint['state'].get('path'))
+            continue
+        if job.attempts < job.max_attempts:
+            if still_expired.update(status='queued', worker='', lease_expires_at=None):
+                requeued += 1
+                events.queue_changed()
+                logger.warning(f"Requeued job {job.pk} after its lease expired (attempt {job.attempts}/{job.max_attempts})")
+            continue
+
+        error = f"Lease expired on attempt {job.attempts}/{job.max_attempts}"
+        if still_expired.update(status='failed', error=error, finished_at=now, lease_expires_at=None, checkpoint=None):
+            failed += 1
+            job.ebook.processing_status = 'failed'
+            job.ebook.progress = 0
+            job.ebook.processing_stage = ''
+            job.ebook.save(update_fields=['processing_status', 'progress', 'processing_stage'])
+            events.publish(job.ebook_id, status='failed', progress=0, stage='')
+            if job.checkpoint:
+                _unlink_quietly(job.checkpoint['state'].get('path'))
+            logger.error(f"Job {job.pk} for ebook {job.ebook_id} failed: {error}")
+    return requeued, failed
+
+def _unlink_quietly(path):
+    try:
+        if path:
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def run_worker(worker_id=None, poll_interval=2.0, burst=False, should_stop=lambda: False):
+    """Claim and run jobs until ``should_stop()`` is true.
+
+    With ``burst`` the worker exits as soon as the queue is empty instead of
+    polling every ``poll_interval`` seconds. Returns the number of jobs run.
+    """
+    worker_id = worker_id or default_worker_id()
+    jobs_run = 0
+    while not should_stop():
+        close_old_connections()
+        reap_expired_jobs()
+        job = claim_job(worker_id)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        jobs_run += 1
+    return jobs_run
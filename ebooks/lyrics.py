@@ -0,0 +1,137 @@
+"""Timed lyrics: where lines fall in the audio, and the windows of them the player fetches.
+
+``Ebook.lyrics`` is a list of ``{"time": seconds, "text": line}`` entries in
+playback order. ``LyricIndex`` keeps it as two parallel lists, start times
+in whole milliseconds and texts, so the line playing at a given moment and
+the lines in a time window are found by binary search. Building one is
+linear in the length of the book, so the lyrics endpoint keeps the most
+recently used indexes in memory (``cached_index``) and only slices them.
+
+Line times come from a ``ChunkTimeline``: the measured duration of every
+synthesized chunk, with lines placed inside a chunk by their share of its
+spoken weight.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from operator import itemgetter
+
+# Characters that take no time to say. Sentence splitting drops the sentence ends from lyric lines.
+_UNSPOKEN = str.maketrans('', '', ' \t\n\r.!?')
+
+def spoken_weight(text):
+    """How much narration ``text`` accounts for: its length without whitespace and sentence ends."""
+    return len(text.translate(_UNSPOKEN))
+
+class ChunkTimeline:
+    """The chunks of a narration in order, with the spoken weight and measured duration of each.
+
+    A duration may be None when it is only known for the file as a whole
+    (segments re-encoded together); ``fill`` shares what is left of the
+    total among those chunks by weight.
+    """
+
+    def __init__(self):
+        self.weights = []
+        self.durations = []
+        self._index = None
+
+    def __len__(self):
+        return len(self.weights)
+
+    def append(self, text, seconds):
+        self.weights.append(spoken_weight(text))
+        self.durations.append(seconds)
+        self._index = None
+
+    def fill(self, total_duration):
+        """Give the chunks without a measured duration their weighted share of the rest of ``total_duration``."""
+        unknown = sum(weight for weight, seconds in zip(self.weights, self.durations) if seconds is None)
+        rest = max(total_duration - sum(seconds for seconds in self.durations if seconds is not None), 0.0)
+        self.durations = [rest * weight / unknown if seconds is None and unknown else seconds or 0.0
+                          for weight, seconds in zip(self.weights, self.durations)]
+        self._index = None
+
+    def time_at(self, position):
+        """Seconds into the audio at which the character at spoken weight ``position`` is heard."""
+        if self._index is None:
+            self._index = (list(accumulate(self.weights)), [0.0, *accumulate(self.durations)])
+        ends, starts = self._index
+        i = bisect_right(ends, position)
+        if i == len(ends):
+            return starts[-1]
+        before = ends[i] - self.weights[i]
+        return starts[i] + self.durations[i] * (position - before) / self.weights[i]
+
+class LyricIndex:
+    def __init__(self, times, texts):
+        self.times = times
+        self.texts = texts
+
+    @classmethod
+    def from_lyrics(cls, lyrics):
+        rows = [(round(float(line['time']) * 1000), line['text']) for line in lyrics or ()]
+        if any(a[0] > b[0] for a, b in zip(rows, rows[1:])):
+            rows.sort(key=itemgetter(0))
+        return cls([time for time, _ in rows], [text for _, text in rows])
+
+    def __len__(self):
+        return len(self.times)
+
+    def line_at(self, ms):
+        """Index of the line playing at ``ms``, or -1 before the first line starts."""
+        return bisect_right(self.times, ms) - 1
+
+    def window(self, start_ms, end_ms, max_lines, before=0):
+        """Slice bounds ``(first, last)`` of the lines shown between ``start_ms`` and ``end_ms``.
+
+        The window starts ``before`` lines earlier than the line playing at
+        ``start_ms``, always includes that line (or the first one) and holds
+        at most ``max_lines`` lines.
+        """
+        playing = max(self.line_at(start_ms), 0)
+        first = max(playing - min(before, max_lines - 1), 0)
+        last = min(bisect_left(self.times, end_ms, lo=playing), first + max_lines)
+        return first, min(max(last, playing + 1), len(self.times))
+
+    def payload(self, start_ms, end_ms, max_lines, before=0):
+        """Columnar JSON-ready window: parallel ``t`` (ms) and ``text`` lists.
+
+        ``offset`` is the index of the window's first line in the whole book.
+        The window has every line that plays from ``start`` up to ``end``
+        (None at the end of the book).
+        """
+        first, last = self.window(start_ms, end_ms, max_lines, before)
+        return {
+            'offset': first,
+            'total': len(self.times),
+            'start': self.times[first] if first else 0,
+            'end': self.times[last] if last < len(self.times) else None,
+            't': self.times[first:last],
+            'text': self.texts[first:last],
+        }
+
+# Indexes kept per process by cached_index, most recently used last
+INDEX_CACHE_SIZE = 32
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+def cached_index(key, load):
+    """The LyricIndex for ``key``, built with ``LyricIndex.from_lyrics(load())`` only on a miss.
+
+    ``key`` must change whenever the lyrics do (the views use the ebook, its
+    audio version and ``lyrics_version``). Up to INDEX_CACHE_SIZE indexes are
+    kept, least recently used dropped first.
+    """
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = LyricIndex.from_lyrics(load())
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
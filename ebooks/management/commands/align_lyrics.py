@@ -0,0 +1,46 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ebooks.alignment import align_lyrics
+from ebooks.models import Ebook
+
+
+class Command(BaseCommand):
+    help = "Snap audiobooks' lyric times to the pauses in their audio."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ebook_ids', nargs='*', type=int,
+                            help='Ebooks to align (default: every audiobook with lyrics).')
+        parser.add_argument('--max-shift', type=float,
+                            default=getattr(settings, 'EBOOK_LYRICS_ALIGN_MAX_SHIFT', 1.5),
+                            help='Move a line at most this many seconds.')
+
+    def handle(self, *args, **options):
+        ebooks = Ebook.objects.exclude(audio_file='').exclude(audio_file=None).filter(lyrics__isnull=False)
+        if options['ebook_ids']:
+            ebooks = ebooks.filter(pk__in=options['ebook_ids'])
+        aligned = skipped = 0
+        audio_seconds = elapsed = 0.0
+        for ebook in ebooks.only('pk', 'audio_file', 'audio_duration', 'lyrics', 'lyrics_version').iterator():
+            path = ebook.audio_file.path
+            if not ebook.lyrics or not os.path.exists(path):
+                skipped += 1
+                continue
+            start = time.monotonic()
+            try:
+                lyrics, pauses = align_lyrics(path, ebook.lyrics, options['max_shift'])
+            except RuntimeError as e:
+                self.stderr.write(f"Skipping ebook {ebook.pk}: {e}")
+                skipped += 1
+                continue
+            taken = time.monotonic() - start
+            ebook.save(update_fields=ebook.set_lyrics(lyrics))
+            aligned += 1
+            elapsed += taken
+            audio_seconds += ebook.audio_duration or 0
+            self.stdout.write(f"Ebook {ebook.pk}: {len(ebook.lyrics)} lines, {pauses} pauses, {taken:.1f}s")
+        per_hour = f"; {elapsed / (audio_seconds / 3600):.1f}s per audio hour" if audio_seconds else ""
+        self.stdout.write(self.style.SUCCESS(f"Aligned {aligned} audiobooks; skipped {skipped}{per_hour}"))
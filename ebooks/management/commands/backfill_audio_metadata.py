@@ -0,0 +1,32 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from ebooks.models import Ebook
+from ebooks.utils import audio_metadata, generate_timed_lyrics_based_on_duration
+
+
+class Command(BaseCommand):
+    help = 'Store duration, bitrate, size and lyrics for audiobooks produced before they were recorded.'
+
+    def handle(self, *args, **options):
+        updated = skipped = 0
+        ebooks = Ebook.objects.exclude(audio_file='').exclude(audio_file=None).filter(audio_duration=None)
+        for ebook in ebooks.only('pk', 'audio_file', 'lyrics', 'lyrics_version', 'extracted_text').iterator():
+            path = ebook.audio_file.path
+            if not os.path.exists(path):
+                skipped += 1
+                continue
+            try:
+                ebook.audio_duration, ebook.audio_bitrate, ebook.audio_size = audio_metadata(path)
+            except ValueError as e:
+                self.stderr.write(f"Skipping ebook {ebook.pk}: {e}")
+                skipped += 1
+                continue
+            fields = ['audio_duration', 'audio_bitrate', 'audio_size']
+            if not ebook.lyrics:
+                lyrics = generate_timed_lyrics_based_on_duration(ebook.iter_text(), ebook.audio_duration)
+                fields.extend(ebook.set_lyrics(lyrics))
+            ebook.save(update_fields=fields)
+            updated += 1
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} audiobooks; skipped {skipped}"))
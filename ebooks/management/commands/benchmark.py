@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ebooks.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Run pipeline benchmarks and print their timings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', metavar='name',
+                            help=f"Benchmarks to run: {', '.join(sorted(BENCHMARKS))} (default: all).")
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Multiply the default workload size.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+        for name in options['names'] or sorted(BENCHMARKS):
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {name} =='))
+            BENCHMARKS[name](self.stdout.write, scale=options['scale'])
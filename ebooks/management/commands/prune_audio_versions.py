@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ebooks.utils import prune_audio_versions
+
+
+class Command(BaseCommand):
+    help = 'Delete superseded audiobook versions once their grace period has passed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-seconds', type=int,
+                            default=getattr(settings, 'EBOOK_AUDIO_VERSION_GRACE_SECONDS', 24 * 60 * 60),
+                            help='Keep a superseded version this long after it was replaced.')
+
+    def handle(self, *args, **options):
+        removed = prune_audio_versions(grace=options['grace_seconds'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} superseded audio versions"))
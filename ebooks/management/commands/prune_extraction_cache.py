@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from ebooks.cache import prune_extraction_cache
+from ebooks.models import ExtractionCacheEntry
+
+
+class Command(BaseCommand):
+    help = 'Remove least recently used entries from the PDF extraction cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-entries', type=int,
+                            default=getattr(settings, 'EBOOK_EXTRACTION_CACHE_MAX_ENTRIES', None),
+                            help='Keep at most this many most recently used entries.')
+        parser.add_argument('--max-age-days', type=int,
+                            default=getattr(settings, 'EBOOK_EXTRACTION_CACHE_MAX_AGE_DAYS', None),
+                            help='Remove entries not used for this many days.')
+
+    def handle(self, *args, **options):
+        removed = prune_extraction_cache(options['max_entries'], options['max_age_days'])
+        totals = ExtractionCacheEntry.objects.aggregate(hits=Sum('hit_count'), size=Sum('size_bytes'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Removed {removed} entries; {ExtractionCacheEntry.objects.count()} remain "
+            f"({(totals['size'] or 0) / 1024 / 1024:.1f} MB, {totals['hits'] or 0} total hits)"
+        ))
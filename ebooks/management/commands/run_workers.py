@@ -0,0 +1,55 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from ebooks.jobs import default_worker_id, run_worker
+
+
+def _worker_main(poll_interval, burst):
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    run_worker(default_worker_id(), poll_interval=poll_interval, burst=burst, should_stop=lambda: bool(stopping))
+
+
+class Command(BaseCommand):
+    help = 'Run background workers that claim and process queued ebook jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Number of worker processes to run.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait before checking an empty queue again.')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once the queue is empty instead of waiting for new jobs.')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1:
+            raise CommandError('--concurrency must be at least 1')
+
+        if concurrency == 1:
+            self.stdout.write(f"Starting worker {default_worker_id()}")
+            _worker_main(options['poll_interval'], options['burst'])
+            return
+
+        # Children must open their own database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_worker_main, args=(options['poll_interval'], options['burst']))
+                     for _ in range(concurrency)]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {concurrency} workers: {', '.join(str(p.pid) for p in processes)}")
+
+        def forward(signum, frame):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        for process in processes:
+            process.join()
@@ -0,0 +1,187 @@
+"""Serving stored ebook files (PDFs and audio) over HTTP.
+
+``serve`` answers conditional requests (ETag and Last-Modified) with 304,
+honours single and multiple byte ranges (so an ``<audio>`` element can seek
+without re-downloading), and streams the file through FileResponse. Under a
+WSGI server with ``wsgi.file_wrapper`` (gunicorn, uWSGI), a whole file or a
+single range goes out with zero-copy ``sendfile``.
+
+With ``EBOOK_MEDIA_OFFLOAD`` set, the access check still happens here but
+the bytes are sent by the front-end server instead: ``'x-accel-redirect'``
+for nginx (an ``internal`` location at ``EBOOK_MEDIA_ACCEL_PREFIX`` aliased
+to MEDIA_ROOT) or ``'x-sendfile'`` for Apache's mod_xsendfile and lighttpd.
+"""
+import mimetypes
+import os
+import secrets
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+# Requests asking for more ranges than this get the whole file
+MAX_RANGES = 16
+CHUNK_SIZE = 64 * 1024
+
+def parse_range(header, size):
+    """Parse a ``Range: bytes=...`` header against a file of ``size`` bytes.
+
+    Returns a list of inclusive ``(start, end)`` ranges, in request order.
+    The list is empty if no range can be satisfied. Returns None when the
+    header is missing, malformed or asks for too many ranges, in which case
+    the whole file is served.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition('-')
+        if not dash or not (first.isdigit() or (not first and last.isdigit())) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            if int(last) > 0 and size > 0:
+                ranges.append((max(size - int(last), 0), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, min(int(last), size - 1) if last else size - 1))
+    return ranges
+
+class FileRange:
+    """A byte range of an open file that reads, seeks and reports its size like a whole file.
+
+    FileResponse takes its Content-Length from ``seek``/``tell``, and
+    ``fileno`` lets ``wsgi.file_wrapper`` sendfile just the range, starting at
+    the current offset.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.start = start
+        self.length = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        remaining = self.length - self.tell()
+        if remaining <= 0:
+            return b''
+        return self.file.read(remaining if size is None or size < 0 else min(size, remaining))
+
+    def tell(self):
+        return self.file.tell() - self.start
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_END:
+            offset += self.length
+        elif whence == os.SEEK_CUR:
+            offset += self.tell()
+        self.file.seek(self.start + min(max(offset, 0), self.length))
+        return self.tell()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+def _multipart_body(path, ranges, size, content_type, boundary):
+    with open(path, 'rb') as f:
+        for start, end in ranges:
+            yield _part_header(boundary, content_type, start, end, size)
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+            yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+def _part_header(boundary, content_type, start, end, size):
+    return (f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode()
+
+def _range_response(path, ranges, size, content_type):
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = FileResponse(FileRange(open(path, 'rb'), start, end - start + 1),
+                                status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return response
+
+    boundary = secrets.token_hex(16)
+    length = sum(len(_part_header(boundary, content_type, start, end, size)) + end - start + 1 + 2
+                 for start, end in ranges) + len(f'--{boundary}--\r\n')
+    response = StreamingHttpResponse(_multipart_body(path, ranges, size, content_type, boundary), status=206,
+                                     content_type=f'multipart/byteranges; boundary={boundary}')
+    response['Content-Length'] = length
+    return response
+
+def _offload(field_file, content_type):
+    mode = getattr(settings, 'EBOOK_MEDIA_OFFLOAD', None)
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'EBOOK_MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(field_file.name)
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = field_file.path
+    else:
+        raise ValueError(f"Unknown EBOOK_MEDIA_OFFLOAD {mode!r}; use 'x-accel-redirect' or 'x-sendfile'")
+    return response
+
+def serve(request, field_file, immutable=False):
+    """Return a response serving ``field_file`` (a stored FieldFile) for ``request``.
+
+    The caller is responsible for deciding whether the user may see the file.
+    Pass ``immutable`` only when the URL names content that never changes.
+    """
+    content_type = mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+    if getattr(settings, 'EBOOK_MEDIA_OFFLOAD', None):
+        response = _offload(field_file, content_type)
+    else:
+        path = field_file.path
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise Http404("File not found")
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = int(stat.st_mtime)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            ranges = parse_range(request.headers.get('Range'), size)
+            if_range = request.headers.get('If-Range')
+            if ranges is not None and if_range and if_range != etag \
+                    and parse_http_date_safe(if_range) != last_modified:
+                ranges = None  # the client's partial copy is stale; send it all
+            if ranges is None:
+                response = FileResponse(open(path, 'rb'), content_type=content_type)
+            elif ranges:
+                response = _range_response(path, ranges, size, content_type)
+            else:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(False, os.path.basename(field_file.name))
+    if immutable:
+        # Browsers (and, if allowed, shared caches) keep it for a year without revalidating
+        visibility = {'public': True} if getattr(settings, 'EBOOK_MEDIA_SHARED_CACHE', False) else {'private': True}
+        patch_cache_control(response, max_age=365 * 24 * 60 * 60, immutable=True, **visibility)
+    else:
+        # Files are only served after an access check, so shared caches must not keep them
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
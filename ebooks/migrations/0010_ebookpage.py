@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0009_alter_ebook_audio_file_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EbookPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.PositiveIntegerField()),
+                ('raw_text', models.TextField(blank=True)),
+                ('cleaned_text', models.TextField(blank=True)),
+                ('char_count', models.PositiveIntegerField(default=0)),
+                ('ebook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='ebooks.ebook')),
+            ],
+            options={
+                'ordering': ['page_number'],
+                'constraints': [models.UniqueConstraint(fields=('ebook', 'page_number'), name='unique_ebook_page')],
+            },
+        ),
+    ]
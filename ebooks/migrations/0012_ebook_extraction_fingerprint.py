@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0011_ebook_pdf_sha256_extractioncacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ebook',
+            name='extraction_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0012_ebook_extraction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('voice_style', models.CharField(choices=[('storytelling', 'Storytelling (Natural)'), ('narration', 'Clear Narration'), ('calm', 'Calm & Slow'), ('energetic', 'Energetic'), ('dramatic', 'Dramatic'), ('whisper', 'Whisper'), ('excited', 'Excited'), ('monotone', 'Monotone'), ('formal', 'Formal')], default='storytelling', max_length=20)),
+                ('accent', models.CharField(choices=[('us', 'US English'), ('uk', 'British English'), ('au', 'Australian English'), ('ca', 'Canadian English'), ('in', 'Indian English'), ('ie', 'Irish English'), ('za', 'South African English'), ('nz', 'New Zealand English')], default='us', max_length=2)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('ebook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='ebooks.ebook')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='job_status_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0014_processingjob_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='estimated_chars',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='processingjob',
+            index=models.Index(fields=['status', 'estimated_chars'], name='job_status_size_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0016_processingjob_cancel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ebook',
+            name='processing_stage',
+            field=models.CharField(blank=True, choices=[('extract', 'Extracting text'), ('synthesize', 'Generating speech'), ('combine', 'Combining audio'), ('finalize', 'Finalizing')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0017_ebook_processing_stage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ebook',
+            name='audio_bitrate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ebook',
+            name='audio_duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ebook',
+            name='audio_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-16 21:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0018_ebook_audio_metadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ebook',
+            index=models.Index(fields=['uploaded_by', 'upload_date', 'id'], name='ebook_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ebook',
+            index=models.Index(fields=['upload_date', 'id'], name='ebook_date_idx'),
+        ),
+    ]
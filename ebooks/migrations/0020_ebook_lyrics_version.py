@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ebooks', '0019_ebook_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ebook',
+            name='lyrics_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -1,6 +1,16 @@
+import os
+import re
+import time
+
 from django.db import models
+from django.db.models import Sum
+from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
 
+# Rendered audio is stored as ebooks/audio/<pk>/<first 16 hex digits of its SHA-256>.mp3 and never rewritten
+AUDIO_VERSION_RE = re.compile(r'[0-9a-f]{16}\.mp3')
+
 class Ebook(models.Model):
     VOICE_STYLES = [
         ('storytelling', 'Storytelling (Natural)'),
@@ -27,8 +37,14 @@ class Ebook(models.Model):
     
     title = models.CharField(max_length=200)
     pdf_file = models.FileField(upload_to='uploads/')
+    pdf_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
     extracted_text = models.TextField(blank=True)
+    extraction_fingerprint = models.CharField(max_length=64, blank=True)  # inputs of the stored pages, see utils.extraction_fingerprint
     audio_file = models.FileField(upload_to='uploads/', blank=True, null=True)
+    # Measured once when the audio is produced, so pages never have to open the file
+    audio_duration = models.FloatField(blank=True, null=True)  # seconds
+    audio_bitrate = models.PositiveIntegerField(blank=True, null=True)  # average bits per second
+    audio_size = models.PositiveBigIntegerField(blank=True, null=True)  # bytes
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
     upload_date = models.DateTimeField(auto_now_add=True)
     processing_status = models.CharField(max_length=20, default='uploaded', choices=[
@@ -37,12 +53,162 @@ class Ebook(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ])
-    progress = models.IntegerField(default=0)
+    progress = models.IntegerField(default=0)  # overall percent; see ebooks.progress for how stages map onto it
+    processing_stage = models.CharField(max_length=20, blank=True, choices=[
+        ('extract', 'Extracting text'),
+        ('synthesize', 'Generating speech'),
+        ('combine', 'Combining audio'),
+        ('finalize', 'Finalizing'),
+    ])
     voice_style = models.CharField(max_length=20, choices=VOICE_STYLES, default='storytelling')
     accent = models.CharField(max_length=2, choices=ACCENT_CHOICES, default='us')
     lyrics = models.JSONField(blank=True, null=True)  # Store timed lyrics as list of {"time": seconds, "text": "line"}
+    lyrics_version = models.PositiveBigIntegerField(default=0)  # set by set_lyrics; keys the cached LyricIndex
     background_animation = models.FileField(upload_to='uploads/', blank=True, null=True)
     background_voice = models.FileField(upload_to='uploads/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # The library is paged newest first by (upload_date, id), per uploader or across everyone
+            models.Index(fields=['uploaded_by', 'upload_date', 'id'], name='ebook_owner_date_idx'),
+            models.Index(fields=['upload_date', 'id'], name='ebook_date_idx'),
+        ]
+
     def __str__(self):
         return self.title
+
+    def audio_url(self):
+        """URL of the audio: a per-version URL that can be cached for good, if the file is versioned."""
+        name = os.path.basename(self.audio_file.name)
+        if self.audio_file.name == f'ebooks/audio/{self.pk}/{name}' and AUDIO_VERSION_RE.fullmatch(name):
+            return reverse('ebook_media_version', args=[self.pk, 'audio', name])
+        return reverse('ebook_media', args=[self.pk, 'audio'])
+
+    def set_lyrics(self, lyrics):
+        """Replace the lyrics and give them a new ``lyrics_version``; returns the fields to save.
+
+        Web processes keep the index of each book's lyrics in memory (see
+        ``lyrics.cached_index``) keyed by the version, so lyrics must only be
+        written through here. The version is the time of the change in
+        microseconds, so a writer holding a stale copy of the row still
+        picks a version nobody has used.
+        """
+        self.lyrics = lyrics
+        self.lyrics_version = max(time.time_ns() // 1000, self.lyrics_version + 1)
+        return ['lyrics', 'lyrics_version']
+
+    def audio_duration_display(self):
+        """Audio length as H:MM:SS (or M:SS), or '' if unknown."""
+        if self.audio_duration is None:
+            return ''
+        minutes, seconds = divmod(round(self.audio_duration), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+    def iter_text(self, chunk_size=100):
+        """Yield the cleaned text of the book page by page, in page order.
+
+        Falls back to ``extracted_text`` for books extracted before pages were
+        stored separately.
+        """
+        pages = self.pages.order_by('page_number').filter(char_count__gt=0)
+        found = False
+        for text in pages.values_list('cleaned_text', flat=True).iterator(chunk_size=chunk_size):
+            found = True
+            yield text
+        if not found and self.extracted_text:
+            yield self.extracted_text
+
+    def text_length(self):
+        """Total number of cleaned characters available for narration."""
+        total = self.pages.aggregate(total=Sum('char_count'))['total']
+        return total or len(self.extracted_text)
+
+    def text_preview(self, max_words=500):
+        """Return ``(text, truncated)`` with at most ``max_words`` words from the start of the book."""
+        words = []
+        for text in self.iter_text(chunk_size=10):
+            words.extend(text.split())
+            if len(words) > max_words:
+                return ' '.join(words[:max_words]) + ' ...', True
+        return ' '.join(words), False
+
+
+class EbookPage(models.Model):
+    """Text of a single PDF page, stored separately so long books are never truncated."""
+    ebook = models.ForeignKey(Ebook, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.PositiveIntegerField()
+    raw_text = models.TextField(blank=True)
+    cleaned_text = models.TextField(blank=True)
+    char_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['page_number']
+        constraints = [
+            models.UniqueConstraint(fields=['ebook', 'page_number'], name='unique_ebook_page'),
+        ]
+
+    def __str__(self):
+        return f"{self.ebook} p.{self.page_number}"
+
+
+class ExtractionCacheEntry(models.Model):
+    """Index row for a cached PDF extraction, keyed by content hash and extractor version.
+
+    The page texts themselves live in a gzip file under MEDIA_ROOT (see
+    ``ebooks.cache``); this row tracks usage for hit counting and LRU pruning.
+    """
+    sha256 = models.CharField(max_length=64)
+    extractor_version = models.CharField(max_length=50)
+    page_count = models.PositiveIntegerField(default=0)
+    size_bytes = models.PositiveBigIntegerField(default=0)
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sha256', 'extractor_version'], name='unique_extraction_cache_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.extractor_version})"
+
+
+class ProcessingJob(models.Model):
+    """A queued extraction/narration run for an ebook, executed by ``manage.py run_workers``."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    ebook = models.ForeignKey(Ebook, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    voice_style = models.CharField(max_length=20, choices=Ebook.VOICE_STYLES, default='storytelling')
+    accent = models.CharField(max_length=2, choices=Ebook.ACCENT_CHOICES, default='us')
+    worker = models.CharField(max_length=100, blank=True)  # id of the worker that claimed the job
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    estimated_chars = models.PositiveBigIntegerField(default=0)  # job size for shortest-job-first scheduling
+    # A running job belongs to its worker only until the lease expires; heartbeats extend it
+    lease_expires_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    checkpoint = models.JSONField(blank=True, null=True)  # where a retried attempt can resume, see utils.Checkpoint
+    cancel_requested = models.BooleanField(default=False)  # the running worker stops at its next check
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+            models.Index(fields=['status', 'estimated_chars'], name='job_status_size_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} for {self.ebook} ({self.status})"
@@ -0,0 +1,196 @@
+"""MP3 frame parsing and bitstream-level concatenation.
+
+Joining MP3 segments that share a sample rate and channel layout only
+requires copying their audio frames back to back, which avoids decoding,
+re-encoding (and its generation loss), and an ffmpeg process per segment. The
+frame count gives the exact duration in the same pass.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+# Header fields that must match across segments for frames to be concatenated
+StreamFormat = namedtuple('StreamFormat', 'version layer sample_rate channels')
+
+Frame = namedtuple('Frame', 'format length samples')
+
+_BITRATES = {  # kbps by (version is MPEG-1, layer), index 1..14
+    (True, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+_VERSIONS = {0b00: 2.5, 0b10: 2, 0b11: 1}
+_LAYERS = {0b01: 3, 0b10: 2, 0b11: 1}
+
+class Mp3FormatError(ValueError):
+    """The data is not MP3, or the segments cannot be joined without re-encoding."""
+
+# A stream repeats a handful of distinct headers, so a small cache hits almost always; it is
+# bounded because scanning junk or corrupt data looks up an endless variety of invalid ones
+@lru_cache(maxsize=1024)
+def parse_header(header):
+    """Return the Frame described by a 4-byte header, or None if it is not a valid header."""
+    frame = None
+    b1, b2, b3 = header[1], header[2], header[3]
+    version = _VERSIONS.get((b1 >> 3) & 0b11)
+    layer = _LAYERS.get((b1 >> 1) & 0b11)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0b11
+    if (header[0] == 0xFF and (b1 & 0xE0) == 0xE0 and version and layer
+            and 0 < bitrate_index < 15 and rate_index < 3):
+        bitrate = _BITRATES[(version == 1, layer)][bitrate_index - 1] * 1000
+        sample_rate = _SAMPLE_RATES[version][rate_index]
+        padding = (b2 >> 1) & 1
+        if layer == 1:
+            samples = 384
+            length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 576 if layer == 3 and version != 1 else 1152
+            length = samples // 8 * bitrate // sample_rate + padding
+        channels = 1 if (b3 >> 6) == 0b11 else 2
+        frame = Frame(StreamFormat(version, layer, sample_rate, channels), length, samples)
+    return frame
+
+def _id3v2_size(data):
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+def _is_info_frame(data, pos, frame):
+    """True for a Xing/Info/VBRI metadata frame, which carries no audio."""
+    fmt = frame.format
+    if fmt.layer != 3:
+        return False
+    if fmt.version == 1:
+        side_info = 17 if fmt.channels == 1 else 32
+    else:
+        side_info = 9 if fmt.channels == 1 else 17
+    tag = data[pos + 4 + side_info:pos + 8 + side_info]
+    return tag in (b'Xing', b'Info') or data[pos + 36:pos + 40] == b'VBRI'
+
+def _next_frame(data, pos, end):
+    """Find the next position at or after ``pos`` where two valid frames follow each other."""
+    while True:
+        pos = data.find(b'\xff', pos, end - 3)
+        if pos < 0:
+            return -1
+        frame = parse_header(data[pos:pos + 4])
+        if frame is not None:
+            following = pos + frame.length
+            if following == end or (following + 4 <= end and parse_header(data[following:following + 4])):
+                return pos
+        pos += 1
+
+def scan_frames(data):
+    """Locate the audio frames of one MP3 file.
+
+    Returns ``(runs, stream_format, sample_count)`` where ``runs`` is a list of
+    ``(start, end)`` byte ranges holding consecutive frames. ID3v2/ID3v1 tags,
+    Xing/Info/VBRI headers, junk between frames and a truncated last frame are
+    left out.
+    """
+    data = bytes(data)
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+
+    pos = _id3v2_size(data)
+    runs = []
+    stream_format = None
+    samples = 0
+    run_start = None
+    first = True
+    while pos + 4 <= end:
+        frame = parse_header(data[pos:pos + 4])
+        if frame is None or pos + frame.length > end:
+            if run_start is not None:
+                runs.append((run_start, pos))
+                run_start = None
+            if frame is not None:
+                break  # truncated last frame
+            pos = _next_frame(data, pos + 1, end)
+            if pos < 0:
+                break
+            continue
+
+        if stream_format is None:
+            stream_format = frame.format
+        elif frame.format != stream_format:
+            raise Mp3FormatError(f"Stream changes format mid-file: {stream_format} -> {frame.format}")
+
+        if first and _is_info_frame(data, pos, frame):
+            pos += frame.length
+            first = False
+            continue
+        first = False
+
+        if run_start is None:
+            run_start = pos
+        samples += frame.samples
+        pos += frame.length
+
+    if run_start is not None:
+        runs.append((run_start, pos))
+    if stream_format is None:
+        raise Mp3FormatError("No MPEG audio frames found")
+    return runs, stream_format, samples
+
+class FrameWriter:
+    """Append the audio frames of MP3 segments to ``output`` as they arrive.
+
+    Every segment must share the MPEG version, layer, sample rate and channel
+    count of the first; otherwise Mp3FormatError is raised before anything
+    from that segment is written.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.format = None
+        self.samples = 0
+        self.segments = 0
+
+    def append(self, segment):
+        """Append one segment, given as bytes or a file-like object, and return its duration in seconds."""
+        if hasattr(segment, 'read'):
+            segment.seek(0)
+            segment = segment.read()
+        runs, segment_format, segment_samples = scan_frames(segment)
+        if self.format is None:
+            self.format = segment_format
+        elif segment_format != self.format:
+            raise Mp3FormatError(f"Segment format {segment_format} does not match {self.format}")
+
+        view = memoryview(segment)
+        for start, stop in runs:
+            self.output.write(view[start:stop])
+        self.samples += segment_samples
+        self.segments += 1
+        return segment_samples / segment_format.sample_rate
+
+    @property
+    def duration(self):
+        """Seconds of audio written so far, from the frame count."""
+        return self.samples / self.format.sample_rate if self.format else 0.0
+
+def concatenate(segments, output):
+    """Copy the audio frames of each MP3 segment to ``output`` back to back.
+
+    ``segments`` are file-like objects (or bytes) in the format FrameWriter
+    accepts. Returns the total duration in seconds, computed from the frame count.
+    """
+    writer = FrameWriter(output)
+    for segment in segments:
+        writer.append(segment)
+    if writer.format is None:
+        raise Mp3FormatError("No segments to concatenate")
+    return writer.duration
+
+def duration(data):
+    """Duration in seconds of one MP3 file, from its frame count."""
+    _, stream_format, samples = scan_frames(data)
+    return samples / stream_format.sample_rate
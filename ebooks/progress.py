@@ -0,0 +1,89 @@
+"""Throttled, monotonic progress reporting for ebook processing."""
+import time
+
+from django.conf import settings
+
+from . import events
+from .models import Ebook
+
+# (stage, first percent, last percent) in processing order
+STAGES = [
+    ('extract', 0, 10),
+    ('synthesize', 10, 90),
+    ('combine', 90, 95),
+    ('finalize', 95, 100),
+]
+_STAGE_RANGES = {name: (start, end) for name, start, end in STAGES}
+
+class ProgressReporter:
+    """Writes an ebook's ``processing_stage`` and ``progress`` columns, and nothing else.
+
+    The overall percent never goes backwards during a run. Every change of
+    stage or percent is published as a progress event (a cache write, see
+    ``events``) for pages watching the conversion. Stage changes are
+    written straight away. Other updates are written once ``min_interval``
+    seconds have passed since the last write or the percent has moved by
+    ``min_step`` points. Each write is a single-row UPDATE of those two
+    columns, so it never rewrites the text or lyrics and never re-creates a
+    deleted row.
+    """
+
+    def __init__(self, ebook, min_interval=None, min_step=None, clock=time.monotonic):
+        self.ebook = ebook
+        if min_interval is None:
+            min_interval = getattr(settings, 'EBOOK_PROGRESS_MIN_INTERVAL', 2.0)
+        if min_step is None:
+            min_step = getattr(settings, 'EBOOK_PROGRESS_MIN_STEP', 5)
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.clock = clock
+        self.stage_name = ''
+        self.percent = 0
+        self.writes = 0
+        self._written = None
+        self._written_at = None
+        self._published = None
+
+    def stage(self, name, fraction=0.0):
+        """Enter ``name`` (one of STAGES) and write it immediately."""
+        self.stage_name = name
+        self._advance(fraction)
+        self._write()
+
+    def update(self, fraction):
+        """Report ``fraction`` (0..1) of the current stage as done; written only when due."""
+        self._advance(fraction)
+        self._publish()
+        if self._written is None or self.percent == self._written[1]:
+            return
+        if (self.percent - self._written[1] >= self.min_step
+                or self.clock() - self._written_at >= self.min_interval):
+            self._write()
+
+    def reset(self):
+        """Clear progress after a failed run."""
+        self.stage_name = ''
+        self.percent = 0
+        self._write()
+
+    def _advance(self, fraction):
+        start, end = _STAGE_RANGES[self.stage_name]
+        fraction = min(max(fraction, 0.0), 1.0)
+        self.percent = max(self.percent, int(start + (end - start) * fraction))
+
+    def _publish(self):
+        state = (self.stage_name, self.percent)
+        if state != self._published:
+            events.publish(self.ebook.pk, status='processing', stage=self.stage_name, progress=self.percent)
+            self._published = state
+
+    def _write(self):
+        self._publish()
+        state = (self.stage_name, self.percent)
+        if state == self._written:
+            return
+        Ebook.objects.filter(pk=self.ebook.pk).update(processing_stage=self.stage_name, progress=self.percent)
+        self.ebook.processing_stage, self.ebook.progress = state
+        self._written = state
+        self._written_at = self.clock()
+        self.writes += 1
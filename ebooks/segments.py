@@ -0,0 +1,112 @@
+"""Storage for synthesized audio segments while an audiobook is assembled."""
+import logging
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class SegmentStore:
+    """Ordered audio segments held in memory up to a byte budget, then on disk.
+
+    Once the in-memory segments would exceed ``memory_budget`` bytes, further
+    segments are written to a temp directory owned by this store (created
+    lazily under ``EBOOK_AUDIO_SPILL_DIR`` or the system temp dir). Iterating
+    yields one file-like object per segment, opening spilled files one at a
+    time, so assembling a book never holds more than the budget plus a single
+    segment. Use as a context manager, or call ``close()``, to remove the
+    spilled files.
+    """
+
+    def __init__(self, memory_budget=None, directory=None, suffix='.mp3'):
+        if memory_budget is None:
+            memory_budget = getattr(settings, 'EBOOK_AUDIO_MEMORY_BUDGET', 32 * 1024 * 1024)
+        self.memory_budget = memory_budget
+        self.parent_dir = directory or getattr(settings, 'EBOOK_AUDIO_SPILL_DIR', None)
+        self.suffix = suffix
+        self.directory = None
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self._segments = []  # bytes held in memory, or the path of a spilled segment
+
+    def append(self, audio):
+        """Add a segment given as bytes or a file-like object."""
+        if hasattr(audio, 'read'):
+            if isinstance(audio, BytesIO):
+                data = audio.getbuffer()
+            else:
+                audio.seek(0)
+                data = audio.read()
+        else:
+            data = audio
+
+        size = len(data)
+        if self.memory_bytes + size <= self.memory_budget:
+            self._segments.append(bytes(data))
+            self.memory_bytes += size
+        else:
+            path = self._spill_path(len(self._segments))
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._segments.append(path)
+            self.disk_bytes += size
+        if isinstance(data, memoryview):
+            data.release()
+
+    def adopt(self, path):
+        """Add an existing audio file as the next segment; the store takes ownership of it."""
+        target = self._spill_path(len(self._segments))
+        shutil.move(path, target)
+        self._segments.append(target)
+        self.disk_bytes += os.path.getsize(target)
+
+    def _spill_path(self, index):
+        if self.directory is None:
+            if self.parent_dir:
+                os.makedirs(self.parent_dir, exist_ok=True)
+            self.directory = tempfile.mkdtemp(prefix='ebook-segments-', dir=self.parent_dir)
+            logger.info(f"Audio segments exceed {self.memory_budget} bytes in memory; spilling to {self.directory}")
+        return os.path.join(self.directory, f'{index:06d}{self.suffix}')
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __iter__(self):
+        for segment in self._segments:
+            if isinstance(segment, bytes):
+                yield BytesIO(segment)
+            else:
+                with open(segment, 'rb') as f:
+                    yield f
+
+    def paths(self):
+        """Yield a filesystem path for every segment, spilling in-memory ones first.
+
+        For tools such as ffmpeg that only read files.
+        """
+        for index, segment in enumerate(self._segments):
+            if isinstance(segment, bytes):
+                path = self._spill_path(index)
+                with open(path, 'wb') as f:
+                    f.write(segment)
+                self._segments[index] = path
+                self.memory_bytes -= len(segment)
+                self.disk_bytes += len(segment)
+                segment = path
+            yield segment
+
+    def close(self):
+        self._segments = []
+        self.memory_bytes = self.disk_bytes = 0
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
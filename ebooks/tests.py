@@ -1,3 +1,1381 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from datetime import timedelta
+from functools import partialmethod
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import FileResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import alignment, cache, events, jobs, media, mp3, tts, utils
+from . import lyrics as lyrics_module
+from .lyrics import ChunkTimeline
+from .progress import ProgressReporter
+from .segments import SegmentStore
+from .benchmarks import legacy_clean_text_for_tts, make_sample_pdf, sample_text
+from .models import Ebook, EbookPage, ExtractionCacheEntry, ProcessingJob
+
+
+class PdfExtractionTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.pdf_path = make_sample_pdf(os.path.join(self.tmp.name, 'book.pdf'), pages=12, lines_per_page=5)
+
+    def test_process_mode_matches_thread_mode(self):
+        threaded = utils.extract_pdf_pages(self.pdf_path, mode='thread', workers=4)
+        pooled = utils.extract_pdf_pages(self.pdf_path, mode='process', workers=3)
+        self.assertEqual(len(pooled), 12)
+        self.assertEqual(pooled, threaded)
+        self.assertTrue(all(pooled))
+
+    def test_slow_page_times_out_to_empty_string(self):
+        real_extract = utils._extract_page
+        calls = []
+
+        def slow_on_third_page(page):
+            calls.append(page)
+            if len(calls) == 3:
+                time.sleep(2)
+            return real_extract(page)
+
+        with mock.patch.object(utils, '_extract_page', slow_on_third_page), \
+                self.assertLogs('ebooks.utils', 'WARNING'):
+            start, texts = utils._extract_page_range(self.pdf_path, 0, 5, page_timeout=0.2)
+
+        self.assertEqual(start, 0)
+        self.assertEqual(texts[2], "")
+        self.assertTrue(all(texts[:2] + texts[3:]))
+
+    def test_slow_consumer_is_not_interrupted_by_page_deadline(self):
+        pages = utils.iter_pdf_pages(self.pdf_path, mode='process', workers=1, page_timeout=0.2)
+        index, text = next(pages)
+        time.sleep(0.5)
+        self.assertEqual(index, 0)
+        self.assertTrue(text)
+        self.assertEqual(len(list(pages)), 11)
+
+    def test_heartbeat_while_waiting_on_slow_extraction(self):
+        real_extract = utils._extract_page
+
+        def slow_extract(page):
+            time.sleep(0.3)
+            return real_extract(page)
+
+        beats = []
+        with mock.patch.object(utils, '_extract_page', slow_extract), \
+                mock.patch.object(utils, 'EXTRACTION_HEARTBEAT_SECONDS', 0.05):
+            pages = list(utils.iter_pdf_pages(self.pdf_path, mode='thread', workers=12,
+                                              heartbeat=lambda: beats.append(1)))
+        self.assertEqual(len(pages), 12)
+        self.assertGreaterEqual(len(beats), 3)
+
+
+class EbookFixtureMixin:
+    """Point MEDIA_ROOT at a temp dir, keep progress events in memory, and build ebooks from generated PDFs."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        override = override_settings(MEDIA_ROOT=self.tmp.name, EBOOK_EXTRACTION_MODE='thread',
+                                     EBOOK_PROGRESS_CACHE='default')
+        override.enable()
+        self.addCleanup(override.disable)
+        caches['default'].clear()
+
+    def make_ebook(self, pages):
+        pdf_path = make_sample_pdf(os.path.join(self.tmp.name, 'src.pdf'), pages=pages, lines_per_page=30)
+        with open(pdf_path, 'rb') as f:
+            return Ebook.objects.create(title='Long book', pdf_file=File(f, name='book.pdf'))
+
+
+class EbookPageStorageTests(EbookFixtureMixin, TestCase):
+    def test_long_book_is_stored_per_page_without_truncation(self):
+        ebook = self.make_ebook(pages=40)
+        self.assertEqual(utils.extract_text_from_pdf(ebook, batch_size=16), 40)
+
+        pages = list(ebook.pages.all())
+        self.assertEqual([p.page_number for p in pages], list(range(1, 41)))
+        self.assertGreater(ebook.text_length(), 50000)
+        self.assertEqual(ebook.text_length(), sum(len(t) for t in ebook.iter_text()))
+        self.assertEqual(ebook.extracted_text, "")
+
+    def test_reextraction_replaces_pages(self):
+        ebook = self.make_ebook(pages=3)
+        utils.extract_text_from_pdf(ebook)
+        utils.extract_text_from_pdf(ebook)
+        self.assertEqual(ebook.pages.count(), 3)
+
+    def test_interrupted_replacement_does_not_look_current(self):
+        ebook = self.make_ebook(pages=3)
+        utils.extract_text_from_pdf(ebook)
+        stream = utils.store_pages(ebook, [(0, "Only the first page.")])
+        next(stream)  # old pages deleted, new ones not yet stored
+        ebook.refresh_from_db()
+        self.assertEqual(ebook.extraction_fingerprint, "")
+        self.assertEqual(utils.extract_text_from_pdf(ebook), 3)
+
+    def test_legacy_extracted_text_is_still_readable(self):
+        ebook = Ebook.objects.create(title='Old', pdf_file='uploads/old.pdf', extracted_text='Hello there.')
+        self.assertEqual(list(ebook.iter_text()), ['Hello there.'])
+        self.assertEqual(ebook.text_length(), 12)
+
+
+class ExtractionCacheTests(EbookFixtureMixin, TestCase):
+    def test_second_extraction_of_same_pdf_skips_pypdf2(self):
+        first = self.make_ebook(pages=5)
+        utils.extract_text_from_pdf(first)
+        second = self.make_ebook(pages=5)
+        self.assertEqual(second.pdf_sha256, "")
+
+        with mock.patch.object(utils, 'iter_pdf_pages', side_effect=AssertionError('PyPDF2 called')):
+            self.assertEqual(utils.extract_text_from_pdf(second), 5)
+
+        self.assertEqual(second.pdf_sha256, first.pdf_sha256)
+        self.assertEqual(list(second.iter_text()), list(first.iter_text()))
+        entry = ExtractionCacheEntry.objects.get()
+        self.assertEqual((entry.page_count, entry.hit_count), (5, 1))
+
+    def test_failed_extraction_leaves_no_cache_entry(self):
+        ebook = self.make_ebook(pages=2)
+
+        def broken_pages(path, **kwargs):
+            yield 0, "text"
+            raise RuntimeError("corrupt")
+
+        with mock.patch.object(utils, 'iter_pdf_pages', broken_pages), self.assertRaises(RuntimeError), \
+                self.assertLogs('ebooks.utils', 'ERROR'):
+            utils.extract_text_from_pdf(ebook)
+        self.assertFalse(ExtractionCacheEntry.objects.exists())
+        self.assertEqual(os.listdir(os.path.dirname(cache.extraction_cache_path(ebook.pdf_sha256, utils.EXTRACTOR_VERSION))), [])
+
+    def test_regenerate_skips_extraction_when_fingerprint_unchanged(self):
+        ebook = self.make_ebook(pages=3)
+        utils.extract_text_from_pdf(ebook)
+        ebook.refresh_from_db()
+        self.assertEqual(ebook.extraction_fingerprint, utils.extraction_fingerprint(ebook))
+
+        with mock.patch.object(utils, 'cached_pages', side_effect=AssertionError('re-extracted')):
+            self.assertEqual(utils.extract_text_from_pdf(ebook), 3)
+
+        with mock.patch.object(utils, 'CLEANER_VERSION', utils.CLEANER_VERSION + 1), \
+                mock.patch.object(utils, 'iter_pdf_pages', side_effect=AssertionError('PyPDF2 called')):
+            self.assertEqual(utils.extract_text_from_pdf(ebook), 3)
+        self.assertEqual(ExtractionCacheEntry.objects.get().hit_count, 1)
+
+    def test_prune_removes_least_recently_used(self):
+        for n, sha in enumerate(['a' * 64, 'b' * 64, 'c' * 64]):
+            list(cache.cache_pages([(0, sha)], sha, 'v1'))
+            ExtractionCacheEntry.objects.filter(sha256=sha).update(last_used_at=timezone.now() + timedelta(minutes=n))
+
+        self.assertEqual(cache.prune_extraction_cache(max_entries=1), 2)
+        self.assertEqual(list(ExtractionCacheEntry.objects.values_list('sha256', flat=True)), ['c' * 64])
+        self.assertIsNone(cache.cached_pages('a' * 64, 'v1'))
+        self.assertEqual(list(cache.cached_pages('c' * 64, 'v1')), [(0, 'c' * 64)])
+
+    def test_upload_is_hashed_while_streamed(self):
+        payload = b'%PDF-1.4 ' + os.urandom(4096)
+        request = RequestFactory().post('/', {'pdf_file': SimpleUploadedFile('a.pdf', payload)})
+        self.assertEqual(request.FILES['pdf_file'].sha256, hashlib.sha256(payload).hexdigest())
+
+
+class CleanTextTests(SimpleTestCase):
+    golden_path = os.path.join(os.path.dirname(__file__), 'testdata', 'clean_text_golden.json')
+
+    def test_golden_corpus(self):
+        with open(self.golden_path) as f:
+            cases = json.load(f)
+        for case in cases:
+            with self.subTest(text=case['input'][:40]):
+                self.assertEqual(utils.clean_text_for_tts(case['input']), case['expected'])
+
+    def test_matches_legacy_cleaner_on_random_text(self):
+        rng = random.Random(1234)
+        alphabet = 'aZ9 \n\t.,!?;:-_()"\'\u00e9\u00a0\u2028\u0663\u00b2\u200b\U0001F600xyQ0'
+        for _ in range(500):
+            text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+            self.assertEqual(utils.clean_text_for_tts(text), legacy_clean_text_for_tts(text), repr(text))
+
+    def test_iter_clean_text_cleans_each_page(self):
+        pages = ["firstPage  text", "second\npage2"]
+        self.assertEqual(list(utils.iter_clean_text(iter(pages))),
+                         [utils.clean_text_for_tts(p) for p in pages])
+
+
+class ConcurrentSynthesisTests(SimpleTestCase):
+    def fake_backend(self, latency):
+        """Return a synthesize() that sleeps ``latency(chunk)`` seconds, tracking concurrency."""
+        state = {'active': 0, 'peak': 0}
+
+        def synthesize(chunk):
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            time.sleep(latency(chunk))
+            state['active'] -= 1
+            if chunk == 'boom':
+                raise RuntimeError('backend error')
+            return chunk.upper()
+
+        return synthesize, state
+
+    def test_results_are_reassembled_in_chunk_order(self):
+        chunks = [f'chunk {i}' for i in range(12)]
+        # Later chunks finish first
+        synthesize, state = self.fake_backend(lambda chunk: 0.05 - int(chunk.split()[1]) * 0.004)
+        completed = []
+
+        start = time.perf_counter()
+        results = list(utils.synthesize_chunks(iter(chunks), synthesize, workers=4,
+                                               on_complete=lambda chunk, audio: completed.append(chunk)))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(results, [(c, c.upper()) for c in chunks])
+        self.assertEqual(sorted(completed), sorted(chunks))
+        self.assertEqual(state['peak'], 4)
+        self.assertLess(elapsed, sum(0.05 - i * 0.004 for i in range(12)) / 2)
+
+    def test_failed_chunk_is_yielded_without_audio(self):
+        synthesize, _ = self.fake_backend(lambda chunk: 0.001)
+        with self.assertLogs('ebooks.utils', 'WARNING'):
+            results = list(utils.synthesize_chunks(['a', 'boom', 'b'], synthesize, workers=2))
+        self.assertEqual(results, [('a', 'A'), ('boom', None), ('b', 'B')])
+
+
+class TTSBackendTests(SimpleTestCase):
+    def test_registry_and_settings(self):
+        with override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={'fake': {'latency': 0.25}}):
+            backend = tts.get_backend()
+        self.assertIsInstance(backend, tts.FakeBackend)
+        self.assertEqual(backend.latency, 0.25)
+        self.assertIsInstance(tts.get_backend('ebooks.tts.GTTSBackend'), tts.GTTSBackend)
+        with self.assertRaises(ImproperlyConfigured):
+            tts.get_backend('nope')
+
+    def test_gtts_voice_params_match_original_voice_configs(self):
+        backend = tts.GTTSBackend()
+        self.assertEqual(backend.voice_params('storytelling', 'au'), {'lang': 'en', 'tld': 'com.au', 'slow': False})
+        self.assertEqual(backend.voice_params('narration', 'uk'), {'lang': 'en', 'tld': 'com', 'slow': False})
+        self.assertEqual(backend.voice_params('calm', None), {'lang': 'en', 'tld': 'co.uk', 'slow': True})
+        self.assertEqual(backend.voice_params('unknown', 'in'), {'lang': 'en', 'tld': 'co.in', 'slow': False})
+
+    def test_espeak_voice_params(self):
+        params = tts.EspeakBackend().voice_params('whisper', 'uk')
+        self.assertEqual(params['voice'], 'en-gb+whisper')
+        self.assertEqual(params['speed'], 130)
+
+    def test_fake_backend_output_has_predictable_length(self):
+        backend = tts.FakeBackend(seconds_per_word=0.5)
+        mp3 = backend.synthesize('one two three four').read()
+        self.assertEqual(len(mp3) % len(backend.MP3_FRAME), 0)
+        frames = len(mp3) // len(backend.MP3_FRAME)
+        self.assertAlmostEqual(frames * 576 / 24000, 2.0, delta=0.024)
+        self.assertEqual(backend.duration_for('one two three four'), frames * 576 / 24000)
+
+        wav = tts.FakeBackend(audio_format='wav').synthesize('one two', slow=True)
+        with wave.open(wav) as w:
+            self.assertAlmostEqual(w.getnframes() / w.getframerate(), 1.2, delta=0.024)
+
+
+@override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={})
+class GenerateAudiobookTests(EbookFixtureMixin, TestCase):
+    def test_generates_audio_and_lyrics_offline(self):
+        ebook = self.make_ebook(pages=4)
+        utils.extract_text_from_pdf(ebook)
+        backend = tts.FakeBackend()
+        expected = sum(backend.duration_for(chunk, slow=True)
+                       for chunk in utils.iter_text_chunks(ebook.iter_text(), 1500))
+
+        with mock.patch.object(tts.FakeBackend, 'max_chunk_chars', 1500), \
+                mock.patch.object(utils, 'AudioFileClip', side_effect=AssertionError('ffmpeg used')):
+            utils.generate_audiobook(ebook, voice_style='calm', accent='uk')
+
+        ebook.refresh_from_db()
+        self.assertEqual(ebook.progress, 100)
+        with open(ebook.audio_file.path, 'rb') as f:
+            self.assertAlmostEqual(mp3.duration(f.read()), expected)
+        self.assertTrue(ebook.lyrics)
+        # The fake voice speaks 0.6 s per word here, so each line should start near its word count so far
+        words, worst = 0, 0
+        for line in ebook.lyrics:
+            worst = max(worst, abs(line['time'] - words * 0.6))
+            words += len(line['text'].split())
+        self.assertLess(worst, 3)
+        self.assertAlmostEqual(ebook.audio_duration, expected)
+        self.assertEqual(ebook.audio_size, os.path.getsize(ebook.audio_file.path))
+        self.assertAlmostEqual(ebook.audio_bitrate, ebook.audio_size * 8 / expected, delta=1)
+
+
+    @override_settings(EBOOK_LYRICS_ALIGN=True)
+    def test_lyrics_alignment_failure_keeps_estimated_times(self):
+        ebook = self.make_ebook(pages=1)
+        utils.extract_text_from_pdf(ebook)
+        with mock.patch.object(utils, 'align_lyrics', side_effect=RuntimeError('no ffmpeg')) as align, \
+                self.assertLogs('ebooks.utils', 'WARNING'):
+            utils.generate_audiobook(ebook)
+
+        ebook.refresh_from_db()
+        self.assertEqual(align.call_args.args[0], ebook.audio_file.path)
+        self.assertEqual(ebook.lyrics, align.call_args.args[1])
+        self.assertTrue(ebook.lyrics)
+
+    @override_settings(EBOOK_TTS_WORKERS=2, EBOOK_TTS_CACHE_MAX_BYTES=0, EBOOK_AUDIO_MEMORY_BUDGET=256 * 1024)
+    def test_peak_memory_stays_bounded_by_budget_not_book_length(self):
+        ebook = self.make_ebook(pages=14)
+        utils.extract_text_from_pdf(ebook)
+
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        with mock.patch.object(tts.FakeBackend, 'max_chunk_chars', 200):
+            utils.generate_audiobook(ebook)
+        _, peak = tracemalloc.get_traced_memory()
+
+        ebook.refresh_from_db()
+        audio_size = os.path.getsize(ebook.audio_file.path)
+        self.assertGreater(audio_size, 5 * 1024 * 1024)
+        self.assertLess(peak, 1536 * 1024)
+        self.assertEqual(os.listdir(os.path.dirname(ebook.audio_file.path)), [os.path.basename(ebook.audio_file.path)])
+
+
+@override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={}, EBOOK_TTS_WORKERS=2)
+class PipelineTests(EbookFixtureMixin, TestCase):
+    def test_synthesis_starts_before_extraction_finishes(self):
+        ebook = self.make_ebook(pages=6)
+        events = []
+        extract = utils.iter_pdf_pages
+        synthesize = tts.FakeBackend.synthesize
+
+        def recording_extract(*args, **kwargs):
+            for index, text in extract(*args, **kwargs):
+                events.append('page')
+                yield index, text
+
+        def recording_synthesize(backend, text, **params):
+            events.append('chunk')
+            return synthesize(backend, text, **params)
+
+        with mock.patch.object(utils, 'iter_pdf_pages', recording_extract), \
+                mock.patch.object(tts.FakeBackend, 'synthesize', recording_synthesize), \
+                mock.patch.object(tts.FakeBackend, 'max_chunk_chars', 500):
+            self.assertEqual(utils.process_ebook(ebook), 6)
+
+        self.assertLess(events.index('chunk'), len(events) - 1 - events[::-1].index('page'))
+        ebook.refresh_from_db()
+        self.assertEqual(ebook.pages.count(), 6)
+        self.assertEqual(ebook.extraction_fingerprint, utils.extraction_fingerprint(ebook))
+        self.assertTrue(ebook.lyrics)
+
+    def test_pipelined_output_matches_sequential(self):
+        ebook = self.make_ebook(pages=3)
+        utils.process_ebook(ebook, pipelined=True)
+        ebook.refresh_from_db()
+        with open(ebook.audio_file.path, 'rb') as f:
+            pipelined_audio = f.read()
+        pipelined_lyrics = ebook.lyrics
+
+        utils.process_ebook(ebook, pipelined=False)
+        ebook.refresh_from_db()
+        with open(ebook.audio_file.path, 'rb') as f:
+            self.assertEqual(f.read(), pipelined_audio)
+        self.assertEqual(ebook.lyrics, pipelined_lyrics)
+
+    def test_pages_are_reordered_for_narration(self):
+        pages = [(2, 'c'), (0, 'a'), (3, 'd'), (1, 'b')]
+        self.assertEqual(list(utils.in_page_order(pages)), [(0, 'a'), (1, 'b'), (2, 'c'), (3, 'd')])
+
+
+@override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={})
+class JobQueueTests(EbookFixtureMixin, TestCase):
+    def test_upload_only_enqueues(self):
+        pdf_path = make_sample_pdf(os.path.join(self.tmp.name, 'up.pdf'), pages=1, lines_per_page=3)
+        with open(pdf_path, 'rb') as f:
+            upload = SimpleUploadedFile('up.pdf', f.read(), content_type='application/pdf')
+
+        with mock.patch.object(jobs, 'process_ebook') as process:
+            response = self.client.post('/ebooks/upload/', {
+                'title': 'Queued', 'pdf_file': upload, 'voice_style': 'calm', 'accent': 'uk'})
+        self.assertEqual(response.status_code, 302)
+        process.assert_not_called()
+
+        job = ProcessingJob.objects.get()
+        self.assertEqual((job.status, job.voice_style, job.accent), ('queued', 'calm', 'uk'))
+        self.assertEqual(job.ebook.processing_status, 'processing')
+
+    def test_claim_is_exclusive_and_oldest_first(self):
+        first = jobs.enqueue(Ebook.objects.create(title='A', pdf_file='uploads/a.pdf'))
+        second = jobs.enqueue(Ebook.objects.create(title='B', pdf_file='uploads/b.pdf'))
+
+        self.assertEqual(jobs.claim_job('w1').pk, first.pk)
+        self.assertEqual(jobs.claim_job('w2').pk, second.pk)
+        self.assertIsNone(jobs.claim_job('w3'))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.worker, first.attempts), ('running', 'w1', 1))
+
+    def test_burst_worker_processes_queued_jobs(self):
+        ebook = self.make_ebook(pages=2)
+        job = jobs.enqueue(ebook)
+        call_command('run_workers', burst=True, stdout=StringIO())
+
+        job.refresh_from_db()
+        ebook.refresh_from_db()
+        self.assertEqual(job.status, 'completed')
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(ebook.processing_status, 'completed')
+        self.assertTrue(ebook.audio_file)
+
+    def test_failed_job_records_error(self):
+        ebook = Ebook.objects.create(title='Missing', pdf_file='uploads/missing.pdf')
+        job = jobs.enqueue(ebook)
+        self.assertEqual(jobs.run_worker('w1', burst=True), 1)
+
+        job.refresh_from_db()
+        ebook.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.error)
+        self.assertEqual(ebook.processing_status, 'failed')
+
+
+@override_settings(EBOOK_JOB_MAX_RUNNING=None, EBOOK_JOB_MAX_RUNNING_PER_USER=2)
+class SchedulerTests(EbookFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def enqueue(self, user, chars):
+        ebook = Ebook.objects.create(title=f'{user} {chars}', pdf_file='uploads/x.pdf', uploaded_by=user)
+        with mock.patch.object(jobs, 'estimate_job_chars', return_value=chars):
+            return jobs.enqueue(ebook)
+
+    def test_users_take_turns_and_short_jobs_go_first(self):
+        a_long = self.enqueue(self.alice, 1000)
+        a_short = self.enqueue(self.alice, 50)
+        a_medium = self.enqueue(self.alice, 500)
+        b_huge = self.enqueue(self.bob, 9999)
+
+        queued, _ = jobs.scheduled_queue()
+        self.assertEqual([pk for pk, _ in queued], [a_short.pk, b_huge.pk, a_medium.pk, a_long.pk])
+        self.assertEqual(jobs.queue_position(a_long), 4)
+
+        claimed = [jobs.claim_job('w').pk for _ in range(3)]
+        self.assertEqual(claimed, [a_short.pk, b_huge.pk, a_medium.pk])
+        # Alice already has two jobs running
+        self.assertIsNone(jobs.claim_job('w'))
+        a_long.refresh_from_db()
+        self.assertEqual(jobs.queue_position(a_long), 1)
+
+    def test_a_user_with_fewer_running_jobs_goes_first(self):
+        self.enqueue(self.alice, 10)
+        jobs.claim_job('w')
+        self.enqueue(self.alice, 20)
+        bob_job = self.enqueue(self.bob, 5000)
+        self.assertEqual(jobs.claim_job('w').pk, bob_job.pk)
+
+    @override_settings(EBOOK_JOB_MAX_RUNNING=1)
+    def test_global_cap(self):
+        self.enqueue(self.alice, 10)
+        self.enqueue(self.bob, 10)
+        self.assertIsNotNone(jobs.claim_job('w'))
+        self.assertIsNone(jobs.claim_job('w'))
+
+    def test_status_endpoint_reports_queue_position(self):
+        self.enqueue(self.bob, 10)
+        job = self.enqueue(self.alice, 100)
+        response = self.client.get(f'/ebooks/{job.ebook.pk}/status/')
+        self.assertEqual(response.json()['queue_position'], 2)
+
+        jobs.claim_job('w')
+        jobs.claim_job('w')
+        self.assertIsNone(self.client.get(f'/ebooks/{job.ebook.pk}/status/').json()['queue_position'])
+
+    def test_unextracted_pdf_is_sized_without_parsing_it(self):
+        ebook = self.make_ebook(pages=3)
+        with mock.patch.object(utils.PdfReader, '__init__', side_effect=AssertionError('PDF parsed')):
+            job = jobs.enqueue(ebook)
+        self.assertEqual(job.estimated_chars, ebook.pdf_file.size // jobs.PDF_BYTES_PER_CHAR_ESTIMATE)
+        utils.extract_text_from_pdf(ebook)
+        self.assertEqual(jobs.estimate_job_chars(ebook), ebook.text_length())
+
+
+@override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={}, EBOOK_TTS_WORKERS=1,
+                   EBOOK_TTS_CACHE_MAX_BYTES=0, EBOOK_JOB_CANCEL_CHECK_SECONDS=0)
+class JobCancellationTests(EbookFixtureMixin, TestCase):
+    def test_regenerate_requests_coalesce_into_the_queued_job(self):
+        ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf')
+        first = jobs.enqueue(ebook)
+        ebook.voice_style, ebook.accent = 'calm', 'uk'
+        second = jobs.enqueue(ebook)
+
+        self.assertEqual(first.pk, second.pk)
+        job = ProcessingJob.objects.get()
+        self.assertEqual((job.voice_style, job.accent), ('calm', 'uk'))
+
+    def test_regenerate_supersedes_the_running_job(self):
+        ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf')
+        jobs.enqueue(ebook)
+        running = jobs.claim_job('w1')
+        newer = jobs.enqueue(ebook)
+
+        running.refresh_from_db()
+        self.assertTrue(running.cancel_requested)
+        self.assertNotEqual(newer.pk, running.pk)
+        # The new job waits until the old one has stopped
+        self.assertIsNone(jobs.claim_job('w2'))
+        ProcessingJob.objects.filter(pk=running.pk).update(status='cancelled')
+        self.assertEqual(jobs.claim_job('w2').pk, newer.pk)
+
+    def run_and_interrupt(self, ebook, interrupt, after_chunks=3):
+        calls = []
+        synthesize = tts.FakeBackend.synthesize
+        heartbeat = jobs.JobCheckpoint.heartbeat
+
+        def counting_synthesize(backend, text, **params):
+            calls.append(text)
+            return synthesize(backend, text, **params)
+
+        def interrupting_heartbeat(checkpoint):
+            if len(calls) == after_chunks:
+                interrupt()
+            return heartbeat(checkpoint)
+
+        jobs.enqueue(ebook)
+        with mock.patch.object(tts.FakeBackend, 'max_chunk_chars', 300), \
+                mock.patch.object(tts.FakeBackend, 'synthesize', counting_synthesize), \
+                mock.patch.object(jobs.JobCheckpoint, 'heartbeat', interrupting_heartbeat):
+            job = jobs.run_job(jobs.claim_job('w1'))
+        return job, calls
+
+    def test_cancel_stops_between_chunks_without_output(self):
+        ebook = self.make_ebook(pages=2)
+        utils.extract_text_from_pdf(ebook)
+        total_chunks = len(list(utils.iter_text_chunks(ebook.iter_text(), 300)))
+
+        job, calls = self.run_and_interrupt(ebook, lambda: jobs.cancel_jobs(ebook))
+
+        self.assertEqual(job.status, 'cancelled')
+        self.assertLess(len(calls), total_chunks // 2)
+        ebook.refresh_from_db()
+        self.assertEqual(ebook.processing_status, 'failed')
+        self.assertFalse(ebook.audio_file)
+        self.assertEqual(os.listdir(utils.audio_version_dir(ebook.pk)), [])
+
+    def test_delete_cancels_running_work(self):
+        ebook = self.make_ebook(pages=2)
+        utils.extract_text_from_pdf(ebook)
+
+        job, calls = self.run_and_interrupt(ebook, lambda: self.client.post(f'/ebooks/{ebook.pk}/delete/'))
+
+        self.assertEqual(job.status, 'cancelled')
+        self.assertFalse(Ebook.objects.filter(pk=ebook.pk).exists())
+        self.assertFalse(ProcessingJob.objects.exists())
+        self.assertEqual(os.listdir(utils.audio_version_dir(ebook.pk)), [])
+
+
+class EbookDetailTests(EbookFixtureMixin, TestCase):
+    def make_audiobook(self):
+        ebook = self.make_ebook(pages=2)
+        utils.extract_text_from_pdf(ebook)
+        os.makedirs(os.path.join(self.tmp.name, 'ebooks', 'audio'))
+        with open(os.path.join(self.tmp.name, 'ebooks', 'audio', 'book.mp3'), 'wb') as f:
+            f.write(tts.FakeBackend().synthesize('word ' * 200).getvalue())  # 80 seconds
+        Ebook.objects.filter(pk=ebook.pk).update(audio_file='ebooks/audio/book.mp3', processing_status='completed')
+        return Ebook.objects.get(pk=ebook.pk)
+
+    def test_detail_page_only_reads(self):
+        ebook = self.make_audiobook()
+        ebook.audio_duration, ebook.audio_bitrate, ebook.audio_size = utils.audio_metadata(ebook.audio_file.path)
+        ebook.lyrics = [{'time': 0.0, 'text': 'stored line'}]
+        ebook.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/ebooks/{ebook.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q['sql'] for q in queries if not q['sql'].startswith('SELECT')], [])
+        # Lyrics are fetched by the player a window at a time, not rendered into the page
+        self.assertNotContains(response, 'stored line')
+        self.assertContains(response, f'data-url="/ebooks/{ebook.pk}/lyrics/"')
+        self.assertContains(response, 'Length: 1:20')
+
+    def test_backfill_measures_existing_audiobooks(self):
+        ebook = self.make_audiobook()
+        call_command('backfill_audio_metadata', stdout=StringIO())
+
+        ebook.refresh_from_db()
+        self.assertAlmostEqual(ebook.audio_duration, 80.0, delta=0.05)
+        self.assertEqual(ebook.audio_size, os.path.getsize(ebook.audio_file.path))
+        self.assertTrue(ebook.lyrics)
+
+
+@override_settings(EBOOK_LYRICS_WINDOW_SECONDS=60, EBOOK_LYRICS_WINDOW_MAX_LINES=10)
+class LyricsWindowTests(TestCase):
+    def setUp(self):
+        # A line every 5 seconds, stored out of order to check the index sorts them
+        lyrics = [{'time': i * 5, 'text': f'line {i}'} for i in range(100)]
+        lyrics[3], lyrics[4] = lyrics[4], lyrics[3]
+        self.ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf', lyrics=lyrics)
+        self.addCleanup(lyrics_module._index_cache.clear)
+
+    def window(self, **params):
+        response = self.client.get(f'/ebooks/{self.ebook.pk}/lyrics/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_window_starts_at_the_playing_line(self):
+        data = self.window(start=12_000, end=27_000)
+        self.assertEqual(data, {'offset': 2, 'total': 100, 'start': 10_000, 'end': 30_000,
+                                't': [10_000, 15_000, 20_000, 25_000],
+                                'text': ['line 2', 'line 3', 'line 4', 'line 5']})
+        self.assertEqual(self.window(start=12_000, end=27_000, before=2)['offset'], 0)
+
+    def test_window_is_capped_and_ends_with_the_book(self):
+        data = self.window(start=0)
+        self.assertEqual((data['offset'], len(data['t']), data['end']), (0, 10, 50_000))
+        data = self.window(start=490_000)
+        self.assertEqual((data['offset'], data['text'], data['end']), (98, ['line 98', 'line 99'], None))
+        data = self.window(start=10_000_000)
+        self.assertEqual((data['offset'], data['t'], data['end']), (99, [495_000], None))
+
+    def test_bad_parameters_and_missing_lyrics(self):
+        response = self.client.get(f'/ebooks/{self.ebook.pk}/lyrics/', {'start': 'soon'})
+        self.assertEqual(response.status_code, 400)
+        self.ebook.save(update_fields=self.ebook.set_lyrics(None))
+        self.assertEqual(self.window(), {'offset': 0, 'total': 0, 'start': 0, 'end': None, 't': [], 'text': []})
+
+    def test_owner_rules_apply(self):
+        owner = User.objects.create_user('owner')
+        Ebook.objects.filter(pk=self.ebook.pk).update(uploaded_by=owner)
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.client.get(f'/ebooks/{self.ebook.pk}/lyrics/').status_code, 404)
+
+    def test_index_is_built_once_per_lyrics_version(self):
+        self.window(start=0)
+        with mock.patch.object(lyrics_module.LyricIndex, 'from_lyrics', side_effect=AssertionError('rebuilt')), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.window(start=490_000)['offset'], 98)
+        self.assertFalse(any('"lyrics"' in query['sql'] for query in queries.captured_queries))
+
+        self.ebook.save(update_fields=self.ebook.set_lyrics([{'time': 0, 'text': 'aligned'}]))
+        self.assertEqual(self.window(start=0)['text'], ['aligned'])
+
+
+class MediaServingTests(EbookFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user('owner')
+        self.data = bytes(range(256)) * 40
+        os.makedirs(os.path.join(self.tmp.name, 'ebooks', 'audio'))
+        with open(os.path.join(self.tmp.name, 'ebooks', 'audio', 'book.mp3'), 'wb') as f:
+            f.write(self.data)
+        self.ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf', audio_file='ebooks/audio/book.mp3',
+                                          uploaded_by=self.owner)
+        self.url = f'/ebooks/{self.ebook.pk}/media/audio/'
+        self.client.force_login(self.owner)
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        self.addCleanup(response.close)
+        return response
+
+    def test_whole_file_with_validators(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.data)
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('private', response['Cache-Control'])
+
+        self.assertEqual(self.get(If_None_Match=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(If_Modified_Since=response['Last-Modified']).status_code, 304)
+
+    def test_single_ranges(self):
+        for header, start, end in (('bytes=10-19', 10, 19), ('bytes=-5', 10235, 10239),
+                                   ('bytes=10000-', 10000, 10239), ('bytes=10200-99999', 10200, 10239)):
+            response = self.get(Range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response.getvalue(), self.data[start:end + 1])
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/10240')
+            self.assertEqual(int(response['Content-Length']), end - start + 1)
+
+    def test_multiple_ranges(self):
+        response = self.get(Range='bytes=0-3, 100-103')
+        self.assertEqual(response.status_code, 206)
+        boundary = response['Content-Type'].split('boundary=')[1]
+        body = response.getvalue()
+        self.assertEqual(int(response['Content-Length']), len(body))
+        parts = body.split(f'--{boundary}'.encode())
+        self.assertEqual(parts[-1], b'--\r\n')
+        self.assertTrue(parts[1].endswith(b'\r\n\r\n' + self.data[0:4] + b'\r\n'))
+        self.assertIn(b'Content-Range: bytes 100-103/10240', parts[2])
+        self.assertTrue(parts[2].endswith(self.data[100:104] + b'\r\n'))
+
+    def test_unsatisfiable_malformed_and_stale_ranges(self):
+        response = self.get(Range='bytes=20000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10240')
+        self.assertEqual(self.get(Range='bytes=abc').status_code, 200)
+        self.assertEqual(self.get(Range='bytes=0-1', If_Range='"stale"').status_code, 200)
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(Range='bytes=0-1', If_Range=etag).status_code, 206)
+
+    def test_file_range_sends_only_its_bytes(self):
+        with open(self.ebook.audio_file.path, 'rb') as f:
+            response = FileResponse(media.FileRange(f, 1000, 24))
+            # What a sendfile-based file_wrapper uses: the fd offset and Content-Length
+            self.assertEqual(os.lseek(f.fileno(), 0, os.SEEK_CUR), 1000)
+            self.assertEqual(response['Content-Length'], '24')
+            self.assertEqual(b''.join(response.streaming_content), self.data[1000:1024])
+
+    def test_same_access_rules_as_detail(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(f'/ebooks/{self.ebook.pk}/media/extracted_text/').status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.get().status_code, 200)
+
+    @override_settings(EBOOK_MEDIA_OFFLOAD='x-accel-redirect', EBOOK_MEDIA_ACCEL_PREFIX='/protected/')
+    def test_offload_to_nginx(self):
+        response = self.get(Range='bytes=0-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/ebooks/audio/book.mp3')
+        self.assertEqual(response.content, b'')
+
+
+@override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={})
+class AudioVersionTests(EbookFixtureMixin, TestCase):
+    def write_version(self, pk, data, age):
+        os.makedirs(utils.audio_version_dir(pk), exist_ok=True)
+        path = os.path.join(utils.audio_version_dir(pk), 'render.staged.mp3')
+        with open(path, 'wb') as f:
+            f.write(data)
+        path = utils.publish_audio_version(path)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return f'ebooks/audio/{pk}/{os.path.basename(path)}'
+
+    def test_render_is_published_under_its_hash_and_cached_immutably(self):
+        ebook = self.make_ebook(pages=1)
+        utils.extract_text_from_pdf(ebook)
+        utils.generate_audiobook(ebook)
+
+        ebook.refresh_from_db()
+        with open(ebook.audio_file.path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self.assertEqual(ebook.audio_file.name, f'ebooks/audio/{ebook.pk}/{digest[:16]}.mp3')
+        self.assertEqual(os.listdir(utils.audio_version_dir(ebook.pk)), [f'{digest[:16]}.mp3'])
+
+        response = self.client.get(ebook.audio_url())
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        unversioned = self.client.get(f'/ebooks/{ebook.pk}/media/audio/')
+        self.addCleanup(unversioned.close)
+        self.assertIn('no-cache', unversioned['Cache-Control'])
+
+    def test_superseded_versions_are_served_until_pruned_after_grace(self):
+        ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf')
+        old = self.write_version(ebook.pk, b'old render', age=500)
+        ebook.audio_file = self.write_version(ebook.pk, b'new render', age=100)
+        ebook.save()
+        gone = Ebook.objects.create(title='B', pdf_file='uploads/b.pdf')
+        self.write_version(gone.pk, b'orphan', age=0)
+        gone_dir = utils.audio_version_dir(gone.pk)
+        gone.delete()
+
+        response = self.client.get(f'/ebooks/{ebook.pk}/media/audio/{os.path.basename(old)}')
+        self.addCleanup(response.close)
+        self.assertEqual(response.getvalue(), b'old render')
+
+        self.assertEqual(utils.prune_audio_versions(grace=200), 1)
+        self.assertFalse(os.path.exists(gone_dir))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, old)))
+        self.assertEqual(utils.prune_audio_versions(grace=50), 1)
+        self.assertEqual(os.listdir(utils.audio_version_dir(ebook.pk)), [os.path.basename(ebook.audio_file.name)])
+
+    def test_deleting_an_ebook_removes_every_version(self):
+        ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf')
+        old = self.write_version(ebook.pk, b'old render', age=10)
+        ebook.audio_file = self.write_version(ebook.pk, b'new render', age=0)
+        ebook.save()
+
+        self.client.post(f'/ebooks/{ebook.pk}/delete/')
+        self.assertFalse(Ebook.objects.filter(pk=ebook.pk).exists())
+        self.assertFalse(os.path.exists(utils.audio_version_dir(ebook.pk)))
+        self.assertEqual(self.client.get(f'/ebooks/{ebook.pk}/media/audio/{os.path.basename(old)}').status_code, 404)
+
+
+@override_settings(EBOOK_LIST_PAGE_SIZE=7)
+class EbookListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader')
+        self.client.force_login(self.user)
+        other = User.objects.create_user('other')
+        Ebook.objects.create(title='Not mine', pdf_file='uploads/x.pdf', uploaded_by=other)
+        now = timezone.now()
+        for i in range(20):
+            ebook = Ebook.objects.create(title=f'Book {i}', pdf_file=f'uploads/{i}.pdf', uploaded_by=self.user,
+                                         extracted_text='x' * 1000, lyrics=[{'time': 0, 'text': 'line'}],
+                                         processing_status='completed' if i % 2 else 'processing')
+            # Pairs of books share an upload time, so the id has to break ties
+            Ebook.objects.filter(pk=ebook.pk).update(upload_date=now - timedelta(minutes=i // 2))
+
+    def test_keyset_pages_cover_every_book_once_newest_first(self):
+        seen, params, pages = [], {}, 0
+        while params is not None and pages < 5:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/ebooks/list/', params)
+            pages += 1
+            seen.extend(ebook.pk for ebook in response.context['ebooks'])
+            select = [q['sql'] for q in queries if 'FROM "ebooks_ebook"' in q['sql'] and 'LIMIT' in q['sql']]
+            self.assertEqual(len(select), 1)
+            # Only the card columns are loaded; has_text compares extracted_text in SQL without fetching it
+            columns = select[0].split(' FROM ')[0]
+            self.assertNotIn('"ebooks_ebook"."extracted_text"', columns)
+            self.assertNotIn('lyrics', select[0])
+            # The counters read every book, so later pages skip them
+            self.assertEqual(response.context['stats'] is None, bool(params))
+            cursor = response.context['next_cursor']
+            params = {'after': cursor} if cursor else None
+
+        expected = list(Ebook.objects.filter(uploaded_by=self.user).order_by('-upload_date', '-pk')
+                        .values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 3)
+
+    def test_stats_cover_all_pages_and_modal_is_shared(self):
+        response = self.client.get('/ebooks/list/')
+        self.assertEqual(response.context['stats'], {'total': 20, 'completed': 10, 'processing': 10, 'with_audio': 0})
+        self.assertContains(response, 'id="deleteModal"', count=1)
+        self.assertContains(response, 'data-bs-target="#deleteModal"', count=7)
+
+    def test_delete_dialog_mentions_text_only_when_there_is_some(self):
+        response = self.client.get('/ebooks/list/')
+        self.assertContains(response, 'data-has-text="true"', count=7)
+        Ebook.objects.filter(uploaded_by=self.user).update(extracted_text='')
+        mine = Ebook.objects.filter(uploaded_by=self.user).order_by('-upload_date', '-pk').first()
+        EbookPage.objects.create(ebook=mine, page_number=1, cleaned_text='Hi.', char_count=3)
+        response = self.client.get('/ebooks/list/')
+        self.assertContains(response, 'data-has-text="true"', count=1)
+        self.assertContains(response, 'data-has-text="false"', count=6)
+
+    def test_bad_cursor_shows_first_page(self):
+        response = self.client.get('/ebooks/list/', {'after': 'nonsense'})
+        self.assertEqual(len(response.context['ebooks']), 7)
+        self.assertTrue(response.context['is_first_page'])
+
+
+@override_settings(EBOOK_PROGRESS_CACHE='default')
+class ProgressReporterTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf', lyrics=[{'time': 0, 'text': 'kept'}])
+        self.now = 0.0
+        self.progress = ProgressReporter(self.ebook, min_interval=10, min_step=5, clock=lambda: self.now)
+
+    def stored(self):
+        return Ebook.objects.values_list('processing_stage', 'progress').get(pk=self.ebook.pk)
+
+    def test_writes_are_throttled_by_step_and_time(self):
+        self.progress.stage('synthesize')
+        self.assertEqual(self.stored(), ('synthesize', 10))
+        for i in range(1, 41):
+            self.progress.update(i / 1000)  # 0.08 points each
+        self.assertEqual(self.stored(), ('synthesize', 10))
+        self.now = 11
+        self.progress.update(0.05)
+        self.assertEqual(self.stored(), ('synthesize', 14))
+        self.progress.update(0.12)
+        self.assertEqual(self.stored(), ('synthesize', 19))
+        self.assertEqual(self.progress.writes, 3)
+
+    def test_progress_is_monotonic_across_stages(self):
+        self.progress.stage('synthesize')
+        self.progress.update(0.5)
+        self.progress.update(0.2)
+        self.assertEqual(self.stored(), ('synthesize', 50))
+        self.progress.stage('combine')
+        self.assertEqual(self.stored(), ('combine', 90))
+        self.progress.reset()
+        self.assertEqual(self.stored(), ('', 0))
+
+    def test_only_progress_columns_are_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.progress.stage('extract')
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertIn('"processing_stage"', sql)
+        self.assertNotIn('lyrics', sql)
+        self.assertNotIn('extracted_text', sql)
+
+
+    def test_every_percent_is_published_but_not_written(self):
+        self.progress.stage('synthesize')
+        versions = []
+        for i in range(1, 5):
+            self.progress.update(i / 80)  # one point each
+            versions.append(events.latest(self.ebook.pk)['version'])
+        self.assertEqual(self.progress.writes, 1)
+        self.assertEqual(versions, sorted(set(versions)))
+        event = events.latest(self.ebook.pk)
+        self.assertEqual((event['stage'], event['stage_display'], event['progress']), ('synthesize', 'Generating speech', 14))
+
+
+@override_settings(EBOOK_PROGRESS_STREAM_INTERVAL=0.01)
+class ProgressStreamTests(EbookFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf')
+        jobs.enqueue(self.ebook)
+
+    async def test_long_poll_returns_as_soon_as_an_event_is_newer(self):
+        client = AsyncClient()
+        version = (await client.get(f'/ebooks/{self.ebook.pk}/status/')).json()['version']
+        self.assertTrue(version)
+
+        start = time.monotonic()
+        response = await client.get(f'/ebooks/{self.ebook.pk}/status/', {'since': version, 'wait': 0.2})
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(response.json()['version'], version)
+
+        async def report():
+            await asyncio.sleep(0.05)
+            await sync_to_async(ProgressReporter(self.ebook).stage)('extract', 0.5)
+
+        reporter = asyncio.ensure_future(report())
+        start = time.monotonic()
+        data = (await client.get(f'/ebooks/{self.ebook.pk}/status/', {'since': version, 'wait': 5})).json()
+        await reporter
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertGreater(data['version'], version)
+        self.assertEqual((data['stage'], data['progress']), ('extract', 5))
+
+    def test_long_poll_answers_at_once_under_wsgi(self):
+        version = self.client.get(f'/ebooks/{self.ebook.pk}/status/').json()['version']
+        start = time.monotonic()
+        response = self.client.get(f'/ebooks/{self.ebook.pk}/status/', {'since': version, 'wait': 5})
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(response.json()['version'], version)
+
+    def test_status_is_only_shown_to_the_owner(self):
+        owner = User.objects.create_user('owner')
+        Ebook.objects.filter(pk=self.ebook.pk).update(uploaded_by=owner)
+        self.client.force_login(User.objects.create_user('other'))
+        self.assertEqual(self.client.get(f'/ebooks/{self.ebook.pk}/status/').status_code, 404)
+        self.client.force_login(owner)
+        self.assertEqual(self.client.get(f'/ebooks/{self.ebook.pk}/status/').status_code, 200)
+
+    def test_stream_is_refused_under_wsgi(self):
+        self.assertEqual(self.client.get(f'/ebooks/{self.ebook.pk}/progress/').status_code, 204)
+
+    async def test_stream_sends_events_until_processing_ends(self):
+        response = await AsyncClient().get(f'/ebooks/{self.ebook.pk}/progress/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        async def publish():
+            await asyncio.sleep(0.05)
+            await sync_to_async(events.publish)(self.ebook.pk, stage='synthesize', progress=40)
+            await asyncio.sleep(0.05)
+            await sync_to_async(events.publish)(self.ebook.pk, status='completed', has_audio=True)
+
+        publisher = asyncio.ensure_future(publish())
+        messages = [message async for message in response.streaming_content]
+        await publisher
+        payloads = [json.loads(m.decode().split('data: ', 1)[1]) for m in messages if b'data: ' in m]
+        self.assertEqual([(p['status'], p['progress']) for p in payloads],
+                         [('processing', 0), ('processing', 40), ('completed', 40)])
+        self.assertEqual(payloads[1]['stage_display'], 'Generating speech')
+        self.assertIsNone(payloads[1]['queue_position'])
+        self.assertTrue(messages[0].decode().startswith('retry: '))
+
+
+@override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={}, EBOOK_TTS_CACHE_MAX_BYTES=0)
+class JobQueryCountTests(EbookFixtureMixin, TestCase):
+    def test_queries_per_job_do_not_grow_with_chunk_count(self):
+        ebook = self.make_ebook(pages=5)
+        utils.extract_text_from_pdf(ebook)
+        chunks = len(list(utils.iter_text_chunks(ebook.iter_text(), 100)))
+        self.assertGreater(chunks, 100)
+
+        jobs.enqueue(ebook)
+        job = jobs.claim_job('w1')
+        with mock.patch.object(tts.FakeBackend, 'max_chunk_chars', 100), \
+                CaptureQueriesContext(connection) as queries:
+            jobs.run_job(job)
+
+        self.assertEqual(job.status, 'completed')
+        ebook_updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "ebooks_ebook"')]
+        self.assertLessEqual(len(ebook_updates), 25)
+        self.assertLess(len(queries), 40)
+        self.assertFalse([sql for sql in ebook_updates if 'extracted_text' in sql])
+
+
+class WorkerCrash(BaseException):
+    """Stands in for the worker process dying mid-job."""
+
+
+@override_settings(EBOOK_TTS_BACKEND='fake', EBOOK_TTS_BACKEND_OPTIONS={}, EBOOK_TTS_WORKERS=1,
+                   EBOOK_TTS_CACHE_MAX_BYTES=0, EBOOK_PIPELINE=False)
+class JobLeaseTests(EbookFixtureMixin, TestCase):
+    def expire(self, job):
+        ProcessingJob.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_expired_job_is_requeued_then_failed_after_max_attempts(self):
+        ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf')
+        job = jobs.enqueue(ebook)
+        ProcessingJob.objects.filter(pk=job.pk).update(max_attempts=2)
+
+        for attempt in (1, 2):
+            claimed = jobs.claim_job('w1')
+            self.assertEqual(claimed.attempts, attempt)
+            self.assertGreater(claimed.lease_expires_at, timezone.now())
+            self.assertEqual(jobs.reap_expired_jobs(), (0, 0))
+            self.expire(job)
+            self.assertEqual(jobs.reap_expired_jobs(), (1, 0) if attempt == 1 else (0, 1))
+
+        job.refresh_from_db()
+        ebook.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('Lease expired', job.error)
+        self.assertEqual(ebook.processing_status, 'failed')
+
+    def test_heartbeat_extends_lease_and_detects_a_lost_lease(self):
+        job = jobs.enqueue(Ebook.objects.create(title='A', pdf_file='uploads/a.pdf'))
+        job = jobs.claim_job('w1')
+        self.expire(job)
+        checkpoint = jobs.JobCheckpoint(job, interval=0)
+        checkpoint.heartbeat()
+        self.assertEqual(jobs.reap_expired_jobs(), (0, 0))
+
+        ProcessingJob.objects.filter(pk=job.pk).update(worker='w2')
+        with self.assertRaises(jobs.LeaseLost):
+            checkpoint.heartbeat()
+
+    def test_lost_lease_leaves_progress_to_the_new_owner(self):
+        ebook = self.make_ebook(pages=1)
+        utils.extract_text_from_pdf(ebook)
+
+        class Reaped(utils.Checkpoint):
+            def heartbeat(self):
+                raise jobs.LeaseLost("reaped")
+
+        with mock.patch.object(ProgressReporter, 'reset') as reset, self.assertRaises(jobs.LeaseLost):
+            utils.generate_audiobook(ebook, checkpoint=Reaped())
+        reset.assert_not_called()
+
+    def test_retry_resumes_after_last_checkpointed_chunk(self):
+        ebook = self.make_ebook(pages=2)
+        utils.extract_text_from_pdf(ebook)
+        total_chunks = len(list(utils.iter_text_chunks(ebook.iter_text(), 500)))
+        calls = []
+        synthesize = tts.FakeBackend.synthesize
+
+        def crashing_synthesize(backend, text, **params):
+            calls.append(text)
+            time.sleep(0.03)  # long enough for every chunk's heartbeat to renew the lease before it is saved
+            if crash and len(calls) == 6:
+                raise WorkerCrash()
+            return synthesize(backend, text, **params)
+
+        job = jobs.enqueue(ebook)
+        with mock.patch.object(tts.FakeBackend, 'max_chunk_chars', 500), \
+                mock.patch.object(tts.FakeBackend, 'synthesize', crashing_synthesize), \
+                mock.patch.object(jobs.JobCheckpoint, '__init__', partialmethod(jobs.JobCheckpoint.__init__, interval=0.02)), \
+                mock.patch.object(utils.AudioAssembler, 'close', lambda self: self.output.close()):
+            crash = True
+            with self.assertRaises(WorkerCrash):
+                jobs.run_job(jobs.claim_job('w1'))
+            job.refresh_from_db()
+            self.assertEqual(job.checkpoint['state']['chunks'], 5)
+
+            self.expire(job)
+            self.assertEqual(jobs.reap_expired_jobs(), (1, 0))
+            crash = False
+            calls.clear()
+            jobs.run_job(jobs.claim_job('w2'))
+
+        job.refresh_from_db()
+        ebook.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.checkpoint), ('completed', 2, None))
+        self.assertEqual(len(calls), total_chunks - 5)
+        backend = tts.FakeBackend()
+        expected = sum(backend.duration_for(c) for c in utils.iter_text_chunks(ebook.iter_text(), 500))
+        with open(ebook.audio_file.path, 'rb') as f:
+            self.assertAlmostEqual(mp3.duration(f.read()), expected)
+        # Chunks from before the crash keep their measured durations
+        timeline = ChunkTimeline()
+        for chunk in utils.iter_text_chunks(ebook.iter_text(), 500):
+            timeline.append(chunk, backend.duration_for(chunk))
+        self.assertEqual(ebook.lyrics, utils.generate_timed_lyrics_from_timeline(ebook.iter_text(), timeline))
+
+
+    def test_resumed_attempt_does_not_share_the_part_file(self):
+        frame = tts.FakeBackend.MP3_FRAME
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'book.mp3')
+            stale = utils.AudioAssembler(output)
+            stale.append(frame * 3)
+            state = stale.state()
+            stale.append(frame * 2)
+
+            with utils.AudioAssembler(output, resume=state) as resumed:
+                self.assertTrue(resumed.resumed)
+                self.assertNotEqual(resumed.tmp_path, stale.tmp_path)
+                # The stale attempt keeps writing and then gives up after losing its lease
+                stale.append(frame * 4)
+                stale.close()
+                resumed.append(frame)
+                resumed.finish()
+            with open(output, 'rb') as f:
+                self.assertEqual(f.read(), frame * 4)
+            self.assertEqual(os.listdir(tmp), ['book.mp3'])
+
+
+class Mp3ConcatenationTests(SimpleTestCase):
+    frame = tts.FakeBackend.MP3_FRAME
+
+    def test_concatenates_frames_and_counts_duration(self):
+        segments = [BytesIO(self.frame * 10), BytesIO(self.frame * 25)]
+        out = BytesIO()
+        self.assertAlmostEqual(mp3.concatenate(segments, out), 35 * 576 / 24000)
+        self.assertEqual(out.getvalue(), self.frame * 35)
+
+    def test_strips_id3_tags_xing_header_and_junk(self):
+        id3v2 = b'ID3\x04\x00\x00\x00\x00\x00\x05' + b'x' * 5
+        xing = self.frame[:13] + b'Xing' + bytes(len(self.frame) - 17)
+        id3v1 = b'TAG' + bytes(125)
+        data = id3v2 + xing + self.frame * 3 + b'junk' + self.frame * 2 + self.frame[:40] + id3v1
+
+        runs, fmt, samples = mp3.scan_frames(data)
+        self.assertEqual(fmt, mp3.StreamFormat(2, 3, 24000, 1))
+        self.assertEqual(samples, 5 * 576)
+        out = BytesIO()
+        mp3.concatenate([data], out)
+        self.assertEqual(out.getvalue(), self.frame * 5)
+
+    def test_parses_mpeg1_stereo_header(self):
+        frame = mp3.parse_header(bytes([0xFF, 0xFB, 0x90, 0x00]))  # 128 kbps, 44.1 kHz, stereo
+        self.assertEqual((frame.length, frame.samples), (417, 1152))
+        self.assertEqual(frame.format, mp3.StreamFormat(1, 3, 44100, 2))
+
+    def test_header_cache_stays_bounded_while_scanning_junk(self):
+        mp3.parse_header.cache_clear()
+        # Random bytes with a frame sync byte every 40, each followed by a different (mostly invalid) header
+        junk = random.Random(0).randbytes(200_000).replace(b'\xff', b'\xfe')
+        junk = b'\xff'.join(junk[i:i + 40] for i in range(0, len(junk), 40))
+        mp3.scan_frames(junk + self.frame * 3)
+        info = mp3.parse_header.cache_info()
+        self.assertGreater(info.misses, info.maxsize)
+        self.assertLessEqual(info.currsize, info.maxsize)
+        self.assertIsNotNone(mp3.parse_header(self.frame[:4]))
+
+    def test_mismatched_segments_fall_back_to_reencoding(self):
+        stereo_44k = bytes([0xFF, 0xFB, 0x90, 0x00]) + bytes(413)
+        segments = [BytesIO(self.frame * 4), BytesIO(stereo_44k * 4)]
+        with self.assertRaises(mp3.Mp3FormatError):
+            mp3.concatenate(segments, BytesIO())
+        received = []
+
+        def reencode(store, output_path):
+            received.extend(f.read() for f in store)
+            with open(output_path, 'wb') as f:
+                f.write(b're-encoded')
+            return 1.0
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'book.mp3')
+            with mock.patch.object(utils, '_combine_audio_segments_moviepy', side_effect=reencode):
+                self.assertEqual(utils.combine_audio_segments(segments, path), 1.0)
+            self.assertEqual(os.listdir(tmp), ['book.mp3'])
+        # The frames joined before the mismatch are handed over as one segment
+        self.assertEqual(received, [self.frame * 4, stereo_44k * 4])
+
+
+class SegmentStoreTests(SimpleTestCase):
+    def test_spills_past_memory_budget_and_keeps_order(self):
+        segments = [bytes([i]) * 100 for i in range(10)]
+        with tempfile.TemporaryDirectory() as tmp:
+            with SegmentStore(memory_budget=250, directory=tmp) as store:
+                for segment in segments:
+                    store.append(BytesIO(segment))
+                self.assertEqual((store.memory_bytes, store.disk_bytes), (200, 800))
+                self.assertEqual(len(os.listdir(store.directory)), 8)
+                self.assertEqual([f.read() for f in store], segments)
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_stays_in_memory_within_budget(self):
+        with SegmentStore(memory_budget=1024) as store:
+            store.append(b'abc')
+            store.append(BytesIO(b'def'))
+            self.assertIsNone(store.directory)
+            self.assertEqual(b''.join(f.read() for f in store), b'abcdef')
+
+
+class ChunkAudioCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.audio_cache = cache.ChunkAudioCache(root=self.tmp.name, max_bytes=10 ** 6)
+
+    def test_cached_chunks_skip_the_backend_and_count_hits(self):
+        backend = tts.FakeBackend()
+        params = backend.voice_params('storytelling', 'us')
+        first = cache.CachedSynthesizer(backend, params, self.audio_cache)
+        audio = first('Hello   there\nworld').read()
+
+        second = cache.CachedSynthesizer(backend, params, self.audio_cache)
+        with mock.patch.object(backend, 'synthesize', side_effect=AssertionError('backend called')):
+            self.assertEqual(second('Hello there world').read(), audio)
+        self.assertEqual((second.hits, second.misses, second.hit_rate), (1, 0, 1.0))
+
+        # Different voice parameters are a different key
+        other = cache.CachedSynthesizer(backend, dict(params, slow=True), self.audio_cache)
+        other('Hello there world')
+        self.assertEqual(other.misses, 1)
+
+    def test_evict_removes_least_recently_used_until_under_budget(self):
+        keys = [self.audio_cache.key(f'chunk {i}', 'fake', {}) for i in range(4)]
+        for age, key in enumerate(keys):
+            self.audio_cache.put(key, 'mp3', bytes(400))
+            os.utime(self.audio_cache.path(key, 'mp3'), (time.time() - age * 60,) * 2)
+        self.audio_cache.get(keys[3], 'mp3')  # oldest, but just used
+
+        self.audio_cache.max_bytes = 1000
+        self.assertEqual(self.audio_cache.evict(), 2)
+        remaining = [k for k in keys if self.audio_cache.get(k, 'mp3') is not None]
+        self.assertEqual(remaining, [keys[0], keys[3]])
+
+
+def narration_wav(path, sentences, rate=8000):
+    """Write a WAV of noise bursts ("sentences" of the given seconds) with a 0.4 s pause before each.
+
+    Returns the time each sentence starts.
+    """
+    rng = np.random.default_rng(0)
+    parts, starts, now = [], [], 0.0
+    for seconds in sentences:
+        parts.append(np.zeros(int(0.4 * rate)))
+        now += 0.4
+        starts.append(round(now, 2))
+        parts.append(rng.uniform(-0.5, 0.5, int(seconds * rate)))
+        now += seconds
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes((np.concatenate(parts) * 32767).astype('<i2').tobytes())
+    return starts
+
+
+@override_settings(EBOOK_LYRICS_ALIGN_MAX_SHIFT=1.5)
+class LyricsAlignmentTests(EbookFixtureMixin, TestCase):
+    def test_pauses_are_found_across_block_boundaries(self):
+        rng = np.random.default_rng(1)
+        rms = rng.uniform(0.2, 0.4, 1000).astype(np.float32)
+        rms[95:130] = 0  # runs over the boundary between the first two arrays
+        rms[300:305] = 0  # too short to be a pause
+        rms[990:] = 0  # still quiet at the end
+        whole = list(alignment.find_pauses([rms]))
+        self.assertEqual(whole, [(1.9, 2.6), (19.8, 20.0)])
+        self.assertEqual(list(alignment.find_pauses(np.array_split(rms, 10))), whole)
+
+    def test_snapping_keeps_order_and_respects_max_shift(self):
+        pauses = [(0.0, 0.4), (2.0, 2.5), (2.6, 3.0), (9.0, 9.5)]
+        lyrics = [{'time': t, 'text': str(t)} for t in (0.0, 2.9, 2.95, 6.0)]
+        self.assertEqual([line['time'] for line in alignment.snap_lyrics(lyrics, pauses, 1.5)],
+                         [0.4, 3.0, 3.0, 6.0])
+
+    def test_decoding_corrupt_audio_does_not_stall_on_error_output(self):
+        # MP3 headers with random bodies: ffmpeg reports errors for each frame, far more than a pipe holds
+        rng = np.random.default_rng(0)
+        frame = tts.FakeBackend.MP3_FRAME
+        path = os.path.join(self.tmp.name, 'corrupt.mp3')
+        with open(path, 'wb') as f:
+            f.write(b''.join(frame[:4] + rng.bytes(len(frame) - 4) for _ in range(2000)))
+        result = []
+        decoder = threading.Thread(target=lambda: result.extend(alignment.decode_pcm(path)), daemon=True)
+        decoder.start()
+        decoder.join(timeout=30)
+        self.assertFalse(decoder.is_alive(), 'ffmpeg stalled writing its error output')
+        self.assertTrue(result)
+
+        with open(path, 'wb') as f:
+            f.write(rng.bytes(4096))
+        with self.assertRaisesRegex(RuntimeError, 'could not decode'):
+            list(alignment.decode_pcm(path))
+
+    def test_command_snaps_lyrics_to_the_start_of_each_sentence(self):
+        os.makedirs(os.path.join(self.tmp.name, 'ebooks', 'audio'))
+        path = os.path.join(self.tmp.name, 'ebooks', 'audio', 'book.wav')
+        starts = narration_wav(path, [3.1, 2.2, 4.7, 1.9, 3.3] * 8)
+        # Estimates up to a second off in either direction, as inside a long chunk
+        estimates = [max(start + (-1) ** i * (i % 5) / 4, 0) for i, start in enumerate(starts)]
+        ebook = Ebook.objects.create(title='A', pdf_file='uploads/a.pdf', audio_file='ebooks/audio/book.wav',
+                                     audio_duration=starts[-1] + 3.3,
+                                     lyrics=[{'time': t, 'text': f'line {i}'} for i, t in enumerate(estimates)])
+
+        out = StringIO()
+        call_command('align_lyrics', stdout=out)
+        ebook.refresh_from_db()
+        self.assertIn('Aligned 1 audiobooks', out.getvalue())
+        self.assertIn('per audio hour', out.getvalue())
+        for line, start in zip(ebook.lyrics, starts):
+            self.assertAlmostEqual(line['time'], start, delta=0.025)
+
+
+class TextStreamingTests(SimpleTestCase):
+    def test_chunks_from_pages_respect_max_length_and_keep_all_words(self):
+        pages = [sample_text(40, seed=i) for i in range(20)]
+        chunks = list(utils.iter_text_chunks(iter(pages), max_length=1000))
+        self.assertTrue(all(500 <= len(c) <= 1000 for c in chunks[:-1]))
+        self.assertEqual(" ".join(chunks).split(), " ".join(pages).split())
+        # Every cut lands after a sentence
+        self.assertTrue(all(c.endswith(".") for c in chunks))
+
+    def test_cuts_at_best_available_boundary(self):
+        text = "First paragraph here.\n\nSecond one, with a clause; and more words"
+        self.assertEqual(utils.split_text_into_chunks(text, max_length=30),
+                         ["First paragraph here.", "Second one, with a clause;", "and more words"])
+        self.assertEqual(utils.split_text_into_chunks("aaaa bbbb cccc dddd", max_length=10),
+                         ["aaaa bbbb", "cccc dddd"])
+        self.assertEqual(utils.split_text_into_chunks("x" * 25, max_length=10), ["x" * 10, "x" * 10, "x" * 5])
+
+    def test_small_pages_are_packed_together(self):
+        self.assertEqual(list(utils.iter_text_chunks(["One.", "Two.", "", "Three."], max_length=20)),
+                         ["One.\n\nTwo.\n\nThree."])
+
+    def test_chunk_timeline_interpolates_by_spoken_weight(self):
+        timeline = ChunkTimeline()
+        timeline.append('ab. cd', 2.0)  # weight 4
+        timeline.append('e f', None)
+        timeline.append('gh', 0.0)  # a chunk whose synthesis failed
+        timeline.append('ijkl!', None)
+        timeline.fill(8.0)
+        self.assertEqual(timeline.durations, [2.0, 2.0, 0.0, 4.0])
+        self.assertEqual([timeline.time_at(p) for p in (0, 2, 4, 5, 6, 8, 10, 12)],
+                         [0.0, 1.0, 2.0, 3.0, 4.0, 4.0, 6.0, 8.0])
+
+    def test_lyrics_from_pages_match_lyrics_from_joined_text(self):
+        pages = ["First sentence here. And a second one that", "continues on the next page. Done."]
+        self.assertEqual(
+            utils.generate_timed_lyrics_based_on_duration(iter(pages), 60),
+            utils.generate_timed_lyrics_based_on_duration(" ".join(pages), 60),
+        )
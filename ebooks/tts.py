@@ -0,0 +1,199 @@
+"""Text-to-speech backends.
+
+The backend used for synthesis is chosen with ``EBOOK_TTS_BACKEND`` (a name
+registered here or a dotted path to a TTSBackend subclass) and configured with
+``EBOOK_TTS_BACKEND_OPTIONS``. Each backend maps the app's voice styles and
+accents onto its own voice parameters.
+"""
+import io
+import shutil
+import subprocess
+import time
+import wave
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from gtts import gTTS
+
+BACKENDS = {}
+
+ACCENT_TLDS = {
+    'us': 'com',
+    'uk': 'co.uk',
+    'au': 'com.au',
+    'ca': 'ca',
+    'in': 'co.in',
+    'ie': 'ie',
+    'za': 'co.za',
+    'nz': 'co.nz'
+}
+
+# Per voice style: the accent used when none is given, and whether to read slowly
+VOICE_STYLES = {
+    'storytelling': {'default_accent': 'us', 'slow': False},
+    'narration': {'default_accent': 'us', 'slow': False, 'fixed_accent': True},
+    'calm': {'default_accent': 'uk', 'slow': True},
+    'energetic': {'default_accent': 'us', 'slow': False},
+    'dramatic': {'default_accent': 'us', 'slow': False},
+    'whisper': {'default_accent': 'uk', 'slow': True},
+    'excited': {'default_accent': 'us', 'slow': False},
+    'monotone': {'default_accent': 'us', 'slow': True},
+    'formal': {'default_accent': 'uk', 'slow': False},
+}
+
+def register_backend(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+def get_backend(name=None, **options):
+    """Instantiate the configured TTS backend."""
+    name = name or getattr(settings, 'EBOOK_TTS_BACKEND', 'gtts')
+    if not options:
+        options = getattr(settings, 'EBOOK_TTS_BACKEND_OPTIONS', {}).get(name, {})
+    if name in BACKENDS:
+        backend_class = BACKENDS[name]
+    elif '.' in name:
+        backend_class = import_string(name)
+    else:
+        raise ImproperlyConfigured(f"Unknown TTS backend '{name}'. Choose from: {', '.join(sorted(BACKENDS))}")
+    return backend_class(**options)
+
+def resolve_voice(voice_style, accent):
+    """Return ``(style_config, accent)`` with the storytelling/default-accent fallbacks applied."""
+    style = VOICE_STYLES.get(voice_style, VOICE_STYLES['storytelling'])
+    if style.get('fixed_accent') or accent not in ACCENT_TLDS:
+        accent = style['default_accent']
+    return style, accent
+
+
+class TTSBackend:
+    """Base class for TTS backends.
+
+    ``synthesize(text, **voice_params)`` returns a file-like object positioned
+    at 0 containing audio in ``audio_format``.
+    """
+    name = None
+    audio_format = 'mp3'
+    # Longest text passed to a single synthesize() call
+    max_chunk_chars = 4000
+
+    def voice_params(self, voice_style, accent):
+        raise NotImplementedError
+
+    def synthesize(self, text, **voice_params):
+        raise NotImplementedError
+
+
+@register_backend('gtts')
+class GTTSBackend(TTSBackend):
+    """Google Translate TTS (needs network access)."""
+
+    def voice_params(self, voice_style, accent):
+        style, accent = resolve_voice(voice_style, accent)
+        return {'lang': 'en', 'tld': ACCENT_TLDS[accent], 'slow': style['slow']}
+
+    def synthesize(self, text, lang='en', tld='com', slow=False):
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang, tld=tld, slow=slow).write_to_fp(buffer)
+        buffer.seek(0)
+        return buffer
+
+
+@register_backend('espeak')
+class EspeakBackend(TTSBackend):
+    """Offline synthesis with an espeak-compatible command line engine.
+
+    The engine writes WAV to stdout; when ffmpeg is available (it ships with
+    moviepy) the WAV is encoded to MP3 so segments match the gTTS format.
+    """
+    # espeak has no dedicated voices for most of these accents; use the closest one
+    ESPEAK_VOICES = {
+        'us': 'en-us', 'uk': 'en-gb', 'au': 'en-gb', 'ca': 'en-us',
+        'in': 'en', 'ie': 'en-gb', 'za': 'en-gb', 'nz': 'en-gb',
+    }
+    STYLE_VARIANTS = {'whisper': 'whisper', 'dramatic': 'm3', 'excited': 'f2', 'monotone': 'klatt'}
+    STYLE_PITCH = {'energetic': 65, 'excited': 70, 'calm': 40, 'monotone': 50}
+
+    def __init__(self, command='espeak-ng', words_per_minute=175, slow_words_per_minute=130, encode_mp3=True):
+        self.command = shutil.which(command) or shutil.which('espeak') or command
+        self.words_per_minute = words_per_minute
+        self.slow_words_per_minute = slow_words_per_minute
+        self.encode_mp3 = encode_mp3
+        self.audio_format = 'mp3' if encode_mp3 else 'wav'
+
+    def voice_params(self, voice_style, accent):
+        style, accent = resolve_voice(voice_style, accent)
+        voice = self.ESPEAK_VOICES[accent]
+        if voice_style in self.STYLE_VARIANTS:
+            voice = f"{voice}+{self.STYLE_VARIANTS[voice_style]}"
+        return {
+            'voice': voice,
+            'speed': self.slow_words_per_minute if style['slow'] else self.words_per_minute,
+            'pitch': self.STYLE_PITCH.get(voice_style, 50),
+        }
+
+    def synthesize(self, text, voice='en-us', speed=175, pitch=50):
+        wav = subprocess.run(
+            [self.command, '--stdout', '-v', voice, '-s', str(speed), '-p', str(pitch), '--', text],
+            check=True, capture_output=True,
+        ).stdout
+        if self.encode_mp3:
+            from imageio_ffmpeg import get_ffmpeg_exe
+            wav = subprocess.run(
+                [get_ffmpeg_exe(), '-loglevel', 'error', '-f', 'wav', '-i', 'pipe:0',
+                 '-ac', '1', '-ar', '24000', '-b:a', '32k', '-f', 'mp3', 'pipe:1'],
+                input=wav, check=True, capture_output=True,
+            ).stdout
+        return io.BytesIO(wav)
+
+
+@register_backend('fake')
+class FakeBackend(TTSBackend):
+    """Deterministic offline backend for tests, benchmarks and load testing.
+
+    Produces silence whose length depends only on the word count (and the
+    ``slow`` flag), after sleeping ``latency`` seconds to mimic a network call.
+    MP3 output uses the same stream parameters as gTTS (MPEG-2 Layer III,
+    24 kHz mono, 32 kbps), so it goes through the same audio code paths.
+    """
+    SAMPLE_RATE = 24000
+    SAMPLES_PER_FRAME = 576
+    # MPEG-2 Layer III, no CRC, 32 kbps, 24 kHz, mono; an all-zero body decodes as silence
+    MP3_FRAME = bytes([0xFF, 0xF3, 0x44, 0xC4]) + bytes(92)
+
+    def __init__(self, latency=0.0, seconds_per_word=0.4, audio_format='mp3'):
+        self.latency = latency
+        self.seconds_per_word = seconds_per_word
+        self.audio_format = audio_format
+
+    def voice_params(self, voice_style, accent):
+        style, accent = resolve_voice(voice_style, accent)
+        return {'lang': 'en', 'tld': ACCENT_TLDS[accent], 'slow': style['slow']}
+
+    def duration_for(self, text, slow=False):
+        """Exact duration in seconds of the audio returned for ``text``."""
+        seconds = max(1, len(text.split())) * self.seconds_per_word * (1.5 if slow else 1)
+        return self.frames_for(seconds) * self.SAMPLES_PER_FRAME / self.SAMPLE_RATE
+
+    def frames_for(self, seconds):
+        return max(1, round(seconds * self.SAMPLE_RATE / self.SAMPLES_PER_FRAME))
+
+    def synthesize(self, text, lang='en', tld='com', slow=False):
+        if self.latency:
+            time.sleep(self.latency)
+        frames = self.frames_for(self.duration_for(text, slow))
+        if self.audio_format == 'mp3':
+            return io.BytesIO(self.MP3_FRAME * frames)
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.SAMPLE_RATE)
+            w.writeframes(bytes(2 * frames * self.SAMPLES_PER_FRAME))
+        buffer.seek(0)
+        return buffer
@@ -6,5 +6,9 @@ urlpatterns = [
     path('list/', views.ebook_list, name='ebook_list'),
     path('<int:pk>/', views.ebook_detail, name='ebook_detail'),
     path('<int:pk>/status/', views.check_processing_status, name='check_status'),
+    path('<int:pk>/progress/', views.progress_stream, name='progress_stream'),
+    path('<int:pk>/lyrics/', views.ebook_lyrics, name='ebook_lyrics'),
     path('<int:pk>/delete/', views.delete_ebook, name='delete_ebook'),
+    path('<int:pk>/media/<slug:kind>/', views.ebook_media, name='ebook_media'),
+    path('<int:pk>/media/<slug:kind>/<str:version>', views.ebook_media, name='ebook_media_version'),
 ]
\ No newline at end of file
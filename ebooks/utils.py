@@ -1,106 +1,444 @@
 import os
 import re
+import hashlib
+import signal
+import threading
 import concurrent.futures
-from io import BytesIO
+import itertools
+import time
+import json
+from contextlib import contextmanager
+import PyPDF2
 try:
     from PyPDF2 import PdfReader
 except ImportError:
     from PyPDF2 import PdfFileReader as PdfReader
-from gtts import gTTS
 from moviepy import AudioFileClip, concatenate_audioclips
 from django.conf import settings
+from .models import AUDIO_VERSION_RE, Ebook, EbookPage
+from .cache import CachedSynthesizer, cache_pages, cached_pages, sha256_of_file
+from .tts import get_backend
+from . import mp3
+from .alignment import align_lyrics
+from .lyrics import ChunkTimeline, spoken_weight
+from .segments import SegmentStore
+from .progress import ProgressReporter
 import logging
 import tempfile
 
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(ebook):
-    """Extract text from PDF with optimized processing."""
-    pdf_path = ebook.pdf_file.path
-    
+# Bump the suffix whenever page extraction changes so cached text is not reused
+EXTRACTOR_VERSION = f"PyPDF2-{PyPDF2.__version__}/1"
+# Bump whenever clean_text_for_tts changes so stored pages are re-cleaned
+CLEANER_VERSION = 1
+
+def _reader_pages(reader):
+    """Return the page sequence for both old and new PyPDF2 readers."""
+    if hasattr(reader, 'pages'):
+        return reader.pages
+    return [reader.getPage(i) for i in range(reader.numPages)]
+
+def _extract_page(page):
+    if hasattr(page, 'extract_text'):
+        return page.extract_text()
+    return page.extractText()
+
+class PageTimeout(Exception):
+    """Raised inside an extraction worker when a single page runs too long."""
+
+@contextmanager
+def _page_deadline(seconds):
+    """Abort the enclosed block with PageTimeout after ``seconds``.
+
+    Uses SIGALRM, so it only applies on POSIX and in a main thread (which is
+    where process-pool workers run); elsewhere it is a no-op.
+    """
+    if (not seconds or not hasattr(signal, 'setitimer')
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def _expire(signum, frame):
+        raise PageTimeout()
+
+    previous = signal.signal(signal.SIGALRM, _expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        
-        # Get total pages
-        if hasattr(reader, 'pages'):
-            total_pages = len(reader.pages)
-            pages = reader.pages
-        else:
-            total_pages = reader.numPages
-            pages = [reader.getPage(i) for i in range(total_pages)]
-        
-        # Process pages in parallel for faster extraction
-        def extract_page_text(page):
-            if hasattr(page, 'extract_text'):
-                return page.extract_text()
-            else:
-                return page.extractText()
-        
-        # Use ThreadPoolExecutor for parallel processing
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            future_to_page = {executor.submit(extract_page_text, page): i for i, page in enumerate(pages)}
-            
-            page_texts = [None] * total_pages
-            for future in concurrent.futures.as_completed(future_to_page):
-                page_idx = future_to_page[future]
-                try:
-                    page_texts[page_idx] = future.result()
-                except Exception as e:
-                    logger.warning(f"Error extracting page {page_idx}: {e}")
-                    page_texts[page_idx] = ""
-        
-        # Combine text in order
-        text = "\n".join(filter(None, page_texts))
-        
-        # Clean and optimize text
-        text = clean_text_for_tts(text)
-        
-        # Limit text length to prevent processing issues
-        if len(text) > 50000:  # ~50k characters limit
-            text = text[:50000] + "\n\n[Text truncated for audio processing]"
-        
-        ebook.extracted_text = text
-        ebook.save()
-        
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _extract_page_range(pdf_path, start, stop, page_timeout=None):
+    """Open the PDF and extract the text of pages ``start`` to ``stop - 1``.
+
+    Runs inside a process-pool worker, so it opens its own reader instead of
+    receiving page objects from the parent.
+    """
+    return start, list(_iter_page_range(pdf_path, start, stop, page_timeout))
+
+def _iter_page_range(pdf_path, start, stop, page_timeout=None):
+    pages = _reader_pages(PdfReader(pdf_path))
+    for index in range(start, stop):
+        # Yield outside the deadline so the alarm is not armed while the
+        # consumer holds the generator suspended
+        try:
+            with _page_deadline(page_timeout):
+                text = _extract_page(pages[index]) or ""
+        except PageTimeout:
+            logger.warning(f"Page {index} exceeded {page_timeout}s extraction timeout, skipping")
+            text = ""
+        except Exception as e:
+            logger.warning(f"Error extracting page {index}: {e}")
+            text = ""
+        yield text
+
+# How often a waiting extraction calls its heartbeat
+EXTRACTION_HEARTBEAT_SECONDS = 1
+
+def _as_completed(futures, heartbeat=None):
+    """Like concurrent.futures.as_completed, but calls ``heartbeat()`` whenever nothing finished for a while."""
+    if heartbeat is None:
+        yield from concurrent.futures.as_completed(futures)
+        return
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(pending, timeout=EXTRACTION_HEARTBEAT_SECONDS,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+        if not done:
+            heartbeat()
+        yield from done
+
+def _extract_pages_threaded(pdf_path, workers, heartbeat=None):
+    pages = _reader_pages(PdfReader(pdf_path))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_page = {executor.submit(_extract_page, page): i for i, page in enumerate(pages)}
+        for future in _as_completed(future_to_page, heartbeat):
+            page_idx = future_to_page[future]
+            try:
+                yield page_idx, future.result() or ""
+            except Exception as e:
+                logger.warning(f"Error extracting page {page_idx}: {e}")
+                yield page_idx, ""
+
+def _extract_pages_multiprocess(pdf_path, workers, page_timeout, heartbeat=None):
+    total_pages = len(_reader_pages(PdfReader(pdf_path)))
+    if total_pages == 0:
+        return
+
+    # One contiguous range per worker so each process parses the file once
+    workers = max(1, min(workers, total_pages))
+    span = -(-total_pages // workers)
+    ranges = [(start, min(start + span, total_pages)) for start in range(0, total_pages, span)]
+
+    if len(ranges) == 1:
+        yield from enumerate(_iter_page_range(pdf_path, 0, total_pages, page_timeout))
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+        futures = [executor.submit(_extract_page_range, pdf_path, start, stop, page_timeout)
+                   for start, stop in ranges]
+        for future in _as_completed(futures, heartbeat):
+            start, texts = future.result()
+            yield from enumerate(texts, start)
+
+def iter_pdf_pages(pdf_path, mode=None, workers=None, page_timeout=None, heartbeat=None):
+    """Yield ``(page_index, raw_text)`` for every page of a PDF as it is extracted.
+
+    Pages arrive in completion order, not page order. ``mode`` is
+    ``'process'`` (a process pool where each worker extracts a contiguous page
+    range) or ``'thread'``. Missing arguments fall back to the
+    EBOOK_EXTRACTION_* settings. ``heartbeat()`` is called every
+    EXTRACTION_HEARTBEAT_SECONDS while waiting on the pool, so a caller
+    holding a job lease can renew it while a long page range is extracted.
+    """
+    mode = mode or getattr(settings, 'EBOOK_EXTRACTION_MODE', 'process')
+    workers = workers or getattr(settings, 'EBOOK_EXTRACTION_WORKERS', None) or os.cpu_count() or 4
+    if page_timeout is None:
+        page_timeout = getattr(settings, 'EBOOK_EXTRACTION_PAGE_TIMEOUT', 30)
+
+    if mode == 'thread':
+        return _extract_pages_threaded(pdf_path, workers, heartbeat)
+    if mode == 'process':
+        return _extract_pages_multiprocess(pdf_path, workers, page_timeout, heartbeat)
+    raise ValueError(f"Unknown extraction mode: {mode}")
+
+def in_page_order(pages):
+    """Reorder ``(page_index, text)`` pairs from iter_pdf_pages into page order.
+
+    Pages that arrive early are held until the pages before them are in.
+    """
+    waiting = {}
+    next_index = 0
+    for index, text in pages:
+        waiting[index] = text
+        while next_index in waiting:
+            yield next_index, waiting.pop(next_index)
+            next_index += 1
+    for index in sorted(waiting):
+        yield index, waiting[index]
+
+def extract_pdf_pages(pdf_path, mode=None, workers=None, page_timeout=None):
+    """Extract the raw text of every page of a PDF, in page order."""
+    page_texts = {}
+    for index, text in iter_pdf_pages(pdf_path, mode=mode, workers=workers, page_timeout=page_timeout):
+        page_texts[index] = text
+    return [page_texts[i] for i in range(len(page_texts))]
+
+def extraction_fingerprint(ebook):
+    """Fingerprint of everything that determines an ebook's stored page text."""
+    key = f"{ebook.pdf_sha256}:{EXTRACTOR_VERSION}:{CLEANER_VERSION}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def _ensure_pdf_hash(ebook):
+    if not ebook.pdf_sha256:
+        with ebook.pdf_file.open('rb') as f:
+            ebook.pdf_sha256 = sha256_of_file(f)
+        ebook.save(update_fields=['pdf_sha256'])
+
+def _stored_pages_are_current(ebook):
+    """Return the stored page count if it matches the current extraction fingerprint, else 0."""
+    if ebook.extraction_fingerprint != extraction_fingerprint(ebook):
+        return 0
+    return ebook.pages.count()
+
+def _page_source(ebook, heartbeat=None):
+    """Return ``(pages, from_cache)`` where ``pages`` yields ``(page_index, raw_text)``."""
+    pages = cached_pages(ebook.pdf_sha256, EXTRACTOR_VERSION)
+    if pages is not None:
+        return pages, True
+    pages = iter_pdf_pages(ebook.pdf_file.path, heartbeat=heartbeat)
+    return cache_pages(pages, ebook.pdf_sha256, EXTRACTOR_VERSION), False
+
+def store_pages(ebook, pages, batch_size=100):
+    """Clean and store ``(page_index, raw_text)`` pairs, yielding each EbookPage as it is cleaned.
+
+    Replaces the ebook's existing pages. Rows are bulk inserted in batches,
+    and the extraction fingerprint is recorded once the stream is exhausted;
+    it is cleared before the old pages go, so an interrupted run never
+    leaves partial pages that look current.
+    """
+    if ebook.extraction_fingerprint:
+        ebook.extraction_fingerprint = ""
+        ebook.save(update_fields=['extraction_fingerprint'])
+    ebook.pages.all().delete()
+    batch = []
+    for index, raw_text in pages:
+        cleaned = clean_text_for_tts(raw_text)
+        page = EbookPage(
+            ebook=ebook,
+            page_number=index + 1,
+            raw_text=raw_text,
+            cleaned_text=cleaned,
+            char_count=len(cleaned),
+        )
+        batch.append(page)
+        yield page
+        if len(batch) >= batch_size:
+            EbookPage.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        EbookPage.objects.bulk_create(batch)
+
+    # Pages replace the old single-blob storage
+    ebook.extracted_text = ""
+    ebook.extraction_fingerprint = extraction_fingerprint(ebook)
+    ebook.save(update_fields=['extracted_text', 'extraction_fingerprint'])
+
+def extract_text_from_pdf(ebook, batch_size=100):
+    """Extract the PDF into one EbookPage row per page.
+
+    Pages are cleaned and bulk inserted in batches as they come out of the
+    extractor, so memory stays flat and nothing is truncated. Identical PDFs
+    (by SHA-256) are served from the extraction cache without touching
+    PyPDF2. If the stored pages already match the current extraction
+    fingerprint nothing is done. Returns the number of pages stored.
+    """
+    try:
+        _ensure_pdf_hash(ebook)
+        page_count = _stored_pages_are_current(ebook)
+        if page_count:
+            logger.info(f"Extraction inputs unchanged for ebook {ebook.pk}, reusing {page_count} pages")
+            return page_count
+
+        pages, _ = _page_source(ebook)
+        return sum(1 for _ in store_pages(ebook, pages, batch_size))
+
     except Exception as e:
         logger.error(f"Error extracting PDF text: {e}")
         raise
 
+class JobCancelled(Exception):
+    """Raised from a Checkpoint to stop a run that is no longer wanted."""
+
+class LeaseLost(Exception):
+    """The job was reaped and possibly handed to another worker while this one was running it."""
+
+class Checkpoint:
+    """Hooks that let the caller of process_ebook keep a long run alive, resumable and cancellable.
+
+    ``heartbeat()`` is called between pages and between chunks (and
+    periodically while waiting on the extraction pool), and
+    ``check_cancelled()`` once more before the output is published; either
+    may raise JobCancelled, which stops the run without touching the ebook
+    or leaving partial output behind, or LeaseLost, which stops it without
+    writing anything further to the ebook. ``load(key)``
+    returns the state saved by an earlier attempt with the same resume key,
+    or None; ``save(key, state)`` is offered the current state (a zero-argument
+    callable returning a JSON-serializable dict) after each chunk and may call
+    it as rarely as it likes. This base class keeps nothing.
+    """
+
+    def heartbeat(self):
+        pass
+
+    def check_cancelled(self):
+        pass
+
+    def load(self, key):
+        return None
+
+    def save(self, key, state):
+        pass
+
+def process_ebook(ebook, voice_style='storytelling', accent='us', pipelined=None, checkpoint=None):
+    """Extract an ebook's text and narrate it.
+
+    In pipelined mode (``EBOOK_PIPELINE``, on by default) pages flow from the
+    extractor through cleaning and chunking into synthesis, and chunk audio is
+    appended to the output file as it completes, so narration of the first
+    pages overlaps extraction of the rest and memory is bounded by the queue
+    depths rather than the book. Pages that are already stored, or that come
+    from the extraction cache, are stored first since reading them is cheap.
+    Completed extraction is never repeated, and with a ``checkpoint`` a retried
+    run continues after the last saved chunk. Returns the number of pages.
+    """
+    if pipelined is None:
+        pipelined = getattr(settings, 'EBOOK_PIPELINE', True)
+    checkpoint = checkpoint or Checkpoint()
+    progress = ProgressReporter(ebook)
+
+    _ensure_pdf_hash(ebook)
+    page_count = _stored_pages_are_current(ebook)
+    if not page_count:
+        pages, from_cache = _page_source(ebook, heartbeat=checkpoint.heartbeat)
+        if pipelined and not from_cache:
+            return _process_pipelined(ebook, pages, voice_style, accent, checkpoint, progress)
+        total_pages = 0 if from_cache else _pdf_page_count(ebook)
+        progress.stage('extract')
+        for _ in store_pages(ebook, pages):
+            page_count += 1
+            if total_pages:
+                progress.update(page_count / total_pages)
+            checkpoint.heartbeat()
+
+    generate_audiobook(ebook, voice_style=voice_style, accent=accent, checkpoint=checkpoint, progress=progress)
+    return page_count
+
+def _pdf_page_count(ebook):
+    return len(_reader_pages(PdfReader(ebook.pdf_file.path)))
+
+def _process_pipelined(ebook, pages, voice_style, accent, checkpoint, progress):
+    total_pages = _pdf_page_count(ebook)
+    stored = {'pages': 0, 'chars': 0}
+
+    def texts():
+        for page in store_pages(ebook, in_page_order(pages)):
+            stored['pages'] += 1
+            stored['chars'] += page.char_count
+            checkpoint.heartbeat()
+            if page.char_count:
+                yield page.cleaned_text
+
+    def estimated_total_chars():
+        # Extrapolate from the pages seen so far until extraction finishes
+        return max(stored['chars'], stored['chars'] / max(1, stored['pages']) * total_pages)
+
+    # Extraction runs inside the synthesize stage here, so progress starts there
+    generate_audiobook(ebook, voice_style=voice_style, accent=accent, texts=texts(),
+                       total_chars=estimated_total_chars, checkpoint=checkpoint, progress=progress)
+    return stored['pages']
+
+def _resume_key(ebook, backend, voice_params):
+    """Identifies the chunk sequence and audio format, so saved progress is only reused when both match."""
+    params = json.dumps(voice_params, sort_keys=True)
+    key = f"{extraction_fingerprint(ebook)}:{backend.name}:{backend.audio_format}:{backend.max_chunk_chars}:{params}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+# Boundaries where PDF extraction glued words together: lower->Upper and
+# letter->digit get ". " inserted before the matched character, digit->letter
+# after it. The insertion positions are disjoint, so this is equivalent to the
+# original three passes. Each pattern starts with the (rare) character it
+# consumes rather than a lookbehind, which lets the regex engine skip ahead.
+_BREAK_BEFORE_RE = re.compile(r'[A-Z](?<=[a-z].)|\d(?<=[A-Za-z].)')
+_BREAK_AFTER_RE = re.compile(r'\d(?=[A-Za-z])')
+# "word Next" -> "word. Next". Only plain spaces are left by this point.
+_MISSING_PERIOD_RE = re.compile(r' (?<=[a-z] )(?= *[A-Z])')
+_TTS_SAFE_CHAR_RE = re.compile(r'[\w\s\.,!?;:\-\n]')
+
+class _TtsSafeTable(dict):
+    """str.translate table dropping characters TTS struggles with.
+
+    Filled lazily per code point from _TTS_SAFE_CHAR_RE, so it stays exact for
+    Unicode while costing one dict lookup per character after warm-up.
+    """
+    def __missing__(self, codepoint):
+        keep = _TTS_SAFE_CHAR_RE.match(chr(codepoint)) is not None
+        self[codepoint] = codepoint if keep else None
+        return self[codepoint]
+
+_TTS_SAFE_TABLE = _TtsSafeTable()
+
 def clean_text_for_tts(text):
     """Clean and optimize text for better TTS processing."""
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Fix common PDF extraction issues
-    text = re.sub(r'([a-z])([A-Z])', r'\1. \2', text)  # Add periods between sentences
-    text = re.sub(r'(\d)([A-Za-z])', r'\1. \2', text)  # Number to text
-    text = re.sub(r'([A-Za-z])(\d)', r'\1. \2', text)  # Text to number
-    
+    # Remove excessive whitespace (str.split uses the same whitespace set as \s).
+    # This also removes every newline, so no paragraph handling is needed later.
+    text = ' '.join(text.split())
+
+    # Fix common PDF extraction issues: "endOf" / "page7" / "7pages"
+    text = _BREAK_BEFORE_RE.sub(r'. \g<0>', text)
+    text = _BREAK_AFTER_RE.sub(r'\g<0>. ', text)
+
     # Remove special characters that TTS struggles with
-    text = re.sub(r'[^\w\s\.,!?;:\-\n]', '', text)
-    
-    # Fix line breaks
-    text = re.sub(r'\n\s*\n', '\n\n', text)  # Double line breaks for paragraphs
-    text = re.sub(r'\n(?!\n)', ' ', text)    # Single line breaks to spaces
-    
+    text = text.translate(_TTS_SAFE_TABLE)
+
     # Add proper sentence endings
-    text = re.sub(r'(?<=[a-z])(?=\s+[A-Z])', '.', text)
-    
-    return text.strip()
+    text = _MISSING_PERIOD_RE.sub('. ', text)
 
-def generate_timed_lyrics(text):
-    """Generate timed lyrics data from text."""
-    # Split text into sentences
-    sentences = re.split(r'[.!?]+', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
+    return text.strip()
 
+def iter_clean_text(texts):
+    """Clean a stream of texts (e.g. pages) one at a time."""
+    for text in texts:
+        yield clean_text_for_tts(text)
+
+def _iter_sentences(text):
+    """Split text (a string or an iterable of page texts) into sentences.
+
+    A sentence that runs across a page boundary is carried over and joined
+    with the start of the next page.
+    """
+    texts = [text] if isinstance(text, str) else text
+    pending = ""
+    for page_text in texts:
+        parts = re.split(r'[.!?]+', f"{pending} {page_text}" if pending else page_text)
+        pending = parts.pop()
+        for sentence in parts:
+            sentence = sentence.strip()
+            if sentence:
+                yield sentence
+    if pending.strip():
+        yield pending.strip()
+
+def _lyric_lines(text):
     # Combine sentences into lines of approximately 10-15 words each
     lyrics_lines = []
     current_line = ""
     target_words_per_line = 12
 
-    for sentence in sentences:
+    for sentence in _iter_sentences(text):
         words = sentence.split()
         if len(current_line.split()) + len(words) <= target_words_per_line:
             current_line += " " + sentence if current_line else sentence
@@ -112,6 +450,12 @@ def generate_timed_lyrics(text):
     if current_line:
         lyrics_lines.append(current_line.strip())
 
+    return lyrics_lines
+
+def generate_timed_lyrics(text):
+    """Generate timed lyrics data from text (a string or iterable of page texts)."""
+    lyrics_lines = _lyric_lines(text)
+
     lyrics = []
     current_time = 0.0
     words_per_minute = 80  # Further reduced speaking rate for better sync
@@ -132,26 +476,7 @@ def generate_timed_lyrics(text):
 
 def generate_timed_lyrics_based_on_duration(text, total_duration):
     """Generate timed lyrics data based on actual audio duration."""
-    # Split text into sentences
-    sentences = re.split(r'[.!?]+', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-
-    # Combine sentences into lines of approximately 10-15 words each
-    lyrics_lines = []
-    current_line = ""
-    target_words_per_line = 12
-
-    for sentence in sentences:
-        words = sentence.split()
-        if len(current_line.split()) + len(words) <= target_words_per_line:
-            current_line += " " + sentence if current_line else sentence
-        else:
-            if current_line:
-                lyrics_lines.append(current_line.strip())
-            current_line = sentence
-
-    if current_line:
-        lyrics_lines.append(current_line.strip())
+    lyrics_lines = _lyric_lines(text)
 
     # Distribute timing based on total duration
     if not lyrics_lines:
@@ -172,241 +497,483 @@ def generate_timed_lyrics_based_on_duration(text, total_duration):
 
     return lyrics
 
-def generate_audiobook(ebook, voice_style='storytelling', accent='us'):
-    """Generate high-quality TTS audio with customizable voice."""
-    text = ebook.extracted_text
-    if not text:
-        return
+def generate_timed_lyrics_from_timeline(text, timeline):
+    """Generate timed lyrics from the measured duration of each synthesized chunk.
 
-    try:
-        ebook.progress = 0
-        ebook.save()
-
-        # Voice configuration based on user preference
-        accent_tlds = {
-            'us': 'com',
-            'uk': 'co.uk',
-            'au': 'com.au',
-            'ca': 'ca',
-            'in': 'co.in',
-            'ie': 'ie',
-            'za': 'co.za',
-            'nz': 'co.nz'
-        }
-
-        voice_configs = {
-            'storytelling': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'com'),
-                'slow': False
-            },
-            'narration': {
-                'lang': 'en',
-                'tld': 'com',
-                'slow': False
-            },
-            'calm': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'co.uk'),
-                'slow': True
-            },
-            'energetic': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'com'),
-                'slow': False
-            },
-            'dramatic': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'com'),
-                'slow': False
-            },
-            'whisper': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'co.uk'),
-                'slow': True
-            },
-            'excited': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'com'),
-                'slow': False
-            },
-            'monotone': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'com'),
-                'slow': True
-            },
-            'formal': {
-                'lang': 'en',
-                'tld': accent_tlds.get(accent, 'co.uk'),
-                'slow': False
-            }
-        }
-
-        config = voice_configs.get(voice_style, voice_configs['storytelling'])
-
-        # Split text into chunks for better processing
-        chunks = split_text_into_chunks(text)
-        audio_segments = []
-
-        # Process each chunk
-        for i, chunk in enumerate(chunks):
-            try:
-                # Generate TTS for each chunk
-                tts = gTTS(
-                    text=chunk,
-                    lang=config['lang'],
-                    tld=config['tld'],
-                    slow=config['slow']
-                )
-
-                # Save to temporary buffer
-                buffer = BytesIO()
-                tts.write_to_fp(buffer)
-                buffer.seek(0)
-                audio_segments.append(buffer)
-
-                # Update progress
-                ebook.progress = int((i + 1) / len(chunks) * 50)  # 50% for TTS generation
-                ebook.save()
-
-                logger.info(f"Processed chunk {i+1}/{len(chunks)}")
-
-            except Exception as e:
-                logger.warning(f"Error processing chunk {i+1}: {e}")
-                continue
-
-        if not audio_segments:
-            raise Exception("No audio segments were generated")
-
-        # Combine audio segments
-        final_audio = combine_audio_segments(audio_segments)
-
-        # Update progress
-        ebook.progress = 90
-        ebook.save()
-
-        # Save final audio
-        audio_filename = f"{ebook.pk}_audiobook_{voice_style}.mp3"
-        audio_path = os.path.join(settings.MEDIA_ROOT, 'ebooks', 'audio', audio_filename)
-        os.makedirs(os.path.dirname(audio_path), exist_ok=True)
-
-        with open(audio_path, 'wb') as f:
-            f.write(final_audio.getvalue())
-
-        ebook.audio_file = f"ebooks/audio/{audio_filename}"
+    Each line starts where its first character falls on ``timeline`` (see
+    ChunkTimeline), so lines are never off by more than the chunk they are in.
+    """
+    lyrics = []
+    position = 0
+    for line in _lyric_lines(text):
+        lyrics.append({
+            'time': round(timeline.time_at(position), 2),
+            'text': line
+        })
+        position += spoken_weight(line)
+    return lyrics
 
-        # Generate timed lyrics based on actual audio duration
-        from moviepy import AudioFileClip
-        audio_clip = AudioFileClip(audio_path)
-        total_duration = audio_clip.duration
-        audio_clip.close()
+def _align_lyrics(ebook, audio_path, lyrics):
+    """Snap ``lyrics`` to the pauses in the audio (see ``alignment``), or return them unchanged if that fails."""
+    try:
+        start = time.monotonic()
+        aligned, pauses = align_lyrics(audio_path, lyrics)
+    except Exception as e:
+        logger.warning(f"Could not align lyrics of ebook {ebook.pk}: {e}")
+        return lyrics
+    logger.info(f"Aligned {len(lyrics)} lyric lines of ebook {ebook.pk} to {pauses} pauses "
+                f"in {time.monotonic() - start:.1f}s")
+    return aligned
+
+def generate_audiobook(ebook, voice_style='storytelling', accent='us', texts=None, total_chars=None,
+                       checkpoint=None, progress=None):
+    """Generate high-quality TTS audio with customizable voice.
+
+    ``texts`` streams cleaned page text into synthesis and defaults to the
+    stored pages. ``total_chars`` (a number, or a callable returning the
+    current estimate while ``texts`` is still being produced) drives progress.
+    ``checkpoint`` (see Checkpoint) receives heartbeats and the resume state,
+    and ``progress`` (a ProgressReporter) records the stage and percent.
+    """
+    if texts is None:
+        texts = ebook.iter_text()
+        total_chars = ebook.text_length()
+        if not total_chars:
+            return
+    checkpoint = checkpoint or Checkpoint()
+    progress = progress or ProgressReporter(ebook)
 
-        lyrics_data = generate_timed_lyrics_based_on_duration(text, total_duration)
-        ebook.lyrics = lyrics_data
+    try:
+        progress.stage('synthesize')
+
+        backend = get_backend()
+        voice_params = backend.voice_params(voice_style, accent)
+        # Rendered under a staging name, then published under its content hash (see publish_audio_version)
+        audio_dir = audio_version_dir(ebook.pk)
+        audio_path = os.path.join(audio_dir, f"{voice_style}.staged.mp3")
+        resume_key = _resume_key(ebook, backend, voice_params)
+        resume = checkpoint.load(resume_key)
+
+        # Stream the book page by page into TTS-sized chunks
+        chars_done = 0
+
+        def report_progress(chunk, audio):
+            nonlocal chars_done, completed
+            chars_done += len(chunk)
+            completed += 1
+            total = total_chars() if callable(total_chars) else total_chars
+            progress.update(chars_done / max(total, 1))
+            logger.debug(f"Processed chunk {completed} ({chars_done}/{int(total)} chars)")
+            checkpoint.heartbeat()
+
+        completed = 0
+        chunks = iter_text_chunks(texts, max_length=backend.max_chunk_chars)
+        synthesize = CachedSynthesizer(backend, voice_params)
+        # Where each chunk's audio starts, measured from its frames as it is appended; lyrics are timed from it
+        timeline = ChunkTimeline()
+        # Chunk audio is appended to the output file as it arrives, in order
+        with AudioAssembler(audio_path, resume=resume) as assembler:
+            if assembler.resumed:
+                # These chunks' audio is already in the partial file
+                durations = resume.get('durations', [])
+                for chunk in itertools.islice(chunks, resume['chunks']):
+                    timeline.append(chunk, durations[completed] if completed < len(durations) else None)
+                    chars_done += len(chunk)
+                    completed += 1
+                logger.info(f"Resuming ebook {ebook.pk} after chunk {completed}")
+
+            def state():
+                # Chunks complete out of order, so count the ones already in the file
+                return dict(assembler.state(), chunks=len(timeline), durations=timeline.durations)
+
+            for chunk, buffer in synthesize_chunks(chunks, synthesize, on_complete=report_progress):
+                timeline.append(chunk, assembler.append(buffer) if buffer is not None else 0.0)
+                if assembler.resumable:
+                    checkpoint.save(resume_key, state)
+
+            logger.info(f"Chunk audio cache for ebook {ebook.pk}: {synthesize.hits} hits, "
+                        f"{synthesize.misses} misses ({synthesize.hit_rate:.0%})")
+            if synthesize.audio_cache.enabled:
+                synthesize.audio_cache.evict()
+
+            if not assembler.segments:
+                raise Exception("No audio segments were generated")
+            checkpoint.check_cancelled()
+            progress.stage('combine')
+            total_duration = assembler.finish()
+
+        progress.stage('finalize')
+        audio_path = publish_audio_version(audio_path)
+        # Switch only now that the new version is complete; the old one stays servable for a grace period
+        ebook.audio_file = os.path.relpath(audio_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        ebook.audio_duration, ebook.audio_bitrate, ebook.audio_size = audio_metadata(audio_path, total_duration)
+
+        # Time the lyrics from the measured length of each chunk
+        timeline.fill(total_duration)
+        lyrics_data = generate_timed_lyrics_from_timeline(ebook.iter_text(), timeline)
+        if getattr(settings, 'EBOOK_LYRICS_ALIGN', False):
+            lyrics_data = _align_lyrics(ebook, audio_path, lyrics_data)
+        lyrics_fields = ebook.set_lyrics(lyrics_data)
 
         ebook.progress = 100
-        ebook.save()
+        ebook.save(update_fields=['audio_file', 'audio_duration', 'audio_bitrate', 'audio_size', *lyrics_fields, 'progress'])
 
         logger.info(f"Audio generated successfully for ebook {ebook.pk}, duration: {total_duration}s, lyrics: {len(lyrics_data)} lines")
+        prune_audio_versions(ebook_pk=ebook.pk)
 
+    except JobCancelled:
+        logger.info(f"Audio generation for ebook {ebook.pk} cancelled")
+        raise
+    except LeaseLost:
+        # The ebook's progress now belongs to whichever worker holds the job
+        raise
     except Exception as e:
-        ebook.progress = 0
-        ebook.save()
+        progress.reset()
         logger.error(f"Error generating audiobook: {e}")
         raise
 
 def split_text_into_chunks(text, max_length=4000):
     """Split text into optimal chunks for TTS processing."""
-    # Split by paragraphs first
-    paragraphs = text.split('\n\n')
-    chunks = []
-    current_chunk = ""
-    
-    for paragraph in paragraphs:
-        if len(current_chunk + paragraph) <= max_length:
-            current_chunk += paragraph + "\n\n"
+    return list(iter_text_chunks([text], max_length))
+
+def synthesize_chunks(chunks, synthesize, workers=None, on_complete=None):
+    """Synthesize chunks concurrently and yield ``(chunk, audio)`` in chunk order.
+
+    At most ``2 * workers`` chunks are in flight or waiting to be yielded, so
+    ``chunks`` may be a lazy stream. A chunk whose synthesis fails is logged and
+    yielded with ``audio=None``. ``on_complete(chunk, audio)`` is called in the
+    caller's thread as each chunk finishes, in completion order.
+    """
+    workers = workers or getattr(settings, 'EBOOK_TTS_WORKERS', 4)
+    chunk_iter = enumerate(chunks)
+    pending = {}
+    finished = {}
+    next_index = 0
+    exhausted = False
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            while not exhausted and len(pending) + len(finished) < 2 * workers:
+                try:
+                    index, chunk = next(chunk_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(synthesize, chunk)] = (index, chunk)
+
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index, chunk = pending.pop(future)
+                try:
+                    audio = future.result()
+                except Exception as e:
+                    logger.warning(f"Error processing chunk {index + 1}: {e}")
+                    audio = None
+                finished[index] = (chunk, audio)
+                if on_complete:
+                    on_complete(chunk, audio)
+
+            # Reassemble in chunk order
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+_PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+# Places to cut text that does not fit in one chunk, best first. Each separator
+# stays with the text before it, so sentence and clause punctuation is kept.
+_CHUNK_BOUNDARIES = (
+    ('\n\n',),
+    ('. ', '! ', '? ', '.\n', '!\n', '?\n'),
+    ('; ', ': ', ', ', ' - '),
+    (' ', '\n'),
+)
+
+def _best_cut(text, start, end):
+    """Index at which to end the chunk ``text[start:end]``.
+
+    Only the second half of the window is searched (with rfind, from the end),
+    so every character is scanned a bounded number of times and chunks never
+    come out shorter than half the limit unless the text runs out.
+    """
+    earliest = start + (end - start) // 2
+    for separators in _CHUNK_BOUNDARIES:
+        cut = max(text.rfind(sep, earliest, end) + len(sep) for sep in separators)
+        if cut > earliest:
+            return cut
+    return end  # no boundary at all: hard cut
+
+def iter_text_chunks(texts, max_length=4000):
+    """Chunk a stream of texts (e.g. pages) into pieces of at most ``max_length``.
+
+    Texts are split into paragraphs on blank lines, and consecutive texts are
+    separate paragraphs. Paragraphs are collected until they overflow a chunk,
+    then cut at the best boundary available (paragraph, sentence, clause,
+    word). Runs in linear time and buffers only about one chunk.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+
+    current = []
+    size = 0
+    for text in texts:
+        for paragraph in _PARAGRAPH_BREAK_RE.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+
+            size += len(paragraph) + (2 if current else 0)
+            current.append(paragraph)
+            if size <= max_length:
+                continue
+
+            buffer = '\n\n'.join(current)
+            start = 0
+            while len(buffer) - start > max_length:
+                cut = _best_cut(buffer, start, start + max_length)
+                chunk = buffer[start:cut].strip()
+                if chunk:
+                    yield chunk
+                start = cut
+
+            rest = buffer[start:].strip()
+            current, size = ([rest], len(rest)) if rest else ([], 0)
+
+    if current:
+        yield '\n\n'.join(current)
+
+class AudioAssembler:
+    """Build the final MP3 at ``output_path`` from segments appended in order.
+
+    MP3 segments that share a sample rate and channel layout (everything the
+    MP3 backends produce) are joined frame by frame as they arrive, without
+    decoding, and the duration comes from the frame count. If a segment does
+    not fit, the audio written so far and every later segment are kept in a
+    SegmentStore and re-encoded together with moviepy by ``finish()``. The
+    file is written next to ``output_path`` and renamed into place, so
+    readers never see a partial file. Use as a context manager so an
+    abandoned assembly leaves nothing behind.
+
+    With a ``resume`` dict from an earlier ``state()``, the partial file
+    left by that attempt is continued instead of being rewritten. Its
+    checkpointed prefix is copied into this assembly's own file, so an
+    earlier attempt that is still running (say, after losing its lease)
+    cannot write into or delete the file this one is building.
+    """
+
+    def __init__(self, output_path, resume=None):
+        self.output_path = output_path
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path), suffix='.part.mp3')
+        self.output = os.fdopen(fd, 'wb')
+        self.writer = mp3.FrameWriter(self.output)
+        self.fallback = None
+        self.segments = 0
+        self.resumed = bool(resume) and self._copy_partial(resume['path'], resume['bytes'])
+        if self.resumed:
+            self.writer.format = mp3.StreamFormat(*resume['format'])
+            self.writer.samples = resume['samples']
+            self.writer.segments = self.segments = resume['segments']
+
+    def _copy_partial(self, path, size):
+        """Copy the first ``size`` bytes of an earlier attempt's file, dropping anything written after its checkpoint."""
+        try:
+            with open(path, 'rb') as source:
+                remaining = size
+                while remaining:
+                    block = source.read(min(remaining, 1024 * 1024))
+                    if not block:
+                        break
+                    self.output.write(block)
+                    remaining -= len(block)
+        except FileNotFoundError:
+            remaining = size
+        if remaining:
+            self.output.seek(0)
+            self.output.truncate()
+            return False
+        # The earlier attempt no longer owns a checkpoint, so nobody resumes from its file again
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    @property
+    def resumable(self):
+        """True while the partial file can be continued from ``state()``."""
+        return self.fallback is None and self.writer.format is not None
+
+    def state(self):
+        """Flush the partial file and describe it for a later ``resume``."""
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        return {
+            'path': self.tmp_path,
+            'bytes': self.output.tell(),
+            'format': list(self.writer.format),
+            'samples': self.writer.samples,
+            'segments': self.segments,
+        }
+
+    def append(self, audio):
+        """Add the next segment; returns its duration in seconds, or None if that is only known after ``finish()``."""
+        self.segments += 1
+        if self.fallback is None:
+            try:
+                return self.writer.append(audio)
+            except mp3.Mp3FormatError as e:
+                logger.info(f"Segment {self.segments} cannot be joined without re-encoding: {e}")
+                self._start_fallback()
+        self.fallback.append(audio)
+        return None
+
+    def _start_fallback(self):
+        self.output.close()
+        self.fallback = SegmentStore()
+        if self.writer.segments:
+            self.fallback.adopt(self.tmp_path)
         else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = paragraph + "\n\n"
-    
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    
-    # If chunks are still too long, split by sentences
-    final_chunks = []
-    for chunk in chunks:
-        if len(chunk) <= max_length:
-            final_chunks.append(chunk)
+            os.unlink(self.tmp_path)
+
+    def finish(self):
+        """Publish the file at ``output_path`` and return its duration in seconds."""
+        if not self.segments:
+            raise ValueError("No audio segments to combine")
+        if self.fallback is None:
+            self.output.close()
+            duration = self.writer.duration
+            logger.info(f"Joined {self.segments} MP3 segments without re-encoding ({duration:.1f}s)")
         else:
-            sentences = re.split(r'[.!?]+', chunk)
-            temp_chunk = ""
-            for sentence in sentences:
-                if len(temp_chunk + sentence) <= max_length:
-                    temp_chunk += sentence + ". "
-                else:
-                    if temp_chunk:
-                        final_chunks.append(temp_chunk.strip())
-                    temp_chunk = sentence + ". "
-            if temp_chunk:
-                final_chunks.append(temp_chunk.strip())
-    
-    return [chunk for chunk in final_chunks if chunk.strip()]
-
-def combine_audio_segments(segments):
-    """Combine multiple audio segments into one using moviepy."""
-    if not segments:
-        return BytesIO()
-
-    if len(segments) == 1:
-        segments[0].seek(0)
-        return segments[0]
-
-    temp_files = []
-    clips = []
-
+            logger.info(f"Re-encoding {len(self.fallback)} audio segments with moviepy")
+            duration = _combine_audio_segments_moviepy(self.fallback, self.tmp_path)
+            self.fallback.close()
+        os.replace(self.tmp_path, self.output_path)
+        return duration
+
+    def close(self):
+        self.output.close()
+        if self.fallback is not None:
+            self.fallback.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def audio_metadata(path, duration=None):
+    """Return ``(duration, bitrate, size)`` for the MP3 at ``path``.
+
+    ``duration`` is in seconds and read from the frame headers unless given,
+    ``bitrate`` is the average in bits per second and ``size`` is in bytes.
+    """
+    size = os.path.getsize(path)
+    if duration is None:
+        with open(path, 'rb') as f:
+            duration = mp3.duration(f.read())
+    bitrate = round(size * 8 / duration) if duration else None
+    return duration, bitrate, size
+
+def audio_version_dir(ebook_pk):
+    return os.path.join(settings.MEDIA_ROOT, 'ebooks', 'audio', str(ebook_pk))
+
+def publish_audio_version(path):
+    """Rename a finished audio file to its content-addressed name in the same directory.
+
+    Returns the new path. The rename is atomic, and a version's bytes never
+    change once published, so its URL can be cached forever.
+    """
+    with open(path, 'rb') as f:
+        version = f"{sha256_of_file(f, chunk_size=64 * 1024)[:16]}.mp3"
+    published = os.path.join(os.path.dirname(path), version)
+    os.replace(path, published)
+    return published
+
+def prune_audio_versions(grace=None, ebook_pk=None, now=None):
+    """Delete audio versions that are no longer current, once they have been superseded for ``grace`` seconds.
+
+    A version is superseded when a newer one is published, so the grace
+    period is counted from the current version's modification time (or,
+    without one, from the newest version's). Versions of deleted ebooks go
+    straight away. Limited to one ebook with ``ebook_pk``. Returns the
+    number of files removed.
+    """
+    if grace is None:
+        grace = getattr(settings, 'EBOOK_AUDIO_VERSION_GRACE_SECONDS', 24 * 60 * 60)
+    now = now if now is not None else time.time()
+    root = os.path.join(settings.MEDIA_ROOT, 'ebooks', 'audio')
+    if ebook_pk is not None:
+        dirs = [str(ebook_pk)] if os.path.isdir(audio_version_dir(ebook_pk)) else []
+    else:
+        dirs = [entry.name for entry in os.scandir(root) if entry.is_dir() and entry.name.isdigit()] \
+            if os.path.isdir(root) else []
+    current = dict(Ebook.objects.filter(pk__in=[int(d) for d in dirs]).values_list('pk', 'audio_file'))
+
+    removed = 0
+    for name in dirs:
+        directory = os.path.join(root, name)
+        versions = {entry.name: entry.stat().st_mtime for entry in os.scandir(directory)
+                    if AUDIO_VERSION_RE.fullmatch(entry.name)}
+        if int(name) in current:
+            keep = os.path.basename(current[int(name)] or '')
+            superseded_at = versions.get(keep, max(versions.values(), default=now))
+            if now - superseded_at < grace:
+                continue
+        else:
+            keep = None
+        for version in versions:
+            if version != keep:
+                _remove_audio_version(os.path.join(directory, version))
+                removed += 1
+        if keep is None and not os.listdir(directory):
+            os.rmdir(directory)
+    if removed:
+        logger.info(f"Removed {removed} superseded audio versions")
+    return removed
+
+def _remove_audio_version(path):
     try:
-        logger.info(f"Combining {len(segments)} audio segments")
-        # Create temp files for each segment
-        for segment in segments:
-            segment.seek(0)
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                temp_file.write(segment.read())
-                temp_path = temp_file.name
-            temp_files.append(temp_path)
-            clips.append(AudioFileClip(temp_path, fps=24000))
-
-        logger.info(f"Loaded {len(clips)} clips")
-        # Concatenate clips
-        combined = concatenate_audioclips(clips)
-        logger.info("Concatenated clips")
-
-        # Export to temp file
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as output_file:
-            combined.write_audiofile(output_file.name, fps=24000, codec='mp3', bitrate='128k', verbose=False, logger=None)
-            output_path = output_file.name
-
-        logger.info("Wrote combined audio")
-        # Read back to BytesIO
-        with open(output_path, 'rb') as f:
-            output = BytesIO(f.read())
-
-        # Clean up temp files
-        for path in temp_files + [output_path]:
-            try:
-                os.unlink(path)
-            except:
-                pass
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
 
-        output.seek(0)
-        return output
+def combine_audio_segments(segments, output_path):
+    """Combine audio segments into one MP3 at ``output_path`` and return its duration."""
+    with AudioAssembler(output_path) as assembler:
+        for segment in segments:
+            assembler.append(segment)
+        return assembler.finish()
 
-    except Exception as e:
-        logger.error(f"Error combining audio segments: {e}")
-        # Clean up on error
-        for path in temp_files:
-            try:
-                os.unlink(path)
-            except:
-                pass
-        raise e
\ No newline at end of file
+def _combine_audio_segments_moviepy(segments, output_path):
+    """Decode the segments with moviepy and write them to ``output_path`` as one MP3."""
+    clips = []
+    with SegmentStore(memory_budget=0) as spilled:
+        if isinstance(segments, SegmentStore):
+            paths = list(segments.paths())
+        else:
+            for segment in segments:
+                spilled.append(segment)
+            paths = list(spilled.paths())
+
+        try:
+            logger.info(f"Combining {len(paths)} audio segments")
+            clips = [AudioFileClip(path, fps=24000) for path in paths]
+            combined = concatenate_audioclips(clips)
+            duration = combined.duration
+            combined.write_audiofile(output_path, fps=24000, codec='mp3', bitrate='128k', logger=None)
+            logger.info("Wrote combined audio")
+            return duration
+        except Exception as e:
+            logger.error(f"Error combining audio segments: {e}")
+            raise
+        finally:
+            for clip in clips:
+                clip.close()
\ No newline at end of file
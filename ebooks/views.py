@@ -1,56 +1,33 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
-from .models import Ebook
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.fields.files import FieldFile
+from django.utils.dateparse import parse_datetime
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from . import events, media
+from .lyrics import cached_index
+from .models import AUDIO_VERSION_RE, Ebook, EbookPage
 from .forms import EbookForm
-from .utils import extract_text_from_pdf, generate_audiobook, generate_timed_lyrics, generate_timed_lyrics_based_on_duration
-from moviepy import AudioFileClip
-import os
+from .jobs import cancel_jobs, enqueue, queue_position
+from .utils import prune_audio_versions
+import json
+import time
 from django.conf import settings
 import logging
-import threading
-import time
 
 logger = logging.getLogger(__name__)
 
-def process_ebook_background(ebook):
-    """Process ebook in background thread."""
-    print(f"Starting background processing for ebook {ebook.pk}")
-    try:
-        print("Extracting text...")
-        extract_text_from_pdf(ebook)
-        print(f"Text extracted: {len(ebook.extracted_text or '')} chars")
-        print("Generating audiobook...")
-        generate_audiobook(ebook, voice_style=ebook.voice_style, accent=ebook.accent)
-        if ebook.audio_file:
-            ebook.processing_status = 'completed'
-            print("Processing completed successfully")
-        else:
-            ebook.processing_status = 'failed'
-            print("Processing failed: no audio file")
-        ebook.save()
-        logger.info(f"Background processing completed for ebook {ebook.pk}")
-    except Exception as e:
-        ebook.processing_status = 'failed'
-        ebook.progress = 0
-        ebook.save()
-        print(f"Background processing failed for ebook {ebook.pk}: {e}")
-        logger.error(f"Background processing failed for ebook {ebook.pk}: {e}")
-
 def upload_ebook(request):
     if request.method == 'POST':
         form = EbookForm(request.POST, request.FILES, user=request.user if request.user.is_authenticated else None)
         if form.is_valid():
             try:
                 ebook = form.save()
-                ebook.processing_status = 'processing'
-                ebook.progress = 0
-                ebook.save()
-                
-                # Start background processing
-                thread = threading.Thread(target=process_ebook_background, args=(ebook,))
-                thread.daemon = True
-                thread.start()
+
+                # Queue for the background workers (manage.py run_workers)
+                enqueue(ebook)
                 
                 messages.success(request, f'Upload started! "{ebook.title}" is being processed with {ebook.get_voice_style_display()} voice.')
                 return redirect('ebook_detail', pk=ebook.pk)
@@ -64,43 +41,69 @@ def upload_ebook(request):
     
     return render(request, 'ebooks/upload.html', {'form': form})
 
+# Columns the library cards and the shared delete dialog render
+LIST_COLUMNS = ('pk', 'title', 'processing_status', 'upload_date', 'voice_style', 'pdf_file', 'audio_file')
+
+def _list_cursor(ebook):
+    return f"{ebook.upload_date.isoformat()},{ebook.pk}"
+
+def _parse_list_cursor(value):
+    try:
+        upload_date, pk = value.rsplit(',', 1)
+        upload_date = parse_datetime(upload_date)
+        return (upload_date, int(pk)) if upload_date else None
+    except (AttributeError, ValueError):
+        return None
+
+def _library_stats(ebooks):
+    return ebooks.aggregate(
+        total=Count('pk'),
+        completed=Count('pk', filter=Q(processing_status='completed')),
+        processing=Count('pk', filter=Q(processing_status='processing')),
+        with_audio=Count('pk', filter=Q(audio_file__gt='')),
+    )
+
 def ebook_list(request):
+    """Newest first, a page at a time.
+
+    Pages are keyed on ``(upload_date, id)``: ``?after=<cursor>`` continues
+    below the last book shown, so every page is an index range scan however
+    deep the user pages, instead of an OFFSET that re-reads every earlier row.
+    """
     if request.user.is_authenticated:
-        ebooks = Ebook.objects.filter(uploaded_by=request.user).order_by('-upload_date')
+        ebooks = Ebook.objects.filter(uploaded_by=request.user)
     else:
-        ebooks = Ebook.objects.all().order_by('-upload_date')
-    
-    return render(request, 'ebooks/list.html', {'ebooks': ebooks})
+        ebooks = Ebook.objects.all()
+
+    cursor = _parse_list_cursor(request.GET.get('after'))
+    # The counters read every book the user owns, so only the first page (which shows them) pays for them
+    stats = None if cursor else _library_stats(ebooks)
+    if cursor:
+        upload_date, pk = cursor
+        ebooks = ebooks.filter(Q(upload_date__lt=upload_date) | Q(upload_date=upload_date, pk__lt=pk))
+    page_size = getattr(settings, 'EBOOK_LIST_PAGE_SIZE', 24)
+    # Extracted text lives in EbookPage rows (or, for old books, extracted_text); the delete dialog mentions it
+    has_text = Q(Exists(EbookPage.objects.filter(ebook=OuterRef('pk')))) | Q(extracted_text__gt='')
+    page = list(ebooks.only(*LIST_COLUMNS).annotate(has_text=has_text).order_by('-upload_date', '-pk')[:page_size + 1])
+    next_cursor = _list_cursor(page[page_size - 1]) if len(page) > page_size else None
+
+    return render(request, 'ebooks/list.html', {
+        'ebooks': page[:page_size],
+        'stats': stats,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
+    })
 
 def ebook_detail(request, pk):
+    # The player fetches lyrics a window at a time (ebook_lyrics), so the page only needs to know there are some
+    ebooks = Ebook.objects.defer('lyrics').annotate(has_lyrics=Q(lyrics__0__isnull=False))
     if request.user.is_authenticated:
-        ebook = get_object_or_404(Ebook, pk=pk, uploaded_by=request.user)
+        ebook = get_object_or_404(ebooks, pk=pk, uploaded_by=request.user)
     else:
-        ebook = get_object_or_404(Ebook, pk=pk)
+        ebook = get_object_or_404(ebooks, pk=pk)
 
-    # Generate lyrics if they don't exist and we have extracted text, or regenerate if needed
-    if ebook.extracted_text and ebook.audio_file:
-        try:
-            # Get actual audio duration
-            audio_path = os.path.join(settings.MEDIA_ROOT, ebook.audio_file.name)
-            if os.path.exists(audio_path):
-                audio_clip = AudioFileClip(audio_path)
-                total_duration = audio_clip.duration
-                audio_clip.close()
-
-                lyrics_data = generate_timed_lyrics_based_on_duration(ebook.extracted_text, total_duration)
-                ebook.lyrics = lyrics_data
-                ebook.save()
-                logger.info(f"Generated/updated lyrics for ebook {ebook.pk}: {len(lyrics_data)} lines, duration: {total_duration}s")
-            else:
-                # Fallback to estimated timing
-                lyrics_data = generate_timed_lyrics(ebook.extracted_text)
-                ebook.lyrics = lyrics_data
-                ebook.save()
-                logger.info(f"Generated/updated lyrics (estimated) for ebook {ebook.pk}: {len(lyrics_data)} lines")
-        except Exception as e:
-            logger.error(f"Error generating lyrics for ebook {ebook.pk}: {e}")
-            # Don't fail the page load, just log the error
+    # Lyrics and audio details are computed once by the pipeline, so viewing never decodes audio or writes
+    has_text = ebook.text_length() > 0
 
     if request.method == 'POST' and 'regenerate' in request.POST:
         # Handle regeneration with new voice/accent
@@ -109,14 +112,10 @@ def ebook_detail(request, pk):
         if voice_style and accent:
             ebook.voice_style = voice_style
             ebook.accent = accent
-            ebook.processing_status = 'processing'
-            ebook.progress = 0
             ebook.save()
 
-            # Start background regeneration
-            thread = threading.Thread(target=process_ebook_background, args=(ebook,))
-            thread.daemon = True
-            thread.start()
+            # Queue background regeneration
+            enqueue(ebook)
 
             messages.success(request, f'Regenerating audio with {ebook.get_voice_style_display()} voice and {ebook.get_accent_display()} accent.')
             return redirect('ebook_detail', pk=ebook.pk)
@@ -143,16 +142,173 @@ def ebook_detail(request, pk):
     from .forms import RegenerateForm
     regenerate_form = RegenerateForm(initial={'voice_style': ebook.voice_style, 'accent': ebook.accent})
 
-    return render(request, 'ebooks/detail.html', {'ebook': ebook, 'regenerate_form': regenerate_form})
+    text_preview, text_truncated = ebook.text_preview() if has_text else ('', False)
 
-def check_processing_status(request, pk):
-    """AJAX endpoint to check processing status"""
-    ebook = get_object_or_404(Ebook, pk=pk)
-    return JsonResponse({
+    return render(request, 'ebooks/detail.html', {
+        'ebook': ebook,
+        'regenerate_form': regenerate_form,
+        'has_text': has_text,
+        'text_preview': text_preview,
+        'text_truncated': text_truncated,
+    })
+
+def _status_payload(ebook):
+    # Read the event first, so a change made while the rows are read shows up as a newer version
+    event = events.latest(ebook.pk)
+    job = ebook.jobs.order_by('-created_at', '-pk').first()
+    payload = {
         'status': ebook.processing_status,
         'has_audio': bool(ebook.audio_file),
-        'progress': ebook.progress
-    })
+        'progress': ebook.progress,
+        'stage': ebook.processing_stage,
+        'stage_display': ebook.get_processing_stage_display(),
+        'queue_position': queue_position(job) if job else None,
+        'version': 0,
+    }
+    # Progress is published on every change but written to the row only now and then
+    if event is not None:
+        payload.update(event)
+    return payload
+
+async def check_processing_status(request, pk):
+    """AJAX endpoint to check processing status (same access rules as ebook_detail).
+
+    With ``?since=<version>&wait=<seconds>`` this is a long poll: the response
+    is held until a progress event newer than ``since`` is published or the
+    wait (capped at EBOOK_PROGRESS_LONG_POLL_SECONDS) runs out. The page uses
+    it when the progress stream is unavailable. Holding a request only costs
+    a coroutine under ASGI (``myblog.asgi``); under WSGI it would tie up a
+    worker for the whole wait, so there the status is returned straight away
+    and the page falls back to polling every few seconds.
+    """
+    try:
+        since = int(request.GET['since'])
+        wait = min(float(request.GET.get('wait', 0)), getattr(settings, 'EBOOK_PROGRESS_LONG_POLL_SECONDS', 25))
+    except (KeyError, ValueError):
+        since, wait = None, 0
+
+    user = await request.auser()
+    if user.is_authenticated:
+        ebook = await aget_object_or_404(Ebook, pk=pk, uploaded_by=user)
+    else:
+        ebook = await aget_object_or_404(Ebook, pk=pk)
+    if wait > 0 and isinstance(request, ASGIRequest):
+        if await events.await_change(pk, since, wait) is not None:
+            await ebook.arefresh_from_db()
+    return JsonResponse(await sync_to_async(_status_payload)(ebook))
+
+def _sse(name, data, retry=None):
+    message = f"event: {name}\nid: {data['version']}\ndata: {json.dumps(data)}\n\n"
+    return f"retry: {retry}\n{message}" if retry else message
+
+async def _progress_events(ebook, payload):
+    """Yield SSE messages for ``payload`` and every progress event after it, until processing ends."""
+    keepalive = getattr(settings, 'EBOOK_PROGRESS_KEEPALIVE_SECONDS', 15)
+    # The browser reconnects on its own once a stream ends, so long streams are cut off
+    # rather than held open forever by idle tabs
+    deadline = time.monotonic() + getattr(settings, 'EBOOK_PROGRESS_STREAM_SECONDS', 300)
+    yield _sse('progress', payload, retry=1000)
+    seen_queue = await events.aqueue_version()
+    while payload['status'] == 'processing' and time.monotonic() < deadline:
+        event = await events.await_change(ebook.pk, payload['version'], keepalive)
+        if payload['queue_position'] is not None:
+            # Positions only move when jobs are queued or claimed; recount then
+            queue = await events.aqueue_version()
+            if queue != seen_queue:
+                seen_queue = queue
+                job = await ebook.jobs.order_by('-created_at', '-pk').afirst()
+                payload['queue_position'] = await sync_to_async(queue_position)(job) if job else None
+                event = event or {'version': payload['version']}
+        if event is None:
+            yield ': keepalive\n\n'
+            continue
+        payload.update(event)
+        if payload['stage']:
+            payload['queue_position'] = None
+        yield _sse('progress', payload)
+
+async def progress_stream(request, pk):
+    """Server-Sent Events stream of an ebook's processing progress.
+
+    Costs a few queries when the stream opens; after that it is fed by the
+    progress events the workers publish. Streaming needs an ASGI server
+    (``myblog.asgi``); under WSGI it answers 204, which tells EventSource not
+    to reconnect, and the page falls back to long-polling the status endpoint.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if user.is_authenticated:
+        ebook = await aget_object_or_404(Ebook, pk=pk, uploaded_by=user)
+    else:
+        ebook = await aget_object_or_404(Ebook, pk=pk)
+
+    payload = await sync_to_async(_status_payload)(ebook)
+    response = StreamingHttpResponse(_progress_events(ebook, payload), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
+
+# URL name -> file field served by ebook_media
+MEDIA_FIELDS = {
+    'pdf': 'pdf_file',
+    'audio': 'audio_file',
+    'background-animation': 'background_animation',
+    'background-voice': 'background_voice',
+}
+
+def ebook_media(request, pk, kind, version=None):
+    """Serve one of an ebook's files to whoever may view the ebook (same rules as ebook_detail).
+
+    Audio is also served by ``version`` (see Ebook.audio_url). Those URLs
+    always return the same bytes, so they are marked immutable, and a
+    superseded version stays available until it is pruned.
+    """
+    field = MEDIA_FIELDS.get(kind)
+    if field is None or request.method not in ('GET', 'HEAD'):
+        raise Http404("Unknown file")
+    ebooks = Ebook.objects.only('pk', 'uploaded_by', field)
+    if request.user.is_authenticated:
+        ebook = get_object_or_404(ebooks, pk=pk, uploaded_by=request.user)
+    else:
+        ebook = get_object_or_404(ebooks, pk=pk)
+    file = getattr(ebook, field)
+    if version is not None:
+        if kind != 'audio' or not AUDIO_VERSION_RE.fullmatch(version):
+            raise Http404("Unknown version")
+        name = f'ebooks/audio/{ebook.pk}/{version}'
+        if file.name != name:
+            file = FieldFile(ebook, file.field, name)
+        return media.serve(request, file, immutable=True)
+    if not file:
+        raise Http404("No such file")
+    return media.serve(request, file)
+
+def ebook_lyrics(request, pk):
+    """The lyric lines for a stretch of playback, for the player (same access rules as ebook_detail).
+
+    ``?start=&end=`` are playback times in milliseconds; ``end`` defaults to
+    EBOOK_LYRICS_WINDOW_SECONDS after ``start``. ``?before=`` adds that many
+    lines before the one playing at ``start``, for context after a seek. At
+    most EBOOK_LYRICS_WINDOW_MAX_LINES lines are returned (see LyricIndex.payload).
+    The index is cached per audio and lyrics version, so a window costs a
+    binary search and a slice rather than reading the whole book's lyrics.
+    """
+    # The lyrics themselves are only read when this process has no index of the current version
+    ebooks = Ebook.objects.only('pk', 'uploaded_by', 'audio_file', 'lyrics_version')
+    if request.user.is_authenticated:
+        ebook = get_object_or_404(ebooks, pk=pk, uploaded_by=request.user)
+    else:
+        ebook = get_object_or_404(ebooks, pk=pk)
+    try:
+        start = max(int(request.GET.get('start', 0)), 0)
+        end = int(request.GET.get('end', start + getattr(settings, 'EBOOK_LYRICS_WINDOW_SECONDS', 300) * 1000))
+        before = max(int(request.GET.get('before', 0)), 0)
+    except ValueError:
+        return JsonResponse({'error': 'start, end and before must be whole numbers'}, status=400)
+    index = cached_index((ebook.pk, ebook.audio_file.name, ebook.lyrics_version),
+                         lambda: Ebook.objects.filter(pk=ebook.pk).values_list('lyrics', flat=True).first())
+    return JsonResponse(index.payload(start, end, getattr(settings, 'EBOOK_LYRICS_WINDOW_MAX_LINES', 200), before))
 
 def delete_ebook(request, pk):
     """Delete entire ebook and all associated files"""
@@ -163,14 +319,21 @@ def delete_ebook(request, pk):
 
     if request.method == 'POST':
         title = ebook.title
+        # Stop queued and running conversions first so no worker writes files for a deleted book
+        cancel_jobs(ebook)
+        events.publish(ebook.pk, status='deleted')
+
         # Delete associated files
         if ebook.pdf_file:
             ebook.pdf_file.delete(save=False)
         if ebook.audio_file:
             ebook.audio_file.delete(save=False)
 
-        # Delete the ebook record
+        # Delete the ebook record, then every audio version still on disk (superseded ones
+        # would otherwise wait for prune_audio_versions) and the version directory
+        ebook_pk = ebook.pk
         ebook.delete()
+        prune_audio_versions(grace=0, ebook_pk=ebook_pk)
         messages.success(request, f'Ebook "{title}" and all associated files have been permanently deleted.')
 
     return redirect('ebook_list')
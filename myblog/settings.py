@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -131,3 +132,107 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# PDF text extraction
+# 'process' extracts contiguous page ranges in a process pool (PyPDF2 holds the GIL,
+# so threads give no speedup); 'thread' keeps the old thread-pool behaviour.
+EBOOK_EXTRACTION_MODE = 'process'
+EBOOK_EXTRACTION_WORKERS = None  # None = one worker per CPU
+EBOOK_EXTRACTION_PAGE_TIMEOUT = 30  # seconds per page; 0 disables the timeout
+
+# Hash PDFs while they stream in so identical uploads share one cached extraction
+FILE_UPLOAD_HANDLERS = [
+    'ebooks.uploadhandlers.HashingMemoryFileUploadHandler',
+    'ebooks.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
+# Defaults for `manage.py prune_extraction_cache`
+EBOOK_EXTRACTION_CACHE_MAX_ENTRIES = 1000
+EBOOK_EXTRACTION_CACHE_MAX_AGE_DAYS = 90
+
+# Number of TTS chunks synthesized concurrently (network-bound, so threads are fine)
+EBOOK_TTS_WORKERS = 4
+
+# Text-to-speech backend: 'gtts' (network), 'espeak' (offline engine) or 'fake'
+# (deterministic silence for tests and load testing), or a dotted path to a
+# ebooks.tts.TTSBackend subclass. Options are passed to the backend constructor.
+EBOOK_TTS_BACKEND = 'gtts'
+EBOOK_TTS_BACKEND_OPTIONS = {
+    'espeak': {'command': 'espeak-ng'},
+    'fake': {'latency': 0.0},
+}
+
+# On-disk cache of synthesized chunk audio (MEDIA_ROOT/cache/tts), evicted LRU after each job
+EBOOK_TTS_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 0 disables the cache
+
+# Synthesized chunk audio is kept in memory up to this many bytes per job, then
+# spilled to a temp dir (EBOOK_AUDIO_SPILL_DIR, default: the system temp dir)
+EBOOK_AUDIO_MEMORY_BUDGET = 32 * 1024 * 1024
+EBOOK_AUDIO_SPILL_DIR = None
+
+# Overlap PDF extraction with synthesis: chunks are narrated while later pages are still being extracted
+EBOOK_PIPELINE = True
+
+# Background jobs (manage.py run_workers): a job whose worker stops heartbeating for
+# EBOOK_JOB_LEASE_SECONDS is requeued, resuming from its last checkpoint, up to
+# EBOOK_JOB_MAX_ATTEMPTS times before it is marked failed
+EBOOK_JOB_LEASE_SECONDS = 300
+EBOOK_JOB_MAX_ATTEMPTS = 3
+# Fair scheduling: cap on jobs running at once across all workers (None = one per worker)
+# and per uploader, so one user's batch of large books cannot starve everyone else
+EBOOK_JOB_MAX_RUNNING = None
+EBOOK_JOB_MAX_RUNNING_PER_USER = 2
+# How often a running job checks whether it was cancelled (by a regenerate or delete)
+EBOOK_JOB_CANCEL_CHECK_SECONDS = 1
+
+# Progress is written to the database at most every EBOOK_PROGRESS_MIN_INTERVAL seconds,
+# or sooner once it has moved EBOOK_PROGRESS_MIN_STEP percentage points
+EBOOK_PROGRESS_MIN_INTERVAL = 2.0
+EBOOK_PROGRESS_MIN_STEP = 5
+
+# Progress events go from worker processes to the web processes streaming them, so they
+# need a cache both can see: file-based (in the system temp dir) works on one host, use Redis
+# or Memcached across hosts
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'progress': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'audio-ebooks-progress',
+    },
+}
+EBOOK_PROGRESS_CACHE = 'progress'
+# Progress streams (served by myblog.asgi) and long polls check for new events this often (seconds).
+# Streams close after EBOOK_PROGRESS_STREAM_SECONDS and the browser reconnects; long polls wait
+# at most EBOOK_PROGRESS_LONG_POLL_SECONDS (under ASGI only; under WSGI they answer at once)
+EBOOK_PROGRESS_STREAM_INTERVAL = 0.5
+EBOOK_PROGRESS_KEEPALIVE_SECONDS = 15
+EBOOK_PROGRESS_STREAM_SECONDS = 300
+EBOOK_PROGRESS_LONG_POLL_SECONDS = 25
+
+# Books per page in the library (ebook_list)
+EBOOK_LIST_PAGE_SIZE = 24
+
+# Let the front-end server send media files after ebooks.views.ebook_media has checked access:
+# None (Django streams them), 'x-accel-redirect' (nginx; an `internal` location at
+# EBOOK_MEDIA_ACCEL_PREFIX with `alias` MEDIA_ROOT) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+EBOOK_MEDIA_OFFLOAD = None
+EBOOK_MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Let CDNs and other shared caches keep versioned audio (Cache-Control: public, immutable).
+# The versioned URL then works for anyone who has it, without the access check
+EBOOK_MEDIA_SHARED_CACHE = False
+
+# Each audio render is published under its own content-hashed name. The version it replaced stays
+# servable (to players that are part-way through it) for this long before it is deleted
+EBOOK_AUDIO_VERSION_GRACE_SECONDS = 24 * 60 * 60
+
+# The player fetches lyrics in windows of this many seconds of playback, at most this many lines each
+EBOOK_LYRICS_WINDOW_SECONDS = 300
+EBOOK_LYRICS_WINDOW_MAX_LINES = 200
+
+# Snap each new audiobook's lyric times to the pauses in its audio (an extra ffmpeg decode of the
+# whole file; see ebooks.alignment). Existing audiobooks can be aligned with `manage.py align_lyrics`.
+# A line moves at most EBOOK_LYRICS_ALIGN_MAX_SHIFT seconds
+EBOOK_LYRICS_ALIGN = False
+EBOOK_LYRICS_ALIGN_MAX_SHIFT = 1.5
@@ -16,8 +16,6 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 from django.shortcuts import redirect
 
 def home_redirect(request):
@@ -29,6 +27,5 @@ urlpatterns = [
     path('ebooks/', include('ebooks.urls')),
 ]
 
-# Serve media files during development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Uploaded and generated files are served by ebooks.views.ebook_media, which checks access,
+# in development and production alike; MEDIA_URL is never routed directly